@@ -1,11 +1,28 @@
 FPGA_COMMAND_LIST = "pnputil /enum-devices /class USB /connected"
-FPGA_COMMAND_ENABLE = "pnputil /enable-device %s"
-FPGA_COMMAND_DISABLE = "pnputil /disable-device %s"
+FPGA_COMMAND_ENABLE = 'pnputil /enable-device "%s"'
+FPGA_COMMAND_DISABLE = 'pnputil /disable-device "%s"'
+FPGA_COMMAND_HOST = True  # run the commands on a long-lived shell instead of a new process each time
+FPGA_PARALLELISM = 8  # maximum number of boards enabled/disabled at the same time
+FPGA_COMMAND_STATUS = 'pnputil /enum-devices /instanceid "%s"'
+FPGA_COMMAND_RELATIONS = "pnputil /enum-devices /class USB /connected /relations"  # with the parent devices, to read the serial numbers
 FPGA_COMMAND_DISABLE_RETRY = 10
 FPGA_COMMAND_ENABLE_RETRY = 10
+FPGA_COMMAND_FATAL_CODES = [5, 87, 3010]  # access denied, invalid parameter, reboot required: retrying won't help
+FPGA_RETRY_DELAY = 0.2  # seconds after the first failed attempt, doubled after each one
+FPGA_RETRY_MAX_DELAY = 3.0
+FPGA_RETRY_DEADLINE = 30.0  # seconds, total for all the attempts
+FPGA_SETTLE_TIMEOUT = 10.0  # seconds waiting for a device to report its new state
 
 FPGA_DESCRIPTION = "USB Serial Converter A"
 
+# keys of the enumeration fields, in all supported languages
+FPGA_KEYS_ID = ["Instance ID", "Id. de instancia"]
+FPGA_KEYS_DESCRIPTION = ["Device Description", "Descripción del dispositivo"]
+FPGA_KEYS_STATUS = ["Status", "Estado"]
+FPGA_KEYS_PARENT = ["Parent", "Primario"]
+
+FPGA_ALIASES_FILE = "~/.fpga-device-tool/aliases.json"  # user names of the boards, by instance id
+
 FPGA_STATUS_DISABLED = ["Disabled", "Deshabilitado"]
 FPGA_STATUS_ENABLED = ["Started", "Iniciado"]
 
@@ -14,8 +31,81 @@ FPGA_STATUS_ENABLED = ["Started", "Iniciado"]
 VIVADO_PATH = "C:/Xilinx/Vivado*/*/bin/vivado*.bat"
 VIVADO_STARTUP_LOAD = True
 VIVADO_BITSTREAM_LOAD = True
+VIVADO_BITSTREAM_CACHE_FILE = "~/.fpga-device-tool/programmed.json"  # last bitstream programmed on each board
+
+VIVADO_STARTUP_TIMEOUT = 600  # seconds
+VIVADO_STANDBY = False  # keep a second Vivado launched, to replace the current one if it fails
+VIVADO_HEARTBEAT_INTERVAL = 30  # seconds between checks that Vivado is responsive (0 to disable)
+VIVADO_HEARTBEAT_TIMEOUT = 20  # seconds
+VIVADO_DAEMON = False  # keep Vivado running in the background between sessions of the tool
+VIVADO_DAEMON_FILE = "~/.fpga-device-tool/daemon.json"  # address of the running daemon
+VIVADO_DAEMON_IDLE = 3600  # seconds without any client before the daemon exits
+VIVADO_DAEMON_TIMEOUT = 30  # seconds, to connect to the daemon and for each of its responses
+VIVADO_DEVICE = "xc7z020*"  # pattern of the hardware device to program (part name)
+VIVADO_ACQUIRE_TIMEOUT = 60  # seconds, to reconnect to the target after switching boards
+VIVADO_OUTPUT_LINES = 2000  # last output lines kept in memory for diagnostics
+
+VIVADO_PROGRAM_BATCH = True  # program with a single command (retries performed by Vivado) instead of one for each step
 
 VIVADO_PROGRAM_RETRY = 10
+VIVADO_PROGRAM_TIMEOUT = 120  # seconds, for each attempt
+VIVADO_PROGRAM_RETRY_DELAY = 0.5  # seconds after the first failed attempt, doubled after each one
+VIVADO_PROGRAM_RETRY_MAX_DELAY = 4.0
+VIVADO_PROGRAM_RETRY_DEADLINE = 120.0  # seconds, total for all the attempts
+
+VIVADO_SESSIONS = 0  # additional Vivado sessions to program the boards with a unique JTAG serial concurrently (0 to disable)
+VIVADO_HW_SERVER_PORT = 3122  # port of the hw_server of the first additional session, the next ones use the following ports
+
+# --- #
+
+STAGING_PATH = "~/.fpga-device-tool/staging"  # local copies of the bitstreams
+STAGING_MAX_SIZE = 2_000_000_000  # bytes
+STAGING_WATCH_INTERVAL = 5  # seconds between checks for modified bitstreams
+
+# --- #
+
+PIPELINE_WORKERS = 4  # steps that don't need exclusive access to a board run concurrently
+
+# --- #
+
+TEST_COMMAND = ""  # run for each board after programming, {name} {id} and {index} are replaced (see testphase.py). Empty to disable
+TEST_TIMEOUT = 300  # seconds, for each board
+TEST_WORKERS = 16  # boards tested at the same time
+
+# --- #
+
+JOURNAL_FILE = "~/.fpga-device-tool/journal.jsonl"  # steps done by each programming run, to resume them
+JOURNAL_SYNC_INTERVAL = 1.0  # seconds, max time between syncs to disk
+JOURNAL_SYNC_RECORDS = 64  # max records between syncs to disk
+JOURNAL_HISTORY = 20  # summaries of completed runs kept
+
+# --- #
+
+TRACE_ENABLED = False  # record timed spans of the operations (see tracing.py)
+TRACE_BUFFER = 10000  # spans kept in memory
+TRACE_FILE = ""  # where to save the spans on exit: .json for Chrome trace events, json lines otherwise. Empty to disable
+METRICS_PORT = 0  # serve Prometheus metrics on localhost at this port (also enables the spans). 0 to disable
+
+# --- #
+
+AGENT_BIND = "127.0.0.1"  # address the agent listens on (see agent.py), "0.0.0.0" to accept coordinators from other PCs
+AGENT_PORT = 8731
+AGENT_TOKEN = ""  # shared secret between the agents and the coordinator. Empty to generate one when the agent starts
+AGENT_TIMEOUT = 30  # seconds, for each call to an agent
+AGENT_POLL_INTERVAL = 0.5  # seconds between progress updates of each agent
+AGENT_RETRY = 20  # attempts to reach an agent that stopped responding
+AGENT_RETRY_DELAY = 1.0  # seconds after the first failed attempt, doubled after each one
+AGENT_RETRY_MAX_DELAY = 10.0
+AGENT_RETRY_DEADLINE = 300.0  # seconds, total for all the attempts
+
+# --- #
+
+LOG_LEVEL = "INFO"  # of the console output, DEBUG to see every command sent and device found (see log.py)
+LOG_QUEUE_SIZE = 10000  # records waiting to be written, the next ones are dropped (and counted) until there is room
+LOG_FILE = "~/.fpga-device-tool/log.txt"  # empty to disable
+LOG_FILE_LEVEL = "INFO"  # DEBUG to keep the verbose output too (slower)
+LOG_FILE_MAX_BYTES = 5_000_000  # then it is rotated
+LOG_FILE_BACKUPS = 3  # rotated files kept
 
 # --- #
 
@@ -30,12 +120,21 @@ UI_REFRESH_TIMEOUT = 2000
 
 import sys
 
+
+def _bool(value):
+    # bool("False") would be true
+    if value.strip().lower() in ('true', '1', 'yes'): return True
+    if value.strip().lower() in ('false', '0', 'no', ''): return False
+    raise ValueError(f"Invalid boolean {value}")
+
+
 for _parameter in sys.argv[1:]:
+    if "=" not in _parameter: continue  # not a parameter
     try:
-        _key, _value = _parameter.split("=")
+        _key, _value = _parameter.split("=", 1)
         _current = locals()[_key]
         _type = type(_current)
-        _new = _type(_value)
+        _new = _bool(_value) if _type is bool else _type(_value)
         locals()[_key] = _new  # parse new value to same type
         print(f'Replaced {_key} from {repr(_current)} to {repr(_new)} (converted from "{_value}" as {_type})')
     except Exception:
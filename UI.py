@@ -3,7 +3,11 @@ from threading import Event
 
 import PySimpleGUI as sg
 
-from CONFIG import UI_THEME, UI_REFRESH_TIMEOUT
+import log
+from CONFIG import UI_THEME, UI_REFRESH_TIMEOUT, TEST_COMMAND
+from cancel import CancelException
+
+logger = log.get(__name__)
 
 INIT = "Initializing..."
 ICON_SIZE = 10
@@ -16,6 +20,7 @@ class UI:
         """
         self.waiting = Event()
         self.running = False
+        self.cancelled = Event()  # set when the running background process is cancelled
         self.current = 0
         self.total = 0
         self.steps_values = []
@@ -34,6 +39,10 @@ class UI:
                     sg.Button("Enable all", key='enableAll'),
                     sg.Button("Disable all", key='disableAll'),
                     sg.Button("Program all", key='programAll'),
+                    sg.Button("Resume", key='resumeAll', tooltip="Program all, except the boards completed by the last interrupted run with the same steps"),
+                    sg.Button("Test all", key='testAll', visible=bool(TEST_COMMAND)),
+                    sg.Button("Run queue", key='runQueue', tooltip="Program the boards queued with their steps, grouping the ones with the same bitstream"),
+                    sg.Button("Clear queue", key='clearQueue', tooltip="Remove the queued boards without programming them"),
                 ]]),
             ],
 
@@ -61,8 +70,18 @@ class UI:
                 sg.FileBrowse("Add bitstream", target='stepsBitstream', visible=is_vivado_available),
                 sg.Input(key='stepsBitstream', enable_events=True, visible=False),
             ],
+            [
+                sg.Checkbox("Once", False, key='stepsOnce', tooltip="Added pauses and scripts run once, instead of on each board"),
+                sg.Checkbox("Parallel", False, key='stepsParallel', tooltip="Added scripts don't use the board, and run while the next ones are programmed"),
+                sg.Checkbox("Force", False, key='force', tooltip="Program bitstreams even if the board already has them", visible=is_vivado_available),
+                sg.Checkbox("Test", False, key='test', tooltip="After programming, enable all the boards and test them", visible=bool(TEST_COMMAND)),
+            ],
         ])
         self.rows = 0
+        self.icons = []  # canvas item of each row icon
+        self.states = []  # rendered state of each visible row
+        self.counts = {True: 0, False: 0, None: 0}  # number of visible rows on each state
+        self.rendered = {}  # last rendered value of each element
         self.window = sg.Window(
             "FPGA device tool",
             [[boards_layout, program_layout]],
@@ -71,70 +90,93 @@ class UI:
 
         _, self.values = self.window.read(0)
 
-    def update(self, fpgas):
+    def update(self, fpgas, queued=()):
         """
-        Updates the UI with the current state and the given fpgas
+        Updates the UI with the current state, the given fpgas and the 'queued' jobs
+        Only the elements whose value changed since the last update are modified
         """
 
         # steps
         selection = self.get_steps_selection()
-        self.window['stepsUp'](disabled=selection is None or selection <= 0)
-        self.window['stepsRemove'](disabled=selection is None)
-        self.window['stepsDown'](disabled=selection is None or selection >= len(self.steps_values) - 1)
         canProgram = len(self.steps_values) > 0
-        self.window['stepsFrame'](f"Program steps: {len(self.steps_values)}")
-
-        # info
-        info = f"Boards: {len(fpgas)}"
-        enabled = {
-            True: 0,
-            False: 0,
-            None: 0,
-        }
-        for fpga in fpgas:
-            enabled[fpgas.enabled(fpga)] += 1
-        for label, type in (("enabled", True), ("disabled", False), ("waiting", None)):
-            if enabled[type] != 0:
-                info += f" ({enabled[type] if enabled[type] != len(fpgas) else 'all'} {label})"
-        self.window['info'].update(info)
-
-        # buttons
-        self.window['programAll'].update(disabled=not canProgram)
-        self.window['enableAll'].update(disabled=fpgas.allEnabled())
-        self.window['disableAll'].update(disabled=fpgas.allDisabled())
+        queuedBoards = {board for job in queued for board in job.boards}
+        self._render('stepsUp', selection is None or selection <= 0, lambda v: self.window['stepsUp'](disabled=v))
+        self._render('stepsRemove', selection is None, lambda v: self.window['stepsRemove'](disabled=v))
+        self._render('stepsDown', selection is None or selection >= len(self.steps_values) - 1, lambda v: self.window['stepsDown'](disabled=v))
+        self._render('stepsFrame', f"Program steps: {len(self.steps_values)}", lambda v: self.window['stepsFrame'](v))
 
         # foreach fpga
-        for i in fpgas:
+        for i, board in enumerate(fpgas):
             # create new row if needed
             if self.rows < i + 1:
                 self.window.extend_layout(self.window['boards'], [[sg.Column(
                     [[
                         sg.Canvas(size=(ICON_SIZE, ICON_SIZE), key=f'icon_{i}'),
                         sg.Text(key=f'text_{i}', expand_x=True),
+                        sg.Button("Rename", key=f'rename_{i}'),
                         sg.Button("Enable only", key=f'enableOnly_{i}'),
                         sg.Button("Toggle", key=f'toggle_{i}'),
                         sg.Button("Program", key=f'program_{i}'),
+                        sg.Button("Queue", key=f'queue_{i}', tooltip="Queue the current steps for this board, to run with 'Run queue' (again to unqueue it)"),
                     ]],
                     key=f'row_{i}',
                     expand_x=True,
                 )], ])
+                self.icons.append(self.window[f'icon_{i}'].tk_canvas.create_oval(2, 2, ICON_SIZE, ICON_SIZE))
                 self.rows += 1
 
             # show rows
-            self.window[f'row_{i}'].unhide_row()
+            self._render(f'row_{i}', True, lambda v: self.window[f'row_{i}'].unhide_row())
+
+            # update state (and counts)
+            enabled = fpgas.enabled(board)
+            if i == len(self.states):
+                self.states.append(enabled)
+                self.counts[enabled] += 1
+            elif self.states[i] != enabled:
+                self.counts[self.states[i]] -= 1
+                self.states[i] = enabled
+                self.counts[enabled] += 1
 
             # update row
-            self.window[f'icon_{i}'].tk_canvas.create_oval(2, 2, ICON_SIZE, ICON_SIZE, fill={True: 'green', False: 'red', None: 'orange'}[fpgas.enabled(i)])
-            self.window[f'text_{i}'].update(fpgas.name(i))
-            update_toltip(self.window[f'text_{i}'], fpgas.id(i))
-            self.window[f'toggle_{i}'].update("Disable" if fpgas.enabled(i) is True else "Enable", disabled=fpgas.enabled(i) is None)
-            self.window[f'program_{i}'].update(disabled=not canProgram)
-
-            self.window[f'row_{i}'].expand(True)  # fixes wrong size after updating
+            self._render(f'icon_{i}', enabled, lambda v: self.window[f'icon_{i}'].tk_canvas.itemconfig(self.icons[i], fill={True: 'green', False: 'red', None: 'orange'}[v]))
+            self._render(f'toggle_{i}', enabled, lambda v: self.window[f'toggle_{i}'].update("Disable" if v is True else "Enable", disabled=v is None))
+            self._render(f'program_{i}', canProgram, lambda v: self.window[f'program_{i}'].update(disabled=not v))
+            self._render(f'queue_{i}', (board in queuedBoards, canProgram), lambda v: self.window[f'queue_{i}'].update("Unqueue" if v[0] else "Queue", disabled=not any(v)))
+            self._render(f'tooltip_{i}', fpgas.id(board), lambda v: update_toltip(self.window[f'text_{i}'], v))
+            if self._render(f'text_{i}', fpgas.name(board), lambda v: self.window[f'text_{i}'].update(v)):
+                self.window[f'row_{i}'].expand(True)  # fixes wrong size after updating
 
         # hide unused
         for i in range(len(fpgas), self.rows):
-            self.window[f'row_{i}'].hide_row()
+            self._render(f'row_{i}', False, lambda v: self.window[f'row_{i}'].hide_row())
+        for enabled in self.states[len(fpgas):]:
+            self.counts[enabled] -= 1
+        del self.states[len(fpgas):]
+
+        # info
+        info = f"Boards: {len(fpgas)}"
+        for label, type in (("enabled", True), ("disabled", False), ("waiting", None)):
+            if self.counts[type] != 0:
+                info += f" ({self.counts[type] if self.counts[type] != len(fpgas) else 'all'} {label})"
+        self._render('info', info, lambda v: self.window['info'].update(v))
+
+        # buttons
+        self._render('programAll', canProgram, lambda v: self.window['programAll'].update(disabled=not v))
+        self._render('runQueue', len(queued), lambda v: self.window['runQueue'].update(f"Run queue ({v})", disabled=v == 0))
+        self._render('clearQueue', len(queued) == 0, lambda v: self.window['clearQueue'].update(disabled=v))
+        self._render('enableAll', self.counts[False] == 0, lambda v: self.window['enableAll'].update(disabled=v))
+        self._render('disableAll', self.counts[True] == 0, lambda v: self.window['disableAll'].update(disabled=v))
+
+    def _render(self, key, value, update):
+        """
+        Calls 'update(value)' only if 'value' differs from the last one rendered for 'key'
+        returns true iff it was called
+        """
+        if key in self.rendered and self.rendered[key] == value: return False
+        self.rendered[key] = value
+        update(value)
+        return True
 
     def is_shown(self):
         """
@@ -171,6 +213,7 @@ class UI:
             args, kwargs = self.values[event]
             self.running = self.running and sg.one_line_progress_meter(*args, **kwargs)
             if not self.running:
+                self.cancelled.set()
                 self.window.force_focus()
 
         elif event == 'popup':
@@ -179,6 +222,18 @@ class UI:
             sg.popup(*args, **kwargs)
             self.waiting.set()
 
+        elif event == 'notify':
+            # called from background process, show a message without waiting
+            sg.popup_notify(self.values[event], title="FPGA device tool")
+
+        elif event == 'table':
+            # called from background process, show a table
+            title, headings, rows = self.values[event]
+            sg.Window(title, [
+                [sg.Table(rows, headings, num_rows=min(len(rows), 20), auto_size_columns=True, justification='left', expand_x=True, expand_y=True)],
+                [sg.Button("OK")],
+            ], keep_on_top=True, resizable=True).read(close=True)
+
         elif event == 'finished':
             # finished background process, hide process and reenable
             self.running = False
@@ -192,13 +247,14 @@ class UI:
             if hasattr(self, splits[0]):
                 getattr(self, splits[0])(*splits[1:])
             else:
-                print("No function exists for event:", event)
+                logger.warning("No function exists for event: %s", event)
 
     def background(self, function, total):
         """
         Starts a background process
         """
         self.running = True
+        self.cancelled.clear()
         self.total = total
         self.current = 0
         self.window.disable()
@@ -219,7 +275,7 @@ class UI:
 
         # avoid closing if total was less than real
         if self.current >= self.total:
-            print("no more steps, increasing by 1")
+            logger.debug("no more steps, increasing by 1")
             self.total = self.current + 1
 
         # send event to main loop to process
@@ -242,16 +298,30 @@ class UI:
         ])
         self.waiting.wait()
 
+    def notify(self, message):
+        """
+        Shows a message to the user, without waiting
+        """
+        self.window.write_event_value('notify', message)
+
+    def table(self, title, headings, rows):
+        """
+        Shows a table to the user, without waiting
+        """
+        self.window.write_event_value('table', [title, headings, rows])
+
+    def ask(self, message, default=''):
+        """
+        Asks the user for a text, returns None if cancelled
+        """
+        return sg.popup_get_text(message, default_text=default, keep_on_top=True)
+
     def clear(self, key):
         # should be native, but it isn't
         self.window[key]('')
         self.values[key] = ''
 
 
-class CancelException(Exception):
-    pass
-
-
 def update_toltip(element, tooltip):
     if element.TooltipObject is None or tooltip != element.TooltipObject.text:
         element.set_tooltip(tooltip)
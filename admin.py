@@ -5,6 +5,10 @@ import ctypes
 import enum
 import sys
 
+import log
+
+logger = log.get(__name__)
+
 
 # Reference:
 # msdn.microsoft.com/en-us/library/windows/desktop/bb762153(v=vs.85).aspx
@@ -46,7 +50,7 @@ def run_as_admin(main):
         if ctypes.windll.shell32.IsUserAnAdmin():
             main()
         else:
-            print("Asking for administrator permissions...")
+            logger.info("Asking for administrator permissions...")
             params = sys.argv if sys.executable != sys.argv[0] else sys.argv[1:]
             hinstance = ctypes.windll.shell32.ShellExecuteW(
                 None, 'runas', sys.executable, " ".join([f'"{param}"' for param in params]), None, SW.SHOWNORMAL
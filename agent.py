@@ -0,0 +1,291 @@
+"""
+Headless agent, to drive the boards of this PC from a coordinator on another one (see coordinator.py).
+It serves a small JSON-RPC 2.0 API over http (POST /rpc), authenticated with AGENT_TOKEN as a bearer token:
+    ping() -> {host, boards, generation, job}, 'generation' increases each time boards are connected or disconnected
+    list() -> [{index, board, name, enabled, status}]
+    enable(boards=None) / disable(boards=None) / only(board) -> [{event, board, name, success, error}]
+    missing(files) -> the sha256 of 'files' ({sha256: name}) not stored in this agent yet
+    put(name, content) -> stores a step file (base64 content), returns its sha256
+    run(steps, boards=None, force=False, test=False, resume=False) -> job id, runs the steps in the background
+    status(job, since=0) -> {state, events, error}, state is 'running', 'done', 'failed' or 'cancelled'
+    cancel(job)
+Steps are objects like the ones of a steps file, with the sha256 of their file instead of its path.
+Boards are selected like in the command line (positions, names or ids).
+$> python cli.py agent [AGENT_BIND=0.0.0.0] [AGENT_PORT=8731] [AGENT_TOKEN=secret]
+"""
+import base64
+import hashlib
+import json
+import os
+import secrets
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from uuid import uuid4
+
+import log
+import pipeline
+import planner
+from CONFIG import AGENT_BIND, AGENT_PORT, AGENT_TOKEN, AGENT_TIMEOUT, STAGING_PATH
+from bitcache import BitstreamCache
+from cancel import CancelException
+from cli import select
+from fpgas import FPGAs
+from journal import Journal
+from runner import Runner
+from sessions import Sessions
+from staging import Staging
+from vivado import Vivado
+
+logger = log.get(__name__)
+
+# json-rpc error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+BUSY = -32001
+UNAUTHORIZED = -32002
+UNKNOWN_JOB = -32003
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        """
+        Error returned to (or received from) the other side
+        """
+        super().__init__(message)
+        self.code = code
+
+
+class Job:
+    def __init__(self):
+        # a run of steps in the background
+        self.id = uuid4().hex[:12]
+        self.state = 'running'
+        self.events = []
+        self.error = None
+
+
+class Agent:
+    def __init__(self):
+        """
+        Owns the boards of this PC, one operation or job at a time
+        """
+        self.fpgas = FPGAs()
+        self.vivado = Vivado()
+        self.staging = Staging()
+        self.journal = Journal()
+        self.sessions = Sessions()
+        self.runner = Runner(self.vivado, self.fpgas, BitstreamCache(), self.staging, self.journal, self.sessions)
+        self.runner.step = lambda message: self._event({'event': 'progress', 'message': message})
+        self.runner.wait = lambda message: None  # nobody to wait for
+        self.runner.report = self._event
+        self.files = os.path.join(os.path.expanduser(STAGING_PATH), 'received')
+        self.jobs = {}
+        self.job = None  # the running one
+        self._lock = Lock()
+
+    def _event(self, event):
+        # keeps the events of the running job
+        job = self.job
+        if job is not None: job.events.append(event)
+
+    def _exclusive(self):
+        # fails if a job is running
+        job = self.job
+        if job is not None:
+            raise RPCError(BUSY, f"Job {job.id} is running")
+
+    # methods
+
+    def ping(self):
+        job = self.job
+        return {'host': socket.gethostname(), 'boards': len(self.fpgas), 'generation': self.fpgas.generation, 'job': job.id if job is not None else None}
+
+    def list(self):
+        with self._lock:
+            self._exclusive()
+            self.fpgas.update()
+            return [{'index': index + 1, 'board': board, 'name': self.fpgas.name(board), 'enabled': self.fpgas.enabled(board), 'status': self.fpgas.fpgas[board].status} for index, board in enumerate(self.fpgas)]
+
+    def enable(self, boards=None):
+        return self._change(lambda states, selected: {board: True for board in selected}, boards)
+
+    def disable(self, boards=None):
+        return self._change(lambda states, selected: {board: False for board in selected}, boards)
+
+    def only(self, board):
+        return self._change(lambda states, selected: planner.only(states, selected[0]), board)
+
+    def _change(self, desired, boards):
+        # enables/disables boards, returns the results
+        with self._lock:
+            self._exclusive()
+            self.fpgas.update()
+            states = self.fpgas.get_state()
+            results = self.runner.execute(planner.plan(states, desired(states, self._select(boards))))
+            return [{'event': result.operation, 'board': result.board, 'name': self.fpgas.name(result.board), 'success': result.success, 'error': None if result.error is None else str(result.error)} for result in results]
+
+    def missing(self, files):
+        return [sha256 for sha256, name in files.items() if not os.path.isfile(self._path(sha256, name))]
+
+    def put(self, name, content):
+        data = base64.b64decode(content)
+        sha256 = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.files, exist_ok=True)
+        temporal = self._path(sha256, name) + '.tmp'
+        with open(temporal, 'wb') as file:
+            file.write(data)
+        os.chmod(temporal, 0o755)  # scripts
+        os.replace(temporal, self._path(sha256, name))
+        return sha256
+
+    def run(self, steps, boards=None, force=False, test=False, resume=False):
+        with self._lock:
+            self._exclusive()
+            self.fpgas.update()
+            steps = [pipeline.step(step['command'], self._file(step), step.get('scope', pipeline.BOARD), step.get('exclusive', True)) for step in steps]
+            function, _ = self.runner.program_all(steps, self._select(boards), force, test, resume)
+            job = self.job = Job()
+            self.jobs[job.id] = job
+            self.runner.cancelled.clear()
+
+        def background():
+            try:
+                function()
+                job.state = 'done'
+            except CancelException:
+                job.state = 'cancelled'
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = 'failed'
+            finally:
+                self.job = None  # the next events are not part of it
+
+        Thread(target=background, name=f"job {job.id}", daemon=True).start()
+        return job.id
+
+    def status(self, job, since=0):
+        if job not in self.jobs: raise RPCError(UNKNOWN_JOB, f"Unknown job {job}")
+        job = self.jobs[job]
+        return {'state': job.state, 'events': job.events[since:], 'error': job.error}
+
+    def cancel(self, job):
+        if job not in self.jobs: raise RPCError(UNKNOWN_JOB, f"Unknown job {job}")
+        if self.jobs[job].state == 'running': self.runner.cancelled.set()
+
+    # utils
+
+    def _select(self, boards):
+        try:
+            return select(self.fpgas, boards)
+        except LookupError as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+
+    def _path(self, sha256, name):
+        return os.path.join(self.files, sha256 + os.path.splitext(name)[1])
+
+    def _file(self, step):
+        # local path of the file of a step
+        if step.get('sha256') is None: return step.get('parameter')
+        path = self._path(step['sha256'], step.get('parameter') or '')
+        if not os.path.isfile(path): raise RPCError(INVALID_PARAMS, f"Missing file {step['sha256']}, put it first")
+        return path
+
+    def close(self):
+        self.staging.close()
+        self.journal.close()
+        self.fpgas.close()
+        self.sessions.close()
+        self.vivado.close(keep_daemon=True)
+
+
+METHODS = ['ping', 'list', 'enable', 'disable', 'only', 'missing', 'put', 'run', 'status', 'cancel']
+
+
+def _handler(agent, token):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request_id = None
+            try:
+                if self.path != '/rpc': raise RPCError(METHOD_NOT_FOUND, f"Unknown path {self.path}")
+                if not secrets.compare_digest(self.headers.get('Authorization', ''), f"Bearer {token}"):
+                    raise RPCError(UNAUTHORIZED, "Invalid token")
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError as e:
+                    raise RPCError(PARSE_ERROR, str(e))
+                request_id = request.get('id')
+                method, params = request.get('method'), request.get('params') or {}
+                if method not in METHODS: raise RPCError(METHOD_NOT_FOUND, f"Unknown method {method}")
+                try:
+                    response = {'result': getattr(agent, method)(**params)}
+                except TypeError as e:
+                    raise RPCError(INVALID_PARAMS, str(e))
+            except RPCError as e:
+                response = {'error': {'code': e.code, 'message': str(e)}}
+            except Exception as e:
+                response = {'error': {'code': SERVER_ERROR, 'message': f"{type(e).__name__}: {e}"}}
+
+            body = json.dumps({'jsonrpc': '2.0', 'id': request_id, **response}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # not logged
+
+    return Handler
+
+
+def serve(bind=AGENT_BIND, port=AGENT_PORT, token=AGENT_TOKEN):
+    """
+    Serves the boards of this PC until interrupted
+    """
+    if not token:
+        token = secrets.token_hex(16)
+        logger.warning("No AGENT_TOKEN set, using %s", token)
+    agent = Agent()
+    server = ThreadingHTTPServer((bind, port), _handler(agent, token))
+    logger.info("Agent %s listening on %s:%d", socket.gethostname(), bind, server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        agent.close()
+
+
+class Client:
+    def __init__(self, address, token=AGENT_TOKEN, timeout=AGENT_TIMEOUT):
+        """
+        Connection to an agent at 'address' (host:port)
+        """
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+        self._ids = 0
+
+    def call(self, method, **params):
+        """
+        Calls a method of the agent, returns its result
+        Raises RPCError if the agent returns an error, OSError if it can't be reached
+        """
+        from http.client import HTTPConnection
+
+        self._ids += 1
+        host, _, port = self.address.rpartition(':')
+        connection = HTTPConnection(host, int(port), timeout=self.timeout)
+        try:
+            connection.request('POST', '/rpc', json.dumps({'jsonrpc': '2.0', 'id': self._ids, 'method': method, 'params': params}),
+                               {'Content-Type': 'application/json', 'Authorization': f"Bearer {self.token}"})
+            response = json.loads(connection.getresponse().read())
+        except ValueError as e:
+            raise OSError(f"Invalid response from {self.address}: {e}")
+        finally:
+            connection.close()
+        if 'error' in response:
+            raise RPCError(response['error']['code'], response['error']['message'])
+        return response['result']
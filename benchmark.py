@@ -0,0 +1,313 @@
+"""
+Benchmarks of the performance-sensitive parts of the tool
+$> python benchmark.py [parser]
+the enumeration parser, runnable on any platform
+$> python benchmark.py logging
+the time the calling thread spends on each output line, with print or the logger (run it in the usual console)
+$> python benchmark.py e2e [--sizes 1,8,64] [--operations programAll,enableAll] [--compare benchmarks/old.json] [KEY=VALUE ...]
+the command line operations end to end, on the simulated hardware (see simulator.py, Linux only) for each number of boards.
+Reports the wall time, processes launched and retries, and saves them as json (benchmarks/<version>.json by default)
+to compare them between versions. KEY=VALUE parameters are passed to the tool, the simulator options to the simulator.
+$> python benchmark.py ui [--cycles 5000]
+soak test of the board list: refreshes the interface with changing fake boards, the memory and the canvas items must stay
+flat (exit code 1 otherwise). Needs a display.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+from CONFIG import FPGA_DESCRIPTION
+from jobs import Job
+from pnputil import parse
+
+
+def synthetic_enumeration(devices, boards=0.1):
+    """
+    Returns a synthetic pnputil enumeration output with the given number of devices,
+    a 'boards' ratio of them being fpgas (half enabled, half disabled)
+    """
+    every = max(1, round(1 / boards)) if boards else None
+    blocks = ["Microsoft PnP Utility\n\n"]
+    for i in range(devices):
+        board = every is not None and i % every == 0
+        blocks.append(
+            f"Instance ID:                USB\\VID_{'0403&PID_6010&MI_00' if board else '8087&PID_0A2B'}\\6&{i:08X}&0&0000\n"
+            f"Device Description:         {FPGA_DESCRIPTION if board else 'Generic USB Hub'}\n"
+            f"Class Name:                 USB\n"
+            f"Class GUID:                 {{36fc9e60-c465-11cf-8056-444553540000}}\n"
+            f"Manufacturer Name:          {'FTDI' if board else '(Standard USB Host Controller)'}\n"
+            f"Status:                     {'Disabled' if i % 2 else 'Started'}\n"
+            f"Driver Name:                usb.inf\n"
+            f"\n"
+        )
+    return "".join(blocks)
+
+
+def bench_parser(sizes=(10, 1000, 50000), repeat=5):
+    """
+    Measures the enumeration parser throughput and allocations for outputs of several sizes
+    """
+    print(f"{'devices':>8} {'boards':>7} {'best ms':>9} {'devices/s':>12} {'MB/s':>8} {'peak KiB':>9}")
+    for size in sizes:
+        output = synthetic_enumeration(size)
+        lines = output.splitlines(keepends=True)
+
+        # time (best of)
+        best = float('inf')
+        for _ in range(repeat):
+            start = perf_counter()
+            boards = sum(1 for _ in parse(iter(lines), FPGA_DESCRIPTION))
+            best = min(best, perf_counter() - start)
+
+        # allocations
+        tracemalloc.start()
+        for _ in parse(iter(lines), FPGA_DESCRIPTION): pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{size:>8} {boards:>7} {best * 1000:>9.2f} {size / best:>12.0f} {len(output) / best / 1e6:>8.1f} {peak / 1024:>9.1f}")
+
+
+def bench_logging(lines=5000):
+    """
+    Measures the time spent by the calling thread on each line: written with print (as before the logger),
+    and with the logger at DEBUG (the verbose output, not written at INFO) and at INFO (written in the background)
+    The lines are written to the console, the results are shown at the end
+    """
+    import logging
+    import log
+
+    logger = log.get('benchmark')
+    line = 'Running: fdt_program $hw_device "C:/designs/design.bit" 10 500 4000'
+    measures = {}
+    for name, write in (('print', lambda: print(line)), ('logger DEBUG', lambda: logger.debug(line)), ('logger INFO', lambda: logger.info(line))):
+        start = perf_counter()
+        for _ in range(lines):
+            write()
+        measures[name] = perf_counter() - start
+        log.flush()
+
+    print(f"\nConsole at {logging.getLevelName(log.LOG_LEVEL) if isinstance(log.LOG_LEVEL, int) else log.LOG_LEVEL}, {lines} lines each")
+    print(f"{'output':>13} {'us/line':>9}")
+    for name, elapsed in measures.items():
+        print(f"{name:>13} {elapsed / lines * 1e6:>9.1f}")
+
+
+class FakeFpgas:
+    """
+    Boards for the interface, with the methods it uses, that change on each cycle
+    """
+
+    def __init__(self, boards):
+        self.boards = [f"USB\\VID_0403&PID_6010&MI_00\\6&{i:08X}&0&0000" for i in range(boards)]
+        self.states = {board: True for board in self.boards}
+        self.count = boards
+
+    def cycle(self, index):
+        # changes some states, and connects or disconnects a board from time to time
+        for position, board in enumerate(self.boards):
+            if (index + position) % 7 == 0: self.states[board] = (True, False, None)[(index + position) % 3]
+        if index % 50 == 0: self.count = len(self.boards) - (index // 50) % 3
+
+    def __iter__(self):
+        return iter(self.boards[:self.count])
+
+    def __len__(self):
+        return self.count
+
+    def enabled(self, board):
+        return self.states[board]
+
+    def id(self, board):
+        return board
+
+    def name(self, board):
+        return board.split('&')[-3]
+
+    def queued(self, index):
+        # jobs queued for some of the boards
+        return [Job(position, [], [board], 0, False) for position, board in enumerate(self.boards[:index % 5])]
+
+
+def bench_ui(cycles=5000, boards=16, samples=10):
+    """
+    Refreshes the interface 'cycles' times with changing boards, measuring the memory (tracemalloc) and canvas items
+    Returns true iff both stay flat after the first sample (the rows are created by then)
+    """
+    from UI import UI
+
+    ui = UI(True)
+    fpgas = FakeFpgas(boards)
+    every = max(1, cycles // samples)
+    measures = []
+    tracemalloc.start()
+    print(f"{'cycle':>7} {'memory KiB':>11} {'canvas items':>13} {'ms/update':>10}")
+    start = perf_counter()
+    for index in range(1, cycles + 1):
+        fpgas.cycle(index)
+        ui.update(fpgas, fpgas.queued(index))
+        ui.window.read(0)
+        if index % every == 0:
+            memory, _ = tracemalloc.get_traced_memory()
+            items = sum(len(ui.window[f'icon_{i}'].tk_canvas.find_all()) for i in range(ui.rows))
+            measures.append((memory, items))
+            print(f"{index:>7} {memory / 1024:>11.1f} {items:>13} {(perf_counter() - start) / every * 1000:>10.3f}", flush=True)
+            start = perf_counter()
+    tracemalloc.stop()
+    ui.window.close()
+
+    (memory, items), rest = measures[0], measures[1:]
+    flat = all(other_items == items for _, other_items in rest) and all(other_memory <= memory * 1.1 + 64 * 1024 for other_memory, _ in rest)
+    print("Flat" if flat else "Growing")
+    return flat
+
+
+# command line arguments of each operation ({bit} is replaced by a bitstream), and the initial state of the boards
+OPERATIONS = {
+    'list': (['list'], True),
+    'enableAll': (['enable'], False),
+    'disableAll': (['disable'], True),
+    'only': (['only', '1'], True),
+    'program': (['program', '--bit', '{bit}', '--boards', '1', '--force'], True),
+    'programAll': (['program', '--bit', '{bit}', '--force'], True),
+    'programAgain': (['program', '--bit', '{bit}'], True),  # all already programmed, skipped
+}
+
+
+def run_operation(operation, boards, settings, parameters=()):
+    """
+    Runs an operation of the command line on 'boards' simulated boards (with the given simulator settings)
+    Returns its measures
+    """
+    from simulator import Simulator
+
+    arguments, enabled = OPERATIONS[operation]
+    with tempfile.TemporaryDirectory(prefix="fdt-benchmark-") as directory:
+        simulator = Simulator(os.path.join(directory, 'simulator'), **{**settings, 'boards': boards, 'enabled': enabled})
+        bitstream = os.path.join(directory, 'design.bit')
+        with open(bitstream, 'wb') as file:
+            file.write(os.urandom(4096))
+        environment = simulator.environment()
+        environment['HOME'] = environment['USERPROFILE'] = os.path.join(directory, 'home')  # no previous state
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py'), *(argument.format(bit=bitstream) for argument in arguments), *simulator.parameters(), *parameters]
+
+        if operation == 'programAgain':
+            subprocess.run(command + ['--force'], env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            simulator.reset_counts()
+
+        start = perf_counter()
+        process = subprocess.run(command, env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        wall = perf_counter() - start
+
+        events = [json.loads(line) for line in process.stdout.splitlines()]
+        spawns, failures = simulator.counts()
+    return {
+        'operation': operation,
+        'boards': boards,
+        'wall_s': round(wall, 3),
+        'exit': process.returncode,
+        'spawns': sum(spawns.values()),
+        'spawns_by_command': dict(spawns),
+        # each failed enable/disable is retried, and each extra programming attempt is one
+        'retries': failures['enable'] + failures['disable'] + sum(event.get('attempts', 1) - 1 for event in events if event['event'] == 'bitstream'),
+        'failed': sum(event.get('success') is False for event in events),
+        'skipped': sum(event.get('status') == 'skipped' for event in events),
+    }
+
+
+def version():
+    """
+    Returns the version of the tool (git description of the current commit), 'unknown' if not available
+    """
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def bench_end_to_end(sizes, operations, settings, parameters=(), output=None, compare=None):
+    """
+    Runs each operation for each number of boards, prints and saves the results (compared with a previous file, if given)
+    """
+    previous = {}
+    if compare is not None:
+        with open(compare) as file:
+            previous = {(result['operation'], result['boards']): result for result in json.load(file)['results']}
+
+    print(f"{'operation':>13} {'boards':>7} {'wall s':>9} {'spawns':>7} {'retries':>8} {'failed':>7} {'skipped':>8} {'exit':>5}" + (f" {'vs wall':>8} {'vs spawns':>10}" if previous else ""))
+    results = []
+    for operation in operations:
+        for boards in sizes:
+            result = run_operation(operation, boards, settings, parameters)
+            results.append(result)
+            line = f"{operation:>13} {boards:>7} {result['wall_s']:>9.2f} {result['spawns']:>7} {result['retries']:>8} {result['failed']:>7} {result['skipped']:>8} {result['exit']:>5}"
+            before = previous.get((operation, boards))
+            if before is not None:
+                line += f" {(result['wall_s'] / before['wall_s'] - 1) * 100 if before['wall_s'] else 0:>+7.0f}% {result['spawns'] - before['spawns']:>+10}"
+            print(line, flush=True)
+
+    version_ = version()
+    output = output or os.path.join('benchmarks', f"{version_}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({
+            'version': version_,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': settings,
+            'parameters': list(parameters),
+            'results': results,
+        }, file, indent=1)
+    print("Results saved to", output)
+
+
+def main(arguments):
+    from simulator import DEFAULTS
+
+    # KEY=VALUE parameters are for the tool
+    parameters = [argument for argument in arguments if re.fullmatch(r'[A-Z][A-Z0-9_]*=.*', argument)]
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmarks of the tool")
+    parser.add_argument('benchmark', nargs='?', choices=['parser', 'logging', 'e2e', 'ui'], default='parser')
+    parser.add_argument('--cycles', type=int, default=5000, help="interface refreshes")
+    parser.add_argument('--sizes', default="1,2,4,8,16,32,64,128", help="numbers of boards")
+    parser.add_argument('--operations', default=",".join(OPERATIONS), help="operations to run")
+    parser.add_argument('--output', help="results file")
+    parser.add_argument('--compare', help="results file of a previous version")
+    for key, value in DEFAULTS.items():
+        if key not in ('boards', 'enabled'):
+            parser.add_argument('--' + key.replace('_', '-'), type=type(value), default=value, help="simulator setting")
+    arguments = vars(parser.parse_args([argument for argument in arguments if argument not in parameters]))
+
+    if arguments['benchmark'] == 'parser':
+        bench_parser()
+        return
+    if arguments['benchmark'] == 'logging':
+        bench_logging()
+        return
+    if arguments['benchmark'] == 'ui':
+        from tkinter import TclError
+
+        try:
+            flat = bench_ui(arguments['cycles'])
+        except TclError as e:
+            parser.error(f"The ui benchmark needs a display: {e}")
+        if not flat: sys.exit(1)
+        return
+    operations = arguments['operations'].split(',')
+    for operation in operations:
+        if operation not in OPERATIONS: parser.error(f"Unknown operation {operation}, available: {', '.join(OPERATIONS)}")
+    settings = {key: arguments[key] for key in DEFAULTS if key in arguments}
+    bench_end_to_end([int(size) for size in arguments['sizes'].split(',')], operations, settings, parameters, arguments['output'], arguments['compare'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+import hashlib
+from threading import Lock
+from time import time
+
+import store
+from CONFIG import VIVADO_BITSTREAM_CACHE_FILE
+
+
+def digest(path):
+    """
+    returns the sha256 (hex) of the content of a file
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class BitstreamCache:
+    def __init__(self):
+        """
+        Last bitstream successfully programmed on each board (by instance id), kept between sessions
+        Each record has the bitstream sha256, the identity read back from the device after programming,
+        and how long the programming took
+        """
+        self.records = store.load(VIVADO_BITSTREAM_CACHE_FILE, {})
+        self._lock = Lock()
+
+    def matches(self, board, sha256, identify):
+        """
+        returns true iff 'board' was programmed with the given bitstream, and still reports the same identity
+        'identify()' must return the current identity of the board, it is called only if needed
+        """
+        record = self.records.get(board)
+        if record is None or record['sha256'] != sha256: return False
+        identity = identify()
+        return identity is not None and record['identity'] == identity
+
+    def saved(self, board):
+        """
+        returns the seconds it took to program 'board' the last time (0 if unknown)
+        """
+        return self.records.get(board, {}).get('elapsed_ms', 0) / 1000
+
+    def record(self, board, sha256, identity, elapsed_ms):
+        """
+        Saves that 'board' was programmed with the given bitstream
+        """
+        with self._lock:
+            self.records[board] = {'sha256': sha256, 'identity': identity, 'elapsed_ms': elapsed_ms, 'time': time()}
+            store.save(VIVADO_BITSTREAM_CACHE_FILE, self.records)
+
+    def forget(self, board):
+        """
+        Removes the record of 'board' (its content is unknown)
+        """
+        with self._lock:
+            if self.records.pop(board, None) is not None:
+                store.save(VIVADO_BITSTREAM_CACHE_FILE, self.records)
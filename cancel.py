@@ -0,0 +1,5 @@
+class CancelException(Exception):
+    """
+    Raised when the user cancels a running operation
+    """
+    pass
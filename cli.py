@@ -0,0 +1,275 @@
+"""
+Command line interface, to use the tool from scripts without the graphical interface (which is never imported).
+Each result is printed to stdout as a json line, everything else (logs, progress) goes to stderr.
+Enabling and disabling boards requires an administrator console.
+$> python cli.py [KEY=VALUE ...] list
+$> python cli.py enable|disable [--boards 1-3,5]
+$> python cli.py only 2
+$> python cli.py program --bit design.bit [--boards 1-8] [--force] [--test] [--resume]
+$> python cli.py run steps.json [--boards 1-8] [--force] [--test] [--resume]
+$> python cli.py test [--boards 1-8]
+$> python cli.py queue jobs.json
+$> python cli.py agent [AGENT_BIND=0.0.0.0] [AGENT_TOKEN=secret]
+$> python cli.py coordinate --agents pc1:8731,pc2:8731 steps.json|--bit design.bit [--force] [--test] [AGENT_TOKEN=secret]
+The boards are selected by position (starting at 1, ranges allowed), name or instance id.
+The steps file is a json list of [command, parameter, scope, exclusive] (only command required), or objects with those keys.
+The command is 'pause', 'script' or 'bitstream', the scope 'board' (default) or 'global' (once), see pipeline.py
+Scripts run in their own folder, and per-board ones get their board in the FDT_BOARD_NAME, FDT_BOARD_ID and FDT_BOARD_INDEX
+environment variables.
+The jobs file is a json list of objects {boards, bit or steps (a list, like a steps file), priority, force}, see jobs.py
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+COMMANDS = ['list', 'enable', 'disable', 'only', 'program', 'run', 'test', 'queue', 'agent', 'coordinate']
+
+# exit codes
+OK = 0  # everything succeeded
+FAILED = 1  # some operation failed
+USAGE = 2  # invalid arguments or steps file (same as argparse)
+NOT_FOUND = 3  # unknown board, missing file, or no boards connected
+CANCELLED = 130  # interrupted by the user
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(prog="fpga-device-tool", description="Enables, disables and programs FPGA boards")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="list the connected boards")
+    for command, help in (('enable', "enable boards"), ('disable', "disable boards"), ('test', "enable boards and run TEST_COMMAND on each of them")):
+        subparsers.add_parser(command, help=help).add_argument('--boards', help="boards to change (all by default)")
+    subparsers.add_parser('only', help="enable a board and disable all the others").add_argument('board')
+    program = subparsers.add_parser('program', help="program a bitstream on each board")
+    program.add_argument('--bit', required=True, help="bitstream file")
+    run = subparsers.add_parser('run', help="run the steps of a json file on each board")
+    run.add_argument('steps', help="steps file")
+    for subparser in (program, run):
+        subparser.add_argument('--boards', help="boards to program (all by default)")
+        subparser.add_argument('--force', action='store_true', help="program bitstreams even if the board already has them")
+        subparser.add_argument('--test', action='store_true', help="then enable the boards and run TEST_COMMAND on each of them")
+        subparser.add_argument('--resume', action='store_true', help="skip the boards completed by the last interrupted run with the same steps")
+    subparsers.add_parser('queue', help="run the jobs of a json file, each one with its own boards and steps").add_argument('jobs', help="jobs file")
+    subparsers.add_parser('agent', help="serve the boards of this PC to a coordinator (see agent.py)")
+    coordinate = subparsers.add_parser('coordinate', help="run the steps on all the boards of several agents at once")
+    coordinate.add_argument('--agents', required=True, help="agents, as host:port,host:port")
+    coordinate.add_argument('steps', nargs='?', help="steps file")
+    coordinate.add_argument('--bit', help="bitstream file, instead of a steps file")
+    coordinate.add_argument('--force', action='store_true', help="program bitstreams even if the board already has them")
+    coordinate.add_argument('--test', action='store_true', help="then enable the boards and run TEST_COMMAND on each of them")
+
+    # KEY=VALUE parameters are read by CONFIG
+    return parser.parse_args([argument for argument in arguments if not re.fullmatch(r'[A-Z][A-Z0-9_]*=.*', argument)])
+
+
+def select(fpgas, selection):
+    """
+    Returns the boards of a selection like '1-3,5,name,id' (all if None)
+    Raises LookupError if any of them is not connected
+    """
+    if selection is None: return list(fpgas)
+    boards = []
+    for item in selection.split(','):
+        item = item.strip()
+        if re.fullmatch(r'\d+(-\d+)?', item):
+            first, _, last = item.partition('-')
+            for index in range(int(first), int(last or first) + 1):
+                if not 1 <= index <= len(fpgas): raise LookupError(f"There is no board {index}")
+                boards.append(fpgas.at(index - 1))
+        else:
+            matches = [board for board in fpgas if item in (board, fpgas.name(board))]
+            if not matches: raise LookupError(f"There is no board {item}")
+            boards += matches
+    return list(dict.fromkeys(boards))
+
+
+def load_steps(path):
+    """
+    Returns the steps (pipeline.Step) of a steps file
+    """
+    with open(path) as file:
+        return parse_steps(json.load(file))
+
+
+def parse_steps(items):
+    """
+    Returns the steps (pipeline.Step) of a list like the one of a steps file
+    """
+    from pipeline import step
+
+    steps = [step(*item) if isinstance(item, list) else step(**item) for item in items]
+    for s in steps:
+        if s.parameter is not None and not os.path.isfile(s.parameter): raise FileNotFoundError(f"Step file not found: {s.parameter}")
+    return steps
+
+
+def coordinate(arguments, emit):
+    """
+    Runs the 'coordinate' command, returns the exit code
+    """
+    import log
+    from coordinator import Coordinator
+
+    logger = log.get(__name__)
+
+    try:
+        if (arguments.steps is None) == (arguments.bit is None): raise ValueError("Either a steps file or --bit is required")
+        steps = [{'command': 'bitstream', 'parameter': arguments.bit}] if arguments.bit is not None else \
+            [{'command': s.command, 'parameter': s.parameter, 'scope': s.scope, 'exclusive': s.exclusive} for s in load_steps(arguments.steps)]
+        if arguments.bit is not None and not os.path.isfile(arguments.bit): raise FileNotFoundError(f"Bitstream not found: {arguments.bit}")
+    except (LookupError, FileNotFoundError) as e:
+        emit({'event': 'error', 'error': str(e)})
+        return NOT_FOUND
+    except (ValueError, TypeError) as e:
+        emit({'event': 'error', 'error': str(e)})
+        return USAGE
+
+    failed = set()  # agent and board of each failed operation, once
+    progress = {}  # last message, by agent
+
+    def merged(event):
+        emit(event)
+        if event.get('success') is False: failed.add((event['agent'], event.get('board')))
+        if event['event'] in ('progress', 'agent'):
+            progress[event['agent']] = event.get('message') or event['state']
+            logger.info(" | ".join(f"{agent}: {message}" for agent, message in progress.items()))
+
+    coordinator = Coordinator([address.strip() for address in arguments.agents.split(',')], merged)
+    try:
+        states = coordinator.run(steps, arguments.force, arguments.test)
+    except KeyboardInterrupt:
+        coordinator.cancelled.set()
+        emit({'event': 'error', 'error': "Cancelled"})
+        return CANCELLED
+    emit({'event': 'summary', 'agents': states, 'failed': len(failed)})
+    return FAILED if failed or any(state != 'done' for state in states.values()) else OK
+
+
+def main(arguments):
+    """
+    Runs a command, returns the exit code
+    """
+    # results are the only output on stdout, the rest goes to stderr (also from the child processes, that inherit the fd)
+    sys.stdout.flush()
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    def emit(event):
+        output.write(json.dumps(event) + '\n')
+        output.flush()
+
+    arguments = parse_arguments(arguments)
+    if arguments.command == 'agent':
+        import agent
+        try:
+            agent.serve()
+        except KeyboardInterrupt:
+            pass
+        return OK
+    if arguments.command == 'coordinate':
+        return coordinate(arguments, emit)
+
+    # imported after redirecting the output, CONFIG logs the replaced parameters
+    import log
+    import pipeline
+    import planner
+    import tracing
+    from CONFIG import TEST_COMMAND
+    from bitcache import BitstreamCache
+    from fpgas import FPGAs
+    from journal import Journal
+    from runner import Runner
+    from sessions import Sessions
+    from staging import Staging
+
+    logger = log.get(__name__)
+    tracing.serve()
+    fpgas = FPGAs()
+    journal = Journal()
+    vivado = staging = sessions = None
+    failed = set()  # boards with a failed operation (None for global steps), a failed step is also reported by its operation
+    try:
+        fpgas.update()
+        if arguments.command == 'list':
+            for index, board in enumerate(fpgas):
+                emit({'event': 'board', 'index': index + 1, 'board': board, 'name': fpgas.name(board), 'enabled': fpgas.enabled(board), 'status': fpgas.fpgas[board].status})
+            return OK
+        if len(fpgas) == 0:
+            emit({'event': 'error', 'error': "No boards connected"})
+            return NOT_FOUND
+
+        boards = select(fpgas, arguments.board if arguments.command == 'only' else getattr(arguments, 'boards', None))
+        if (arguments.command == 'test' or getattr(arguments, 'test', False)) and not TEST_COMMAND:
+            raise ValueError("TEST_COMMAND is not configured")
+        if arguments.command in ('program', 'run'):
+            from vivado import Vivado
+            steps = load_steps(arguments.steps) if arguments.command == 'run' else [pipeline.step('bitstream', arguments.bit)]
+            if arguments.command == 'program' and not os.path.isfile(arguments.bit): raise FileNotFoundError(f"Bitstream not found: {arguments.bit}")
+            vivado = Vivado()
+            staging = Staging()
+            sessions = Sessions()
+        if arguments.command == 'queue':
+            from vivado import Vivado
+            with open(arguments.jobs) as file:
+                jobs = [(parse_steps(job['steps']) if 'steps' in job else parse_steps([['bitstream', job['bit']]]), select(fpgas, job.get('boards')), job.get('priority', 0), job.get('force', False)) for job in json.load(file)]
+            vivado = Vivado()
+            staging = Staging()
+            sessions = Sessions()
+        runner = Runner(vivado, fpgas, BitstreamCache(), staging, journal, sessions)
+        runner.step = lambda message: logger.info("> %s", message)
+        runner.wait = lambda message: (emit({'event': 'pause', 'message': message}), sys.stdin.readline())
+
+        def report(event):
+            emit(event)
+            if not event['success']: failed.add(event['board'])
+
+        runner.report = report
+
+        states = fpgas.get_state()
+        if arguments.command == 'enable':
+            runner.execute(planner.plan(states, {board: True for board in boards}))
+        elif arguments.command == 'disable':
+            runner.execute(planner.plan(states, {board: False for board in boards}))
+        elif arguments.command == 'only':
+            runner.execute(planner.plan(states, planner.only(states, boards[0])))
+        elif arguments.command == 'test':
+            runner.test_all(boards)[0]()
+        elif arguments.command == 'queue':
+            from jobs import Scheduler
+            scheduler = Scheduler(runner)
+            for steps, job_boards, priority, force in jobs:
+                scheduler.submit(steps, job_boards, priority, force)
+            for job in scheduler.run()[0]():
+                emit({'event': 'job', 'job': job.id, 'state': job.state, 'boards': [fpgas.name(board) for board in job.boards], 'failed': [fpgas.name(board) for board in job.failed]})
+        else:
+            for s in steps:
+                if s.command == 'bitstream': staging.stage(s.parameter)
+            runner.program_all(steps, boards, arguments.force, arguments.test, arguments.resume)[0]()
+        emit({'event': 'summary', 'failed': len(failed), 'skipped': len(runner.skipped), 'tests_passed': sum(result.passed for result in runner.tests), 'tests': len(runner.tests)})
+        return FAILED if failed else OK
+
+    except (LookupError, FileNotFoundError) as e:
+        emit({'event': 'error', 'error': str(e)})
+        return NOT_FOUND
+    except (ValueError, TypeError) as e:
+        emit({'event': 'error', 'error': str(e)})
+        return USAGE
+    except KeyboardInterrupt:
+        emit({'event': 'error', 'error': "Cancelled"})
+        return CANCELLED
+    except Exception as e:
+        emit({'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+        return FAILED
+    finally:
+        if staging is not None: staging.close()
+        journal.close()
+        fpgas.close()
+        if sessions is not None: sessions.close()
+        if vivado is not None: vivado.close(keep_daemon=True)
+        tracing.export()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+import os
+import subprocess
+from threading import Lock
+from uuid import uuid4
+
+import log
+
+logger = log.get(__name__)
+
+
+class CommandHost:
+    def __init__(self, shell=None, status=None):
+        """
+        Long-lived shell used to run commands without creating a new process each time
+        'shell' is the shell to launch, and 'status' the shell expression with the exit code of the last command
+        (by default cmd.exe on Windows and sh elsewhere)
+        """
+        self.shell = shell or ('cmd.exe' if os.name == 'nt' else 'sh')
+        self.status = status or ('%errorlevel%' if os.name == 'nt' else '$?')
+        self._instance: subprocess.Popen | None = None
+        self._lock = Lock()
+
+    def run(self, command):
+        """
+        Runs a command on the host, returns its output (stdout and stderr)
+        Raises subprocess.CalledProcessError if the command fails, or OSError if the host is not usable
+        """
+        output = []
+        try:
+            for line in self.stream(command):
+                output.append(line)
+        except subprocess.CalledProcessError as e:
+            e.output = ''.join(output)
+            raise
+        return ''.join(output)
+
+    def stream(self, command):
+        """
+        Runs a command on the host, yields its output lines as they are produced
+        Raises subprocess.CalledProcessError at the end if the command fails, or OSError if the host is not usable
+        """
+        with self._lock:
+            if self._instance is None or self._instance.poll() is not None:
+                self._launch()
+
+            lines = self._send(command)
+            returncode = None
+            try:
+                while True:
+                    try:
+                        line = next(lines)
+                    except StopIteration as end:
+                        returncode = end.value
+                        break
+                    yield line
+            finally:
+                if returncode is None:
+                    # stopped early, discard the rest of the output
+                    try:
+                        for _ in lines: pass
+                    except OSError:
+                        pass
+
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def _send(self, command):
+        # run, followed by a unique sentinel with the exit code
+        sentinel = f"__end_{uuid4().hex}__"
+        try:
+            self._instance.stdin.write(f"{command}\n")
+            self._instance.stdin.write(f"echo {sentinel} {self.status}\n")
+            self._instance.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.close()
+            raise OSError(f"Command host is not available: {e}")
+
+        # read until the sentinel, returns the exit code
+        while True:
+            line = self._instance.stdout.readline()
+            if line == '':
+                self.close()
+                raise OSError("Command host exited unexpectedly")
+            if sentinel in line:
+                # the output may not end with a newline
+                before, _, after = line.partition(sentinel)
+                if before: yield before
+                return int(after.strip() or -1)
+            yield line
+
+    def _launch(self):
+        logger.debug("Launching command host %s", self.shell)
+        self._instance = subprocess.Popen(self.shell,
+                                          universal_newlines=True,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT,
+                                          )
+        if self.shell.startswith('cmd'):
+            # don't echo the prompt nor the commands
+            self._instance.stdin.write("@echo off\n")
+        for _ in self._send(""): pass  # discard any banner
+
+    def close(self):
+        if self._instance is None: return
+
+        try:
+            self._instance.communicate("exit\n", timeout=2)
+        except (subprocess.TimeoutExpired, OSError, ValueError):
+            self._instance.kill()
+            self._instance.communicate()
+        self._instance = None
+
+
+class CommandHostPool:
+    def __init__(self, *args):
+        """
+        Set of command hosts, so that several commands can run at the same time
+        A new host (created with 'args') is launched only when all the existing ones are busy
+        """
+        self._args = args
+        self._hosts = []
+        self._idle = []
+        self._lock = Lock()
+
+    def run(self, command):
+        """
+        Runs a command on an idle host, same as CommandHost.run
+        """
+        host = self._acquire()
+        try:
+            return host.run(command)
+        finally:
+            self._release(host)
+
+    def stream(self, command):
+        """
+        Runs a command on an idle host, same as CommandHost.stream
+        """
+        host = self._acquire()
+        try:
+            yield from host.stream(command)
+        finally:
+            self._release(host)
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            host = CommandHost(*self._args)
+            self._hosts.append(host)
+            return host
+
+    def _release(self, host):
+        with self._lock:
+            self._idle.append(host)
+
+    def close(self):
+        with self._lock:
+            for host in self._hosts:
+                host.close()
@@ -0,0 +1,137 @@
+import re
+import subprocess
+from collections import deque
+from threading import Condition, Thread
+from time import monotonic
+
+import log
+from CONFIG import VIVADO_OUTPUT_LINES
+from cancel import CancelException
+
+logger = log.get(__name__)
+
+
+class Console:
+    def __init__(self, command):
+        """
+        Interactive process with piped stdin/stdout
+        The output is read from a dedicated thread and kept in memory (last VIVADO_OUTPUT_LINES lines)
+        """
+        self._instance = subprocess.Popen(command,
+                                          universal_newlines=True,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT,
+                                          )
+        self._state = {}
+        self._lines = deque(maxlen=VIVADO_OUTPUT_LINES)
+        self._read = 0  # number of lines read from the process
+        self._position = 0  # number of lines already checked by expect
+        self._closed = False
+        self._condition = Condition()
+        self._reader = Thread(target=self._loop, name="console", daemon=True)
+        self._reader.start()
+
+    def _loop(self):
+        for line in self._instance.stdout:
+            with self._condition:
+                self._lines.append(line.rstrip('\n'))
+                self._read += 1
+                self._condition.notify_all()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def write(self, command):
+        """
+        Sends a command
+        """
+        logger.debug("Running: %s", command)
+        try:
+            self._instance.stdin.write(command)
+            self._instance.stdin.write('\n')
+            self._instance.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise EOFError(f"The process is not running: {e}")
+
+    def skip(self):
+        """
+        Ignores all the output read until now, next expect will only check new lines
+        """
+        with self._condition:
+            self._position = self._read
+
+    def expect(self, patterns, timeout=None, cancel=None):
+        """
+        Waits until a line matches any of the given regex patterns (strings or compiled)
+        Returns the index of the pattern and its match object, the line is consumed
+        Raises TimeoutError after 'timeout' seconds, CancelException if 'cancel' (an Event) is set,
+        or EOFError if the process finishes
+        """
+        patterns = [re.compile(pattern) if isinstance(pattern, str) else pattern for pattern in patterns]
+        end = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while True:
+                # check new lines (the oldest may have been discarded)
+                first = self._read - len(self._lines)
+                for number in range(max(self._position, first), self._read):
+                    self._position = number + 1
+                    line = self._lines[number - first]
+                    for index, pattern in enumerate(patterns):
+                        match = pattern.search(line)
+                        if match: return index, match
+
+                # wait for more
+                if self._closed:
+                    raise EOFError("The process finished")
+                if cancel is not None and cancel.is_set():
+                    raise CancelException()
+                remaining = None if end is None else end - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"None of {[pattern.pattern for pattern in patterns]} found in {timeout} seconds")
+                # wake up periodically to check the cancel token
+                self._condition.wait(0.1 if cancel is not None and (remaining is None or remaining > 0.1) else remaining)
+
+    def output(self, lines=None):
+        """
+        Returns the last lines of output (all kept lines by default)
+        """
+        with self._condition:
+            return list(self._lines)[-lines if lines else 0:]
+
+    def alive(self):
+        """
+        returns true iff the process is still running
+        """
+        return self._instance.poll() is None
+
+    def get(self, key):
+        """
+        returns a value associated to this console (None if not set)
+        """
+        return self._state.get(key)
+
+    def set(self, key, value):
+        """
+        associates a value to this console
+        """
+        self._state[key] = value
+
+    def detach(self):
+        """
+        Stops using this console, which for a local one means closing it
+        """
+        self.close()
+
+    def close(self, command="exit"):
+        """
+        Sends the exit 'command' and waits for the process to end, kills it if it doesn't
+        """
+        try:
+            self._instance.stdin.write(command)
+            self._instance.stdin.close()
+            self._instance.wait(timeout=2)
+        except (subprocess.TimeoutExpired, OSError, ValueError):
+            logger.info("Killing process")
+            self._instance.kill()
+            self._instance.wait()
@@ -0,0 +1,122 @@
+"""
+Coordinator, to program the boards of several PCs at the same time through their agents (see agent.py).
+The same steps run on all the agents at once, their files are sent to the agents that don't have them yet.
+The progress of all of them is merged: each event is emitted with the address of its agent.
+If an agent stops responding, the coordinator keeps trying to reach it (AGENT_RETRY_* policy). When it answers again,
+the job is resumed there (if it was lost, the boards already completed are skipped thanks to the journal),
+otherwise its remaining boards are reported as failed.
+$> python cli.py coordinate steps.json --agents pc1:8731,pc2:8731 [AGENT_TOKEN=secret]
+"""
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from threading import Event
+from time import sleep
+
+from CONFIG import AGENT_POLL_INTERVAL, AGENT_RETRY, AGENT_RETRY_DELAY, AGENT_RETRY_MAX_DELAY, AGENT_RETRY_DEADLINE
+from agent import UNKNOWN_JOB, Client, RPCError
+from bitcache import digest
+from cancel import CancelException
+from retry import Retry
+
+RECONNECT = Retry(AGENT_RETRY, AGENT_RETRY_DELAY, AGENT_RETRY_MAX_DELAY, AGENT_RETRY_DEADLINE, name='agent')
+
+
+class AgentLost(Exception):
+    """
+    The agent didn't answer during the whole retry policy
+    """
+    pass
+
+
+class Coordinator:
+    def __init__(self, addresses, emit=print, token=None):
+        """
+        Coordinates the agents at 'addresses' (host:port), 'emit(event)' is called with each merged event
+        """
+        self.clients = [Client(address) if token is None else Client(address, token) for address in addresses]
+        self.emit = emit
+        self.cancelled = Event()
+
+    def _call(self, client, method, **params):
+        # calls the agent, retrying while it can't be reached (or its answers are broken)
+        error = None
+        for attempt in RECONNECT:
+            if self.cancelled.is_set(): raise CancelException()
+            try:
+                return client.call(method, **params)
+            except (OSError, HTTPException, ValueError) as e:
+                if attempt == 1: self.emit({'event': 'agent', 'agent': client.address, 'state': 'unreachable', 'error': str(e)})
+                error = e
+        raise AgentLost(f"{client.address} unreachable: {error}")
+
+    def list(self):
+        """
+        Returns the boards of all the agents, by agent
+        """
+        with ThreadPoolExecutor(len(self.clients)) as executor:
+            return dict(zip((client.address for client in self.clients), executor.map(lambda client: self._call(client, 'list'), self.clients)))
+
+    def run(self, steps, force=False, test=False):
+        """
+        Runs the steps (dicts, like in a steps file) on all the boards of all the agents at the same time
+        Returns the final state of each agent, by agent
+        """
+        # files, by sha256. The agents only receive their names
+        files = {}
+        steps = [dict(step) for step in steps]
+        for step in steps:
+            if step.get('parameter') is not None:
+                step['sha256'] = digest(step['parameter'])
+                files[step['sha256']] = step['parameter']
+                step['parameter'] = os.path.basename(step['parameter'])
+
+        with ThreadPoolExecutor(len(self.clients)) as executor:
+            try:
+                return dict(zip((client.address for client in self.clients), executor.map(lambda client: self._run(client, steps, files, force, test), self.clients)))
+            except KeyboardInterrupt:
+                self.cancelled.set()  # the agents cancel their jobs
+                raise
+
+    def _run(self, client, steps, files, force, test):
+        # runs the job on an agent until it finishes, resuming it if the agent is lost meanwhile
+        try:
+            job = self._start(client, steps, files, force, test, resume=False)
+            since = 0
+            while True:
+                sleep(AGENT_POLL_INTERVAL)
+                if self.cancelled.is_set():
+                    try:
+                        client.call('cancel', job=job)
+                    except (OSError, HTTPException, ValueError, RPCError):
+                        pass  # it will find out
+                    raise CancelException()
+                try:
+                    status = self._call(client, 'status', job=job, since=since)
+                except RPCError as e:
+                    if e.code != UNKNOWN_JOB: raise
+                    # the agent was restarted, continue where it was left
+                    self.emit({'event': 'agent', 'agent': client.address, 'state': 'resuming'})
+                    job, since = self._start(client, steps, files, force, test, resume=True), 0
+                    continue
+                for event in status['events']:
+                    self.emit({**event, 'agent': client.address})
+                since += len(status['events'])
+                if status['state'] != 'running':
+                    self.emit({'event': 'agent', 'agent': client.address, 'state': status['state'], 'error': status['error']})
+                    return status['state']
+        except (AgentLost, RPCError) as e:
+            self.emit({'event': 'agent', 'agent': client.address, 'state': 'failed', 'error': str(e)})
+            return 'failed'
+        except CancelException:
+            return 'cancelled'
+
+    def _start(self, client, steps, files, force, test, resume):
+        # sends the missing files and starts the job, returns its id
+        for sha256 in self._call(client, 'missing', files=files):
+            with open(files[sha256], 'rb') as file:
+                self._call(client, 'put', name=os.path.basename(files[sha256]), content=base64.b64encode(file.read()).decode('ascii'))
+        job = self._call(client, 'run', steps=steps, force=force, test=test, resume=resume)
+        self.emit({'event': 'agent', 'agent': client.address, 'state': 'running', 'job': job})
+        return job
@@ -0,0 +1,261 @@
+"""
+Persistent console server, to keep Vivado running between sessions of the tool.
+The daemon owns a Console and serves it on localhost with a small framed protocol:
+each message is a 4-byte big-endian length followed by a json object.
+The address and secret token are written to VIVADO_DAEMON_FILE, readable only by the user.
+$> python daemon.py <shell>
+"""
+import json
+import os
+import re
+import secrets
+import socket
+import struct
+import subprocess
+import sys
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+import log
+import store
+from CONFIG import VIVADO_DAEMON_FILE, VIVADO_DAEMON_IDLE, VIVADO_DAEMON_TIMEOUT
+from cancel import CancelException
+from console import Console
+
+logger = log.get(__name__)
+
+
+def send(connection, message):
+    data = json.dumps(message).encode('utf-8')
+    connection.sendall(struct.pack('>I', len(data)) + data)
+
+
+def receive(connection):
+    header = _receive_exactly(connection, 4)
+    return json.loads(_receive_exactly(connection, struct.unpack('>I', header)[0]).decode('utf-8'))
+
+
+def _receive_exactly(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk: raise EOFError("Connection closed")
+        data += chunk
+    return data
+
+
+class Daemon:
+    def __init__(self, shell):
+        """
+        Serves a console running 'shell', until it exits or no client is attached for VIVADO_DAEMON_IDLE seconds
+        """
+        self.console = Console(shell)
+        self.state = {}  # values kept between clients
+        self.token = secrets.token_hex(16)
+        self.client = None  # only one client at a time
+        self.last = monotonic()  # last time a client was attached
+        self.stopped = False
+        self._lock = Lock()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen()
+        self.server.settimeout(1)
+
+    def serve(self):
+        store.save(VIVADO_DAEMON_FILE, {'port': self.server.getsockname()[1], 'token': self.token, 'pid': os.getpid()}, mode=0o600)
+        try:
+            while not self.stopped and self.console.alive():
+                with self._lock:
+                    if self.client is None and monotonic() - self.last > VIVADO_DAEMON_IDLE:
+                        logger.info("Idle, shutting down")
+                        break
+                try:
+                    connection, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                Thread(target=self._serve_client, args=(connection,), daemon=True).start()
+        finally:
+            self.server.close()
+            self.console.close()
+            if store.load(VIVADO_DAEMON_FILE, {}).get('pid') == os.getpid():
+                os.remove(os.path.expanduser(VIVADO_DAEMON_FILE))
+
+    def _serve_client(self, connection):
+        with connection:
+            try:
+                # authenticate and attach
+                hello = receive(connection)
+                if not secrets.compare_digest(str(hello.get('token')), self.token):
+                    send(connection, {'ok': False, 'error': "invalid token"})
+                    return
+                with self._lock:
+                    if self.client is not None:
+                        send(connection, {'ok': False, 'error': "busy"})
+                        return
+                    self.client = connection
+                send(connection, {'ok': True})
+
+                # requests
+                try:
+                    while not self.stopped:
+                        send(connection, self._handle(receive(connection)))
+                finally:
+                    with self._lock:
+                        self.client = None
+                        self.last = monotonic()
+            except (OSError, EOFError, ValueError):
+                pass  # client disconnected
+
+    def _handle(self, request):
+        operation = request.get('op')
+        try:
+            if operation == 'write':
+                self.console.write(request['command'])
+            elif operation == 'skip':
+                self.console.skip()
+            elif operation == 'expect':
+                index, match = self.console.expect(request['patterns'], request.get('timeout'))
+                return {'ok': True, 'index': index, 'line': match.string}
+            elif operation == 'output':
+                return {'ok': True, 'lines': self.console.output(request.get('lines'))}
+            elif operation == 'ping':
+                return {'ok': True, 'alive': self.console.alive()}
+            elif operation == 'get':
+                return {'ok': True, 'value': self.state.get(request['key'])}
+            elif operation == 'set':
+                self.state[request['key']] = request['value']
+            elif operation == 'shutdown':
+                self.stopped = True
+            else:
+                return {'ok': False, 'error': f"unknown operation {operation}"}
+            return {'ok': True}
+        except TimeoutError:
+            return {'ok': False, 'error': 'timeout'}
+        except EOFError:
+            return {'ok': False, 'error': 'eof'}
+
+
+class RefusedError(OSError):
+    """
+    The daemon is running, but can't be used
+    """
+    pass
+
+
+class RemoteConsole:
+    def __init__(self, port, token):
+        """
+        Client of a Daemon, with the same interface as Console
+        """
+        # also the timeout of each request, they are short (the long waits are split in several)
+        self._connection = socket.create_connection(('127.0.0.1', port), timeout=VIVADO_DAEMON_TIMEOUT)
+        response = self._request({'token': token})
+        if not response['ok']: raise RefusedError(f"Daemon refused the connection: {response['error']}")
+
+    def _request(self, request):
+        try:
+            send(self._connection, request)
+            return receive(self._connection)
+        except (OSError, EOFError, ValueError) as e:
+            raise EOFError(f"Daemon not available: {e}")
+
+    def write(self, command):
+        logger.debug("Running (daemon): %s", command)
+        self._request({'op': 'write', 'command': command})
+
+    def skip(self):
+        self._request({'op': 'skip'})
+
+    def expect(self, patterns, timeout=None, cancel=None):
+        """
+        Same as Console.expect, waits in short requests so that it can be cancelled
+        """
+        patterns = [re.compile(pattern) if isinstance(pattern, str) else pattern for pattern in patterns]
+        end = None if timeout is None else monotonic() + timeout
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise CancelException()
+            remaining = None if end is None else end - monotonic()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f"None of {[pattern.pattern for pattern in patterns]} found in {timeout} seconds")
+            response = self._request({'op': 'expect', 'patterns': [pattern.pattern for pattern in patterns], 'timeout': min(0.5, remaining) if remaining is not None else 0.5})
+            if response['ok']:
+                return response['index'], patterns[response['index']].search(response['line'])
+            if response['error'] == 'eof':
+                raise EOFError("The process finished")
+
+    def output(self, lines=None):
+        return self._request({'op': 'output', 'lines': lines})['lines']
+
+    def alive(self):
+        try:
+            return self._request({'op': 'ping'})['alive']
+        except EOFError:
+            return False
+
+    def get(self, key):
+        return self._request({'op': 'get', 'key': key})['value']
+
+    def set(self, key, value):
+        self._request({'op': 'set', 'key': key, 'value': value})
+
+    def detach(self):
+        """
+        Disconnects, the daemon keeps running
+        """
+        self._connection.close()
+
+    def close(self, command="exit"):
+        """
+        Stops the daemon (and its process)
+        """
+        try:
+            self._request({'op': 'write', 'command': command})
+            self._request({'op': 'shutdown'})
+        except EOFError:
+            pass
+        self.detach()
+
+
+def attach(shell):
+    """
+    Connects to the running daemon, launching it first if needed
+    Raises OSError if it can't be done
+    """
+    try:
+        return _connect()
+    except RefusedError:
+        raise
+    except (OSError, KeyError):
+        pass  # not running
+
+    # launch, detached so that it survives this process
+    logger.info("Launching daemon")
+    command = [sys.executable, '--vivado-daemon', shell] if getattr(sys, 'frozen', False) else [sys.executable, os.path.abspath(__file__), shell]
+    if os.name == 'nt':
+        subprocess.Popen(command, creationflags=subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP, close_fds=True)
+    else:
+        subprocess.Popen(command, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True)
+
+    # wait until it is listening
+    end = monotonic() + VIVADO_DAEMON_TIMEOUT
+    while True:
+        try:
+            return _connect()
+        except (OSError, KeyError):
+            if monotonic() > end: raise OSError("The daemon didn't start")
+            sleep(0.1)
+
+
+def _connect():
+    info = store.load(VIVADO_DAEMON_FILE, {})
+    return RemoteConsole(info['port'], info['token'])
+
+
+def main(arguments):
+    Daemon(arguments[0] if arguments else ('cmd.exe' if os.name == 'nt' else 'sh')).serve()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,132 +1,316 @@
+import logging
 import os.path
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from types import SimpleNamespace
+from typing import NamedTuple
 
-from CONFIG import FPGA_STATUS_DISABLED, FPGA_STATUS_ENABLED, FPGA_DESCRIPTION, FPGA_COMMAND_LIST, FPGA_COMMAND_ENABLE, FPGA_COMMAND_DISABLE, FPGA_COMMAND_ENABLE_RETRY, FPGA_COMMAND_DISABLE_RETRY
+import log
+import store
+import tracing
+from CONFIG import FPGA_STATUS_DISABLED, FPGA_STATUS_ENABLED, FPGA_DESCRIPTION, FPGA_COMMAND_LIST, FPGA_COMMAND_ENABLE, FPGA_COMMAND_DISABLE, FPGA_COMMAND_ENABLE_RETRY, FPGA_COMMAND_DISABLE_RETRY, FPGA_COMMAND_HOST, FPGA_PARALLELISM, FPGA_COMMAND_STATUS, FPGA_RETRY_DELAY, FPGA_RETRY_MAX_DELAY, FPGA_RETRY_DEADLINE, FPGA_SETTLE_TIMEOUT, FPGA_ALIASES_FILE, FPGA_COMMAND_RELATIONS
+from cmdhost import CommandHostPool
+from pnputil import parse
+from retry import Retry, retryable
+
+logger = log.get(__name__)
+
+
+class Result(NamedTuple):
+    """
+    Outcome of an operation run with FPGAs.run_all
+    """
+    operation: str
+    board: str
+    success: bool
+    error: Exception | None
+
+
+def is_enabled(status):
+    """
+    returns true if the status is an enabled one, false if disabled, None if undefined
+    """
+    return (
+        True if status in FPGA_STATUS_ENABLED
+        else False if status in FPGA_STATUS_DISABLED
+        else None
+    )
+
+
+def _serial(parent):
+    # serial number of a usb device, from its instance id 'USB\VID_0403&PID_6010\210251A08870'
+    # (None if it has no serial, then Windows generates one like '5&2c5a0e3f&0&3')
+    serial = parent.rpartition('\\')[2]
+    return serial if serial and '&' not in serial else None
+
+
+def _kind(command):
+    # the operation of a command, to label its metrics: '/enable-device' from 'pnputil /enable-device "id"'
+    parts = command.split()
+    return parts[1].lstrip('/') if len(parts) > 1 else parts[0]
+
+
+ENABLE_RETRY = Retry(FPGA_COMMAND_ENABLE_RETRY, FPGA_RETRY_DELAY, FPGA_RETRY_MAX_DELAY, FPGA_RETRY_DEADLINE, name='enable')
+DISABLE_RETRY = Retry(FPGA_COMMAND_DISABLE_RETRY, FPGA_RETRY_DELAY, FPGA_RETRY_MAX_DELAY, FPGA_RETRY_DEADLINE, name='disable')
+SINGLE = Retry(1, 0, 0, 0)
+SETTLE_RETRY = Retry(int(FPGA_SETTLE_TIMEOUT * 10), FPGA_RETRY_DELAY / 2, FPGA_RETRY_MAX_DELAY / 2, FPGA_SETTLE_TIMEOUT, name='settle')
 
 
 class FPGAs:
     def __init__(self):
-        self.fpgas = []
-        self.update()
-        self.state = []
+        self.fpgas = {}  # boards by instance id, in enumeration order
+        self.indexes = {}  # position of each board
+        self.counts = {True: 0, False: 0, None: 0}  # number of boards on each state
+        self.generation = 0  # increased each time boards are connected or disconnected
+        self.aliases = store.load(FPGA_ALIASES_FILE, {})
+        self.host = CommandHostPool() if FPGA_COMMAND_HOST else None
+        self.executor = ThreadPoolExecutor(FPGA_PARALLELISM, thread_name_prefix="fpgas")
+        self._lock = Lock()
 
     def update(self):
         """
         Updates the state of the fpgas
+        Blocks until the devices are enumerated, prefer a Poller from the UI thread
         """
+        with tracing.span('update'):
+            self.apply(self.enumerate())
 
-        # get all
-        output = subprocess.check_output(FPGA_COMMAND_LIST, universal_newlines=True)
+    def enumerate(self):
+        """
+        Enumerates the connected fpgas, without modifying the current state
+        returns an immutable snapshot (tuple of Device)
+        """
 
-        # process
-        devices = []
-        for device in output.split("\n\n")[1:-1]:
-            lines = [line.split(':', 2)[1].strip() for line in device.split("\n")]
-            devices.append(SimpleNamespace(
-                id=lines[0],
-                device_description=lines[1],
-                status=lines[5],
-            ))
+        return tuple(parse(self._stream(FPGA_COMMAND_LIST), FPGA_DESCRIPTION))
 
-        # filter
-        fpgas = [device for device in devices if device.device_description == FPGA_DESCRIPTION]
+    def serials(self):
+        """
+        Reads the serial number of each board (the one of its usb device, None if it has none)
+        Requires a pnputil with /relations (Windows 10 2004 or later), returns no serials otherwise
+        """
+        try:
+            return {device.id: _serial(device.parent) for device in parse(self._stream(FPGA_COMMAND_RELATIONS), FPGA_DESCRIPTION) if device.id in self.fpgas}
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning("Unable to read the serial numbers: %s", e)
+            return {}
+
+    def apply(self, snapshot):
+        """
+        Replaces the current fpgas with the ones from the given snapshot
+        """
+
+        # copy
+        fpgas = {device.id: SimpleNamespace(**device._asdict()) for device in snapshot}
 
         # modify
-        prefix = len(os.path.commonprefix([fpga.id for fpga in fpgas]))
-        suffix = len(os.path.commonprefix([fpga.id[::-1] for fpga in fpgas]))
-        for fpga in fpgas:
-            fpga.enabled = (
-                True if fpga.status in FPGA_STATUS_ENABLED
-                else False if fpga.status in FPGA_STATUS_DISABLED
-                else None
-            )
-            fpga.name = fpga.id[prefix:-suffix] if len(fpgas) > 1 else fpga.id
+        prefix = len(os.path.commonprefix(list(fpgas)))
+        suffix = len(os.path.commonprefix([id[::-1] for id in fpgas]))
+        counts = {True: 0, False: 0, None: 0}
+        for fpga in fpgas.values():
+            fpga.enabled = is_enabled(fpga.status)
+            fpga.default_name = fpga.id[prefix:len(fpga.id) - suffix] if len(fpgas) > 1 else fpga.id
+            counts[fpga.enabled] += 1
 
-        # log
-        print("FPGAs found:")
-        for fpga in fpgas:
-            print(">", fpga)
-        self.fpgas = fpgas
+        # log, every device only when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("FPGAs found:\n%s", "\n".join(f"> {fpga}" for fpga in fpgas.values()))
 
-    def enabled(self, i):
+        with self._lock:
+            if fpgas.keys() != self.fpgas.keys():
+                self.generation += 1
+                logger.info("%d FPGAs found", len(fpgas))
+            self.fpgas = fpgas
+            self.indexes = {id: index for index, id in enumerate(fpgas)}
+            self.counts = counts
+
+    def enabled(self, board):
         """
-        returns true if board 'i' is enabled, false if isn't, None if undefined/error
+        returns true if 'board' is enabled, false if isn't, None if undefined/error (or disconnected)
         """
-        return self.fpgas[i].enabled
+        fpga = self.fpgas.get(board)
+        return None if fpga is None else fpga.enabled
+
+    def _set_enabled(self, board, enabled):
+        with self._lock:
+            fpga = self.fpgas.get(board)
+            if fpga is None: return  # disconnected meanwhile
+            self.counts[fpga.enabled] -= 1
+            fpga.enabled = enabled
+            self.counts[enabled] += 1
 
     def allEnabled(self):
         """
         returns true iff all boards are enabled (and can be disabled)
         """
-        return all(self.enabled(i) is not False for i in self)
+        return self.counts[False] == 0
 
     def allDisabled(self):
         """
         returns true iff all boards are disabled (and can be enabled)
         """
-        return all(self.enabled(i) is not True for i in self)
+        return self.counts[True] == 0
+
+    def name(self, board):
+        """
+        returns the name of 'board': its alias if it has one, or the distinct part of its id otherwise
+        """
+        return self.aliases.get(board) or self.fpgas[board].default_name
 
-    def name(self, i):
+    def rename(self, board, alias):
         """
-        returns the name of board 'i'
+        Sets (or removes, if empty) the alias of 'board', kept between sessions
         """
-        return self.fpgas[i].name
+        if alias:
+            self.aliases[board] = alias
+        else:
+            self.aliases.pop(board, None)
+        store.save(FPGA_ALIASES_FILE, self.aliases)
 
-    def id(self, i):
+    def id(self, board):
         """
-        Returns the id of board 'i'
+        Returns the id of 'board'
         """
-        return self.fpgas[i].id
+        return self.fpgas[board].id
 
-    def toggle(self, i, state=None):
+    def index(self, board):
         """
-        Sets the state of board 'i'
+        Returns the position of 'board' (None if it is not connected)
+        """
+        return self.indexes.get(board)
+
+    def at(self, index):
+        """
+        Returns the board at the given position
+        """
+        return list(self.fpgas)[index]
+
+    def toggle(self, board, state=None):
+        """
+        Sets the state of 'board'
         Call without parameters to toggle
         """
-        if self.enabled(i) is None: return
-        if state is None: state = not self.enabled(i)
-        self.enable(i) if state else self.disable(i)
+        if self.enabled(board) is None: return
+        if state is None: state = not self.enabled(board)
+        self.enable(board) if state else self.disable(board)
 
-    def enable(self, i):
+    def enable(self, board):
         """
-        Enables board 'i'
+        Enables 'board'
+        returns false iff it couldn't be enabled
         """
-        if self.enabled(i) is not False: return
+        if self.enabled(board) is not False: return True
 
-        print("Enabling", i)
-        for _ in range(FPGA_COMMAND_ENABLE_RETRY):
+        logger.debug("Enabling %s", board)
+        with tracing.span('enable', board=self.name(board)):
             try:
-                print(subprocess.check_call(FPGA_COMMAND_ENABLE % self.fpgas[i].id))
-                break
-            except Exception:
-                pass
-        else:
-            print("Unable to enable the device")
-        self.fpgas[i].enabled = True
+                logger.debug(ENABLE_RETRY.call(self._run, FPGA_COMMAND_ENABLE % board))
+            except Exception as e:
+                logger.warning("Unable to enable the device: %s", e)
+                return self._settle(board, True, SINGLE)
+            return self._settle(board, True, SETTLE_RETRY)
 
-    def disable(self, i):
+    def disable(self, board):
         """
-        Disable board 'i'
+        Disable 'board'
+        returns false iff it couldn't be disabled
         """
-        if self.enabled(i) is not True: return
+        if self.enabled(board) is not True: return True
 
-        print("Disabling", i)
-        for _ in range(FPGA_COMMAND_DISABLE_RETRY):
+        logger.debug("Disabling %s", board)
+        with tracing.span('disable', board=self.name(board)):
             try:
-                print(subprocess.check_call(FPGA_COMMAND_DISABLE % self.fpgas[i].id))
-                break
-            except Exception:
-                pass
-        else:
-            print("Unable to disable the device")
-        self.fpgas[i].enabled = False
+                logger.debug(DISABLE_RETRY.call(self._run, FPGA_COMMAND_DISABLE % board))
+            except Exception as e:
+                logger.warning("Unable to disable the device: %s", e)
+                return self._settle(board, False, SINGLE)
+            return self._settle(board, False, SETTLE_RETRY)
+
+    def _settle(self, board, state, retry):
+        """
+        Queries 'board' until it reports the given state, following the retry policy
+        The board is updated with the last reported state, returns true iff it is the given one
+        """
+        enabled = None
+        for _ in retry:
+            try:
+                devices = list(parse(self._stream(FPGA_COMMAND_STATUS % board)))
+                enabled = is_enabled(devices[0].status) if devices else None
+            except Exception as e:
+                logger.warning("Unable to query the device: %s", e)
+                if not retryable(e): break
+            if enabled == state: break
+        self._set_enabled(board, enabled)
+        return enabled == state
+
+    def run_all(self, operations, done=None):
+        """
+        Runs the given operations (('enable' or 'disable', board), independent of each other) concurrently,
+        up to FPGA_PARALLELISM at the same time.
+        'done(result)' is called from this thread as each one finishes, if it raises the pending ones are cancelled.
+        returns the list of results, in completion order
+        """
+        futures = {self.executor.submit(getattr(self, operation), board): (operation, board) for operation, board in operations}
+        results = []
+        try:
+            for future in as_completed(futures):
+                error = future.exception()
+                result = Result(*futures[future], success=error is None and future.result(), error=error)
+                results.append(result)
+                if done is not None: done(result)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def _run(self, command):
+        """
+        Runs a command, on the command host if available, and returns its output
+        Raises subprocess.CalledProcessError if the command fails
+        """
+        with tracing.span('pnputil', command=_kind(command)):
+            if self.host is not None:
+                try:
+                    return self.host.run(command)
+                except OSError as e:
+                    logger.warning("Command host failed, running directly: %s", e)
+            return subprocess.check_output(command, universal_newlines=True, stderr=subprocess.STDOUT)
+
+    def _stream(self, command):
+        """
+        Runs a command, on the command host if available, and yields its output lines as they are produced
+        Raises subprocess.CalledProcessError at the end if the command fails
+        """
+        with tracing.span('pnputil', command=_kind(command)):
+            if self.host is not None:
+                started = False
+                try:
+                    for line in self.host.stream(command):
+                        started = True
+                        yield line
+                    return
+                except OSError as e:
+                    if started: raise
+                    logger.warning("Command host failed, running directly: %s", e)
+            with subprocess.Popen(command, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
+                yield from process.stdout
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, command)
+
+    def close(self):
+        """
+        Closes the executor and the command host, if any
+        """
+        self.executor.shutdown(cancel_futures=True)
+        if self.host is not None:
+            self.host.close()
 
     def get_state(self):
         """
-        returns all the current states of all boards
+        returns the current states of all boards, by board
         """
-        return [(i, self.enabled(i)) for i in self]
+        return {board: fpga.enabled for board, fpga in self.fpgas.items()}
 
     def __len__(self):
         """
@@ -137,7 +321,7 @@ class FPGAs:
 
     def __iter__(self):
         """
-        Iterating this object is the same as iterating range(len(self))
+        Iterating this object is the same as iterating the boards (instance ids), in order
         for convenience
         """
-        return range(len(self)).__iter__()
+        return iter(list(self.fpgas))
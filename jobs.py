@@ -0,0 +1,158 @@
+"""
+Queue of programming jobs: each one runs its steps on its own boards, so different boards can get different bitstreams.
+When the queue runs, the jobs are merged by priority (higher first, then in order of submission):
+jobs with the same steps share a single pipeline, the groups that program the same bitstream run one after another
+(so Vivado keeps its PROGRAM.FILE), and each group starts with the board enabled by the previous one (saving a switch).
+The jobs of the same board always run in their order. Cancelling a job only leaves out its boards.
+"""
+from itertools import count
+from threading import Event, Lock
+
+
+class Job:
+    def __init__(self, id, steps, boards, priority, force):
+        # steps (pipeline.Step) to run on boards
+        self.id = id
+        self.steps = steps
+        self.boards = boards
+        self.priority = priority
+        self.force = force
+        self.state = 'queued'  # then 'running', and 'done', 'failed' or 'cancelled'
+        self.failed = set()  # boards
+        self.cancelled = Event()
+
+    def __repr__(self):
+        return f"Job {self.id} ({len(self.boards)} boards, priority {self.priority}, {self.state})"
+
+
+class Scheduler:
+    def __init__(self, runner):
+        """
+        Runs the queued jobs with 'runner'
+        """
+        self.runner = runner
+        self.queue = []
+        self.running = []  # groups of the current run
+        self._ids = count(1)
+        self._lock = Lock()
+
+    def submit(self, steps, boards=None, priority=0, force=False):
+        """
+        Queues a job to run 'steps' on 'boards' (all by default), returns it
+        """
+        boards = list(self.runner.fpgas) if boards is None else list(dict.fromkeys(boards))
+        with self._lock:
+            job = Job(next(self._ids), steps, boards, priority, force)
+            self.queue.append(job)
+        for step in steps:
+            if step.command == 'bitstream': self.runner.staging.stage(step.parameter)
+        return job
+
+    def cancel(self, job):
+        """
+        Cancels a job, the others keep running
+        """
+        with self._lock:
+            job.cancelled.set()
+            if job in self.queue:
+                self.queue.remove(job)
+                job.state = 'cancelled'
+
+    def queued(self, board):
+        """
+        Returns the last queued job of 'board', if any
+        """
+        with self._lock:
+            return next((job for job in reversed(self.queue) if board in job.boards), None)
+
+    def clear(self):
+        """
+        Cancels all the queued jobs (not the running ones), returns them
+        """
+        with self._lock:
+            jobs, self.queue = self.queue, []
+            for job in jobs:
+                job.cancelled.set()
+                job.state = 'cancelled'
+        return jobs
+
+    def owner(self, board):
+        """
+        Returns the running job that is programming 'board' now, if any
+        """
+        groups, group = self.running, self.runner.group
+        if group is None: return None
+        return next((job for job in groups[group][3] if board in job.boards), None)
+
+    def plan(self, jobs):
+        """
+        Returns the groups (steps, boards, force, jobs) to run the jobs, in order
+        """
+        # jobs with the same steps are merged, unless a board of the job is used by a later group
+        groups = []
+        for job in sorted(jobs, key=lambda job: -job.priority):
+            inputs = self.runner.inputs(job.steps)
+            for index, group in enumerate(groups):
+                if group['inputs'] == inputs and group['force'] == job.force and not any(board in later['boards'] for later in groups[index:] for board in job.boards):
+                    group['boards'] += job.boards
+                    group['jobs'].append(job)
+                    break
+            else:
+                groups.append({'inputs': inputs, 'force': job.force, 'steps': job.steps, 'boards': list(job.boards), 'jobs': [job], 'bitstream': self._bitstream(job.steps)})
+
+        # reordered to keep the same bitstream, a group can't go before an earlier one with a board in common
+        ordered = []
+        current = self._enabled()
+        while groups:
+            ready = [group for index, group in enumerate(groups) if not any(set(group['boards']) & set(earlier['boards']) for earlier in groups[:index])]
+            previous = ordered[-1]['bitstream'] if ordered else None
+            group = next((group for group in ready if previous is not None and group['bitstream'] == previous), ready[0])
+            groups.remove(group)
+            # the enabled board first, no switch needed
+            if current in group['boards']:
+                group['boards'].remove(current)
+                group['boards'].insert(0, current)
+            current = group['boards'][-1] if group['boards'] else current
+            ordered.append(group)
+        return [(group['steps'], group['boards'], group['force'], group['jobs']) for group in ordered]
+
+    def _bitstream(self, steps):
+        # sha256 of the first bitstream of the steps, None if they don't program any
+        return next((self.runner.staging.get(step.parameter)[0] for step in steps if step.command == 'bitstream'), None)
+
+    def _enabled(self):
+        # the only enabled board, if any
+        enabled = [board for board, state in self.runner.fpgas.get_state().items() if state]
+        return enabled[0] if len(enabled) == 1 else None
+
+    def run(self):
+        """
+        Plans to run all the queued jobs, when it finishes their state is updated
+        Returns the function that does it (which returns the jobs), and its number of steps
+        Planning waits for the bitstreams to be staged (to group them), don't call it from the interface thread
+        """
+        with self._lock:
+            jobs, self.queue = self.queue, []
+            for job in jobs:
+                job.state = 'running'
+        groups = self.plan(jobs)
+
+        def skip(board):
+            job = self.owner(board)
+            return job is not None and job.cancelled.is_set()
+
+        function, total = self.runner.program_batch([(steps, boards, force) for steps, boards, force, _ in groups], skip)
+
+        def f():
+            self.running = groups
+            try:
+                for (_, _, _, group_jobs), failed in zip(groups, function()):
+                    for job in group_jobs:
+                        job.failed |= failed & set(job.boards)
+            finally:
+                self.running = []
+                for job in jobs:
+                    job.state = 'cancelled' if job.cancelled.is_set() or self.runner.cancelled.is_set() else 'failed' if job.failed else 'done'
+            return jobs
+
+        return f, total
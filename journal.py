@@ -0,0 +1,121 @@
+"""
+Append-only journal of the programming runs, to resume them after a cancel or a crash.
+Each line is a compact json record:
+{"type":"start","run":id,"inputs":hash,"time":t} when a run starts (or "resume" when it continues)
+{"type":"step","run":id,"board":id,"step":index,"ok":true,"start":t,"end":t} after each step
+Each record is flushed when written (it survives a crash of the tool), but only synced to disk every
+JOURNAL_SYNC_INTERVAL seconds or JOURNAL_SYNC_RECORDS records.
+When a run completes successfully its records are replaced by a single summary line.
+"""
+import json
+import os
+from threading import Lock
+from time import monotonic, time
+from uuid import uuid4
+
+import log
+from CONFIG import JOURNAL_FILE, JOURNAL_SYNC_INTERVAL, JOURNAL_SYNC_RECORDS, JOURNAL_HISTORY
+
+logger = log.get(__name__)
+
+
+class Journal:
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = os.path.expanduser(path)
+        self.run = None  # id of the current run
+        self._file = None
+        self._pending = 0  # records not synced yet
+        self._synced = monotonic()
+        self._lock = Lock()
+
+    def _load(self):
+        # all the records (a truncated last line is ignored)
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning("Ignoring corrupted journal line: %s", line.strip())
+        return records
+
+    def start(self, inputs, board_steps, resume=False):
+        """
+        Starts recording a run of steps with the given 'inputs' hash, 'board_steps' are the indexes of the per-board steps
+        If 'resume' and the last unfinished run had the same inputs, continues it and returns the boards it completed
+        """
+        records = self._load()
+        finished = {record['run'] for record in records if record['type'] == 'summary'}
+        runs = [record for record in records if record['type'] == 'start' and record['run'] not in finished]
+
+        completed = set()
+        if resume and runs and runs[-1]['inputs'] == inputs:
+            self.run = runs[-1]['run']
+            done = {}
+            for record in records:
+                if record['type'] == 'step' and record['run'] == self.run and record['ok'] and record['board'] is not None:
+                    done.setdefault(record['board'], set()).add(record['step'])
+            completed = {board for board, steps in done.items() if steps >= set(board_steps)}
+            self._write({'type': 'resume', 'run': self.run, 'time': time()})
+        else:
+            self.run = uuid4().hex[:12]
+            self._write({'type': 'start', 'run': self.run, 'inputs': inputs, 'time': time()})
+        return completed
+
+    def record(self, board, step, ok, start, end):
+        """
+        Records the result of step number 'step' on 'board' (None for global steps)
+        """
+        self._write({'type': 'step', 'run': self.run, 'board': board, 'step': step, 'ok': ok, 'start': round(start, 3), 'end': round(end, 3)})
+
+    def _write(self, record):
+        # appends a record, syncs if needed
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= JOURNAL_SYNC_RECORDS or monotonic() - self._synced >= JOURNAL_SYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._synced = monotonic()
+
+    def finish(self):
+        """
+        Marks the current run as completed, and compacts the journal
+        """
+        records = self._load()
+        steps = [record for record in records if record['type'] == 'step' and record['run'] == self.run]
+        start = next(record['time'] for record in records if record['type'] == 'start' and record['run'] == self.run)
+        summaries = [record for record in records if record['type'] == 'summary']
+        summaries.append({'type': 'summary', 'run': self.run, 'steps': len(steps), 'start': start, 'end': time()})
+
+        # only the summaries of the last runs are kept
+        with self._lock:
+            self.close()
+            temporal = f"{self.path}.tmp"
+            with open(temporal, 'w', encoding='utf-8') as file:
+                for record in summaries[-JOURNAL_HISTORY:]:
+                    file.write(json.dumps(record, separators=(',', ':')) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporal, self.path)
+        self.run = None
+
+    def close(self):
+        """
+        Syncs and closes the file
+        """
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,142 @@
+"""
+Logging, without blocking the threads that log.
+Each module has its own logger (log.get(__name__)). The records are put in a bounded queue (LOG_QUEUE_SIZE) and written
+by a background thread to the console (LOG_LEVEL) and to a rotating file (LOG_FILE, at LOG_FILE_LEVEL).
+When the queue is full the records are dropped instead of waiting (warnings and errors wait a little first),
+and a summary with the number of dropped records is logged as soon as there is room again.
+The verbose output (commands sent, devices found, command outputs...) is logged at DEBUG level.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import sys
+from queue import Full, Queue
+from threading import Lock
+
+from CONFIG import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_FILE, LOG_FILE_LEVEL, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS
+
+ROOT = 'fdt'
+WARNING_WAIT = 0.1  # seconds a warning or error waits for room in the queue
+
+_lock = Lock()
+_listener = None
+_queue = None
+_handler = None
+
+
+class _BoundedQueueHandler(logging.handlers.QueueHandler):
+    # puts the records in the queue without waiting, counting the dropped ones
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._lock = Lock()
+
+    def summarize(self, block=False):
+        # logs the number of records dropped since the last summary, returns false if there is no room yet
+        with self._lock:
+            if not self.dropped: return True
+            try:
+                self.queue.put(self.prepare(logging.makeLogRecord({'name': ROOT, 'levelno': logging.WARNING, 'levelname': 'WARNING', 'msg': f"{self.dropped} log records dropped, the output was too slow"})), block)
+                self.dropped = 0
+                return True
+            except Full:
+                return False
+
+    def prepare(self, record):
+        # only the message is formatted here (its arguments may change later), the rest in the background
+        if record.exc_info or record.stack_info: return super().prepare(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped and not self.summarize():
+            with self._lock:
+                self.dropped += 1
+            return
+        try:
+            self.queue.put(record, block=record.levelno >= logging.WARNING, timeout=WARNING_WAIT)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    # waits for room to stop, instead of failing when the queue is full
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class _Console(logging.StreamHandler):
+    # writes to the current sys.stdout (the command line redirects it to stderr)
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def setup():
+    """
+    Starts the background writer, if not started yet. Called by get()
+    """
+    global _listener, _queue, _handler
+    with _lock:
+        if _listener is not None: return
+
+        console = _Console()
+        console.setLevel(LOG_LEVEL)
+        console.setFormatter(logging.Formatter("%(message)s"))
+        handlers = [console]
+        if LOG_FILE:
+            path = os.path.expanduser(LOG_FILE)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                file = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8', delay=True)
+                file.setLevel(LOG_FILE_LEVEL)
+                file.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s [%(threadName)s] %(name)s: %(message)s"))
+                handlers.append(file)
+            except OSError as e:
+                console.handle(logging.makeLogRecord({'msg': f"Unable to log to {path}: {e}"}))
+
+        logging.logProcesses = logging.logMultiprocessing = False  # not logged, cheaper records
+        _queue = Queue(LOG_QUEUE_SIZE)
+        root = logging.getLogger(ROOT)
+        root.setLevel(min(handler.level for handler in handlers))
+        _handler = _BoundedQueueHandler(_queue)
+        root.addHandler(_handler)
+        root.propagate = False
+        _listener = _Listener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop)
+
+
+def flush():
+    """
+    Waits until the pending records are written
+    """
+    if _listener is not None: _queue.join()
+
+
+def stop():
+    """
+    Writes the pending records and stops the background writer
+    """
+    global _listener
+    with _lock:
+        if _listener is None: return
+        _handler.summarize(block=True)
+        _listener.stop()
+        _listener = None
+
+
+def get(name):
+    """
+    Returns the logger of a module (its __name__)
+    """
+    setup()
+    if name == '__main__': name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    return logging.getLogger(f"{ROOT}.{name}")
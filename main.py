@@ -1,125 +1,180 @@
 import os
-import subprocess
-
+import sys
+
+import cli
+import daemon
+import log
+import pipeline
+import planner
+import testphase
+import tracing
+from bitcache import BitstreamCache
 from CONFIG import VIVADO_BITSTREAM_LOAD
-from UI import UI
 from admin import run_as_admin
 from fpgas import FPGAs
+from jobs import Scheduler
+from journal import Journal
+from poller import Poller
+from runner import Runner
+from sessions import Sessions
+from staging import Staging
 from vivado import Vivado
 
+logger = log.get(__name__)
+
 
 def main():
+    # the interface is imported here, so that the command line doesn't load it
+    from UI import UI
+
     # init
     vivado = Vivado()
     fpgas = FPGAs()
+    programmed = BitstreamCache()
+    staging = Staging()
+    journal = Journal()
+    sessions = Sessions()
+    runner = Runner(vivado, fpgas, programmed, staging, journal, sessions)
+    scheduler = Scheduler(runner)
+    poller = Poller(fpgas.enumerate, lambda *event: ui.window.write_event_value('devices', event))
 
     class CustomUI(UI):
         def __init__(self):
             super().__init__(vivado.is_vivado_available())
+            runner.step = self.step
+            runner.wait = self.wait
+            runner.cancelled = self.cancelled
 
             # do nothing by default, override for custom
-            self.refresh = lambda: None
-            self.autoRefresh = lambda: None
             self.bitstream = lambda: None
             self.preScript = lambda: None
             self.postScript = lambda: None
 
-        # def utils
-        def do_program(self):
-            for command, _, parameter in self.steps_values:
-                if command == 'pause':
-                    self.wait("Paused")
-                elif command == 'script':
-                    subprocess.call(parameter)
-                elif command == 'bitstream':
-                    vivado.program(parameter)
-                else:
-                    print("Ignoring unknown programming command:", command, parameter)
+        # devices
 
-        def _has_bitream_step(self):
-            return any(c[0] == 'bitstream' for c in self.steps_values)
+        def devices(self):
+            # new snapshot from the poller
+            snapshot, changes = self.values['devices']
+            for label, devices in zip(changes._fields, changes):
+                for device in devices:
+                    logger.info("Device %s: %s", label, device.id)
+            fpgas.apply(snapshot)
 
-        def enableAll(self):
+        def refresh(self):
+            poller.refresh()
+
+        def autoRefresh(self):
+            poller.set_auto(self.get_value('autoRefresh', True))
+
+        def background(self, function, total):
+            # refresh the devices after any operation
             def f():
-                for i in fpgas:
-                    self.step(f"Enabling board {i + 1}")
-                    fpgas.enable(i)
+                try:
+                    function()
+                finally:
+                    poller.refresh()
 
-            self.background(f, len(fpgas))
+            super().background(f, total)
+
+        # def utils
+        def _report_skipped(self):
+            # shows the bitstreams not programmed because they were already
+            if runner.skipped:
+                self.notify(f"Skipped {len(runner.skipped)} already programmed bitstreams, saved {sum(runner.skipped):.1f}s\n(check 'Force' to program them anyway)")
+
+        def enableAll(self):
+            operations = planner.plan(fpgas.get_state(), planner.every(fpgas, True))
+            self.background(lambda: runner.execute(operations), len(operations))
 
         def disableAll(self):
+            operations = planner.plan(fpgas.get_state(), planner.every(fpgas, False))
+            self.background(lambda: runner.execute(operations), len(operations))
+
+        def _report_tests(self):
+            # shows the results of the test phase
+            passed = sum(result.passed for result in runner.tests)
+            self.table(f"Tests: {passed}/{len(runner.tests)} passed", *testphase.summary(runner.tests))
+
+        def programAll(self, resume=False):
+            test = self.get_value('test', False)
+            function, total = runner.program_all(self.steps_values, force=self.get_value('force', False), test=test, resume=resume)
+
             def f():
-                for i in fpgas:
-                    self.step(f"Disabling board {i + 1}")
-                    fpgas.disable(i)
+                function()
+                self._report_skipped()
+                if test: self._report_tests()
 
-            self.background(f, len(fpgas))
+            self.background(f, total)
+
+        def resumeAll(self):
+            self.programAll(resume=True)
+
+        def testAll(self):
+            function, total = runner.test_all()
 
-        def programAll(self):
             def f():
-                states = fpgas.get_state()
-                for i in fpgas:
-                    self.step(f"Enabling board {i + 1}")
-                    fpgas.enable(i)
-                    for j in fpgas:
-                        if j != i:
-                            self.step(f"Disabling board {j + 1}")
-                            fpgas.disable(j)
-                    if i == 0 and self._has_bitream_step():
-                        self.step("Initializing Vivado (may take a while)")
-                        vivado.prepare()
-                    self.step(f"Programming board {i + 1}")
-                    self.do_program()
-                for i, state in states:
-                    self.step(f"Restoring {'enabled' if state else 'disabled'} board {i + 1}")
-                    fpgas.toggle(i, state)
-
-            self.background(f, len(fpgas) * (1 + (len(fpgas) - 1) + 1) + 1 + len(fpgas))
+                function()
+                self._report_tests()
+
+            self.background(f, total)
 
         def toggle(self, i):
-            def f(i):
-                if fpgas.enabled(i) is None:
+            def f(board):
+                if fpgas.enabled(board) is None:
                     self.step("Skipping")
-                if fpgas.enabled(i):
+                if fpgas.enabled(board):
                     self.step("Disabling")
-                    fpgas.disable(i)
+                    fpgas.disable(board)
                 else:
                     self.step("Enabling")
-                    fpgas.enable(i)
+                    fpgas.enable(board)
 
-            self.background(lambda: f(int(i)), 1)
+            board = fpgas.at(int(i))
+            self.background(lambda: f(board), 1)
 
         def enableOnly(self, i):
-            def f(i):
-                self.step("Enabling board")
-                fpgas.enable(i)
-                for j in fpgas:
-                    if j != i:
-                        self.step(f"Disabling board {j + 1}")
-                        fpgas.disable(j)
-
-            self.background(lambda: f(int(i)), 1 + (len(fpgas) - 1))
+            states = fpgas.get_state()
+            operations = planner.plan(states, planner.only(states, fpgas.at(int(i))))
+            self.background(lambda: runner.execute(operations), len(operations))
 
         def program(self, i):
-            def f(i):
-                states = fpgas.get_state()
-                self.step("Enabling board")
-                fpgas.enable(i)
-                for j in fpgas:
-                    if j != i:
-                        self.step(f"Disabling board {j + 1}")
-                        fpgas.disable(j)
-                if self._has_bitream_step():
-                    self.step("Initializing Vivado (may take a while)")
-                    vivado.prepare()
-                self.step("Programming board")
-                self.do_program()
-
-                for i, state in states:
-                    self.step(f"Restoring {'enabled' if state else 'disabled'} board {i + 1}")
-                    fpgas.toggle(i, state)
-
-            self.background(lambda: f(int(i)), 1 + (len(fpgas) - 1) + 2 + len(fpgas))
+            function, total = runner.program_all(self.steps_values, [fpgas.at(int(i))], force=self.get_value('force', False))
+
+            def f():
+                function()
+                self._report_skipped()
+
+            self.background(f, total)
+
+        def queue(self, i):
+            # queues the current steps for the board, or unqueues it
+            board = fpgas.at(int(i))
+            job = scheduler.queued(board)
+            if job is not None:
+                scheduler.cancel(job)
+            else:
+                scheduler.submit(list(self.steps_values), [board], force=self.get_value('force', False))
+
+        def runQueue(self):
+            def f():
+                # planned here, it waits for the bitstreams to be staged
+                function, self.total = scheduler.run()
+                jobs = function()
+                self._report_skipped()
+                failed = [job for job in jobs if job.state == 'failed']
+                if failed:
+                    self.notify("Failed boards: " + ", ".join(fpgas.name(board) for job in failed for board in job.failed))
+
+            self.background(f, len(scheduler.queue))
+
+        def clearQueue(self):
+            scheduler.clear()
+
+        def rename(self, i):
+            board = fpgas.at(int(i))
+            alias = self.ask(f"New name for {fpgas.id(board)}\n(empty to use the default one)", fpgas.name(board))
+            if alias is not None:
+                fpgas.rename(board, alias.strip())
 
         # steps
 
@@ -155,21 +210,26 @@ def main():
 
         def stepsPause(self):
             # add pause
-            self._addStep('pause', 'Pause', None)
+            self._addStep(pipeline.step('pause', scope=self._scope()))
 
         def stepsScript(self):
             # add script
             file = self.values['stepsScript']
-            self._addStep('script', f'Run "{os.path.basename(file)}"', file)
+            self._addStep(pipeline.step('script', file, self._scope(), not self.get_value('stepsParallel', False)))
 
         def stepsBitstream(self):
             # add bistream
             file = self.values['stepsBitstream']
-            self._addStep('bitstream', f'Program "{os.path.basename(file)}"', file)
+            self._addStep(pipeline.step('bitstream', file))
+            staging.stage(file)
             if VIVADO_BITSTREAM_LOAD:
                 vivado.prepare(wait_ready=False)
 
-        def _addStep(self, *step):
+        def _scope(self):
+            # scope of the added steps
+            return pipeline.GLOBAL if self.get_value('stepsOnce', False) else pipeline.BOARD
+
+        def _addStep(self, step):
             selection = self.get_steps_selection()
             if selection is None:
                 # if nothing is selected, add at the end
@@ -188,18 +248,25 @@ def main():
             self.window['steps'](values=[x[1] for x in self.steps_values] + [""], set_to_index=selection, scroll_to_index=selection)
 
     ui = CustomUI()
+    tracing.serve()
+    poller.start()
 
     # loop
     while ui.is_shown():
         # update
-        fpgas.update()
-        ui.update(fpgas)
+        ui.update(fpgas, list(scheduler.queue))
 
         # tick
         ui.tick()
 
-    vivado.close()
-    print("Bye!")
+    poller.stop()
+    staging.close()
+    journal.close()
+    fpgas.close()
+    sessions.close()
+    vivado.close(keep_daemon=True)
+    tracing.export()
+    logger.info("Bye!")
 
 
 @run_as_admin
@@ -207,13 +274,19 @@ def main_admin():
     try:
         main()
     except Exception as e:
-        print("An exception occurred:")
-        print(e)
+        logger.exception("An exception occurred: %s", e)
+        log.flush()
         input("Press enter to exit")
 
 
 if __name__ == '__main__':
-    if 'no_admin' in os.environ:
+    if sys.argv[1:2] == ['--vivado-daemon']:
+        # packaged executable, run as the daemon
+        daemon.main(sys.argv[2:])
+    elif set(sys.argv[1:]) & set(cli.COMMANDS):
+        # packaged executable, run a command without the interface
+        sys.exit(cli.main(sys.argv[1:]))
+    elif 'no_admin' in os.environ:
         main()
     else:
         main_admin()
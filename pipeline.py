@@ -0,0 +1,213 @@
+"""
+Execution engine for the programming steps.
+Each step runs on every board (BOARD) or once (GLOBAL), and is exclusive if it needs its board to be the only enabled one.
+Exclusive steps run in order on a single lane, switching boards as needed. The rest run on a worker pool as soon as
+the previous step of the same board (or the previous global step, for all boards) finishes.
+Bitstreams of 'concurrent' boards (that don't need the others disabled, see sessions.py) also run on the pool.
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import RLock
+from time import monotonic
+from typing import NamedTuple
+
+from CONFIG import PIPELINE_WORKERS
+from cancel import CancelException
+
+BOARD = 'board'
+GLOBAL = 'global'
+
+
+class Step(NamedTuple):
+    command: str  # 'pause', 'script' or 'bitstream'
+    description: str
+    parameter: str | None
+    scope: str = BOARD  # run on each board, or once
+    exclusive: bool = True  # needs the board to be the only enabled one
+
+
+def step(command, parameter=None, scope=BOARD, exclusive=True):
+    """
+    Creates a step, with its description
+    Only scripts can run without exclusive access, and bitstreams are always programmed on each board
+    """
+    if command == 'pause':
+        description = "Pause"
+    elif command == 'script':
+        description = f'Run "{os.path.basename(parameter)}"'
+    elif command == 'bitstream':
+        description = f'Program "{os.path.basename(parameter)}"'
+        scope = BOARD
+    else:
+        raise ValueError(f"Unknown step {command}")
+    exclusive = exclusive or command != 'script'
+    description += " once" if scope == GLOBAL else ""
+    description += " (parallel)" if not exclusive else ""
+    return Step(command, description, parameter, scope, exclusive)
+
+
+class Timing(NamedTuple):
+    """
+    Execution of a step, 'board' is None for global steps
+    """
+    step: Step
+    board: str | None
+    start: float  # seconds since the pipeline started
+    elapsed: float  # seconds
+    error: BaseException | None
+
+
+class Node:
+    def __init__(self, step, board, dependencies):
+        # one execution of a step
+        self.step = step
+        self.board = board
+        self.dependencies = dependencies
+        self.future = Future()
+
+
+class Pipeline:
+    def __init__(self, steps, boards, run, switch, concurrent=()):
+        """
+        Plans the execution of the steps on the boards
+        'run(step, board)' performs a step (board is None for global steps)
+        'switch(board, keep)' makes 'board' the only enabled one except the 'keep' boards, returns false if it can't be done
+        The bitstreams of 'concurrent' boards don't need a switch, unless there are other exclusive steps in their group
+        """
+        self.run = run
+        self.switch = switch
+        self.nodes = []
+        self.lane = []  # in order: boards to switch to (with the boards kept), and exclusive nodes
+        self.switches = []  # boards switched to, in order
+        self.pooled = set()  # exclusive nodes run on the pool
+        self.timings = []
+        self._lock = RLock()  # also taken by the callbacks of the futures completed while holding it
+
+        # consecutive per-board steps are grouped, global ones split the groups
+        previous = {board: [] for board in boards}  # dependencies of the next step of each board
+        groups = []
+        for s in steps:
+            if s.scope == GLOBAL:
+                groups.append(s)
+            elif groups and isinstance(groups[-1], list):
+                groups[-1].append(s)
+            else:
+                groups.append([s])
+
+        for group in groups:
+            if isinstance(group, Step):
+                node = self._add(group, None, [node for nodes in previous.values() for node in nodes] or self._last_global())
+                previous = {board: [node] for board in boards}
+                if group.exclusive: self.lane.append(node)
+                continue
+            bitstreams = all(s.command == 'bitstream' for s in group if s.exclusive)
+            for board in boards:
+                exclusive = []
+                for s in group:
+                    node = self._add(s, board, previous[board])
+                    previous[board] = [node]
+                    if s.exclusive: exclusive.append(node)
+                if board in concurrent and bitstreams:
+                    self.pooled.update(exclusive)
+                elif exclusive:
+                    self.lane += [(board, concurrent if bitstreams else ())] + exclusive
+                    self.switches.append(board)
+
+    def _add(self, step, board, dependencies):
+        node = Node(step, board, list(dict.fromkeys(dependencies)))
+        self.nodes.append(node)
+        return node
+
+    def _last_global(self):
+        # last global node (when there are no boards)
+        globals = [node for node in self.nodes if node.board is None]
+        return globals[-1:]
+
+    def __len__(self):
+        """
+        number of steps to execute
+        """
+        return len(self.nodes)
+
+    def execute(self, cancelled):
+        """
+        Runs all the steps, returns their timings (in order of completion)
+        Steps after a failed one on the same board are not run, and fail with the same error
+        Global steps wait for all the boards, but only a failed global step prevents them from running
+        Raises CancelException if 'cancelled' (an Event) is set
+        """
+        self._start = monotonic()
+        with ThreadPoolExecutor(PIPELINE_WORKERS, thread_name_prefix="pipeline") as executor:
+            try:
+                # the rest start as soon as their dependencies finish
+                for node in self.nodes:
+                    if not node.step.exclusive or node in self.pooled: self._schedule(node, executor, cancelled)
+
+                # the exclusive ones, in order
+                current = None
+                for index, entry in enumerate(self.lane):
+                    if cancelled.is_set(): raise CancelException()
+                    if not isinstance(entry, Node):
+                        # once the previous steps of the board (or all the boards, after a global one) finish
+                        wait([dependency.future for dependency in self.lane[index + 1].dependencies])
+                        board, keep = entry
+                        current = board if self.switch(board, keep) else None
+                    elif entry.board is not None and entry.board != current:
+                        self._finish(entry, LookupError(f"Board {entry.board} not available"), monotonic())
+                    else:
+                        wait([dependency.future for dependency in entry.dependencies])
+                        self._execute(entry)
+                        if isinstance(entry.future.exception(), CancelException): raise CancelException()
+
+                wait([node.future for node in self.nodes])
+            except (CancelException, KeyboardInterrupt):
+                cancelled.set()
+                raise
+            finally:
+                if cancelled.is_set():
+                    for node in self.nodes:
+                        if not node.future.done(): self._finish(node, CancelException(), monotonic())
+        if cancelled.is_set(): raise CancelException()
+        return self.timings
+
+    def _schedule(self, node, executor, cancelled):
+        # submits the node once all its dependencies are done
+        pending = [len(node.dependencies)]
+
+        def ready(_=None):
+            with self._lock:
+                pending[0] -= 1
+                if pending[0] > 0: return
+            if cancelled.is_set():
+                self._finish(node, CancelException(), monotonic())
+            else:
+                executor.submit(self._execute, node)
+
+        if not node.dependencies:
+            pending[0] = 1
+            ready()
+        for dependency in node.dependencies:
+            dependency.future.add_done_callback(ready)
+
+    def _execute(self, node):
+        # runs a node, unless a dependency failed (for global nodes, only the global ones count)
+        start = monotonic()
+        failed = [dependency.future.exception() for dependency in node.dependencies if dependency.future.exception() is not None and (node.board is not None or dependency.board is None)]
+        if failed:
+            self._finish(node, failed[0], start)
+            return
+        try:
+            self.run(node.step, node.board)
+            self._finish(node, None, start)
+        except Exception as e:
+            self._finish(node, e, start)
+
+    def _finish(self, node, error, start):
+        # records the timing and completes the node
+        with self._lock:
+            if node.future.done(): return
+            self.timings.append(Timing(node.step, node.board, start - self._start, monotonic() - start, error))
+            if error is None:
+                node.future.set_result(None)
+            else:
+                node.future.set_exception(error)
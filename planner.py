@@ -0,0 +1,59 @@
+"""
+Pure functions to plan the enable/disable operations needed to switch between board states.
+States are dicts {board: enabled}, with enabled being True, False or None (unknown/undefined).
+Operations are tuples (ENABLE or DISABLE, board).
+"""
+
+ENABLE = 'enable'
+DISABLE = 'disable'
+
+
+def plan(current, desired):
+    """
+    Returns the minimal ordered list of operations to go from the 'current' states to the 'desired' ones.
+    Boards not in 'desired', or desired as None, are kept as they are.
+    Boards with an undefined current state can't be changed, so they are skipped.
+    Enables are returned before disables (so there is always a board available).
+    """
+    return [
+        (ENABLE, board) for board, state in desired.items() if state is True and current.get(board) is False
+    ] + [
+        (DISABLE, board) for board, state in desired.items() if state is False and current.get(board) is True
+    ]
+
+
+def only(current, board):
+    """
+    Returns the desired states to have only 'board' enabled
+    """
+    return {other: other == board for other in current}
+
+
+def every(current, state):
+    """
+    Returns the desired states to have all boards on the same 'state'
+    """
+    return {board: state for board in current}
+
+
+def apply(current, operations):
+    """
+    Returns the states after performing the given operations
+    """
+    states = dict(current)
+    for operation, board in operations:
+        states[board] = operation == ENABLE
+    return states
+
+
+def sequence(current, boards):
+    """
+    Plans to have each board of 'boards' as the only enabled one, one after another.
+    Returns the list of operations for each board, and the final states
+    """
+    plans = []
+    for board in boards:
+        operations = plan(current, only(current, board))
+        current = apply(current, operations)
+        plans.append(operations)
+    return plans, current
@@ -0,0 +1,75 @@
+from typing import NamedTuple
+
+from CONFIG import FPGA_KEYS_ID, FPGA_KEYS_DESCRIPTION, FPGA_KEYS_STATUS, FPGA_KEYS_PARENT
+
+
+class Device(NamedTuple):
+    """
+    Immutable record of a detected device, as reported by the system
+    (a NamedTuple, so it has no __dict__ and is as compact as a tuple)
+    """
+    id: str
+    device_description: str
+    status: str
+    parent: str = ''  # instance id of the parent device, only when enumerated with its relations
+
+
+# field of each key (any alias)
+KEYS = {
+    **{key: 'id' for key in FPGA_KEYS_ID},
+    **{key: 'device_description' for key in FPGA_KEYS_DESCRIPTION},
+    **{key: 'status' for key in FPGA_KEYS_STATUS},
+    **{key: 'parent' for key in FPGA_KEYS_PARENT},
+}
+
+# field of each line of a device block, used only for unknown keys (other languages)
+POSITIONS = {0: 'id', 1: 'device_description', 5: 'status'}
+
+
+def parse(lines, description=None):
+    """
+    Parses the output lines of a pnputil enumeration as they are read, yields the devices found
+    If 'description' is given, the devices with any other description are skipped as soon as it is read
+    """
+    fields = {}
+    index = 0
+    skip = False
+    for line in lines:
+        key, separator, value = line.partition(':')
+
+        # blank line: end of block
+        if not separator and not key.strip():
+            if 'id' in fields and not skip:
+                yield _device(fields)
+            fields = {}
+            index = 0
+            skip = False
+            continue
+
+        # header or skipped device
+        if not separator or skip:
+            continue
+
+        # field
+        field = KEYS.get(key.strip())
+        if field is None:
+            field = POSITIONS.get(index)
+            if field in fields: field = None  # already found by key
+        if field is not None:
+            fields[field] = value.strip()
+            if field == 'device_description' and description is not None and fields[field] != description:
+                skip = True
+        index += 1
+
+    # last block, if the output doesn't end with a blank line
+    if 'id' in fields and not skip:
+        yield _device(fields)
+
+
+def _device(fields):
+    return Device(
+        id=fields['id'],
+        device_description=fields.get('device_description', ''),
+        status=fields.get('status', ''),
+        parent=fields.get('parent', ''),
+    )
@@ -0,0 +1,94 @@
+from threading import Event, Thread
+from typing import NamedTuple
+
+import log
+from CONFIG import UI_REFRESH_TIMEOUT
+
+logger = log.get(__name__)
+
+
+class Changes(NamedTuple):
+    """
+    Differences between two snapshots of devices
+    """
+    added: tuple
+    removed: tuple
+    changed: tuple
+
+
+def diff(old, new):
+    """
+    Computes the added, removed and changed devices (compared by id) from snapshot 'old' to snapshot 'new'
+    """
+    old = {device.id: device for device in old or ()}
+    new = {device.id: device for device in new}
+    return Changes(
+        added=tuple(device for id, device in new.items() if id not in old),
+        removed=tuple(device for id, device in old.items() if id not in new),
+        changed=tuple(device for id, device in new.items() if id in old and old[id] != device),
+    )
+
+
+class Poller:
+    def __init__(self, enumerate, publish):
+        """
+        Periodically calls 'enumerate' from a dedicated thread
+        'publish(snapshot, changes)' is called only when the snapshot differs from the previous one, or after refresh()
+        """
+        self.enumerate = enumerate
+        self.publish = publish
+        self.snapshot = None
+        self.auto = True
+        self._force = False  # publish the next snapshot even if unchanged
+
+        self._wake = Event()
+        self._stopped = False
+        self._thread = Thread(target=self._loop, name="poller", daemon=True)
+
+    def start(self):
+        """
+        Starts polling in the background
+        """
+        self._thread.start()
+
+    def refresh(self):
+        """
+        Asks for a new enumeration as soon as possible, published even if unchanged (the boards may have been modified
+        locally meanwhile, like the undefined state set during an operation)
+        """
+        self._force = True
+        self._wake.set()
+
+    def set_auto(self, auto):
+        """
+        Enables or disables the periodic enumeration, manual refreshes are always performed
+        """
+        self.auto = auto
+        self._wake.set()
+
+    def stop(self):
+        """
+        Stops polling, a running enumeration is not interrupted
+        """
+        self._stopped = True
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopped:
+            self._wake.clear()
+            force, self._force = self._force, False
+
+            # enumerate
+            try:
+                snapshot = tuple(self.enumerate())
+            except Exception as e:
+                logger.warning("Unable to enumerate devices: %s", e)
+            else:
+                # publish only changes (the first snapshot and the refreshed ones are always published)
+                changes = diff(self.snapshot, snapshot)
+                if self.snapshot is None or force or any(changes):
+                    self.snapshot = snapshot
+                    self.publish(snapshot, changes)
+
+            # wait
+            self._wake.wait(UI_REFRESH_TIMEOUT / 1000 if self.auto else None)
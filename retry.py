@@ -0,0 +1,66 @@
+import random
+from subprocess import CalledProcessError
+from time import monotonic, sleep
+
+import tracing
+from CONFIG import FPGA_COMMAND_FATAL_CODES
+
+
+class Retry:
+    def __init__(self, attempts, delay, max_delay, deadline, jitter=0.25, name=None):
+        """
+        Retry policy: up to 'attempts' attempts in 'deadline' seconds
+        waiting 'delay' seconds after the first one, doubled after each attempt up to 'max_delay',
+        and randomized by +-'jitter' (ratio) so concurrent retries don't happen all at once
+        Retries are counted in the metric fdt_retries_total, labelled with 'name'
+        """
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+        self.name = name
+
+    def __iter__(self):
+        """
+        Iterates the attempt numbers (starting at 1), sleeping between them
+        Stops when the attempts are exhausted or the deadline would expire
+        """
+        end = monotonic() + self.deadline
+        delay = self.delay
+        for attempt in range(1, self.attempts + 1):
+            if attempt > 1:
+                wait = min(delay, self.max_delay) * random.uniform(1 - self.jitter, 1 + self.jitter)
+                if monotonic() + wait > end: return
+                sleep(wait)
+                delay *= 2
+                tracing.count('retries', operation=self.name)
+            yield attempt
+
+    def call(self, function, *args):
+        """
+        Calls 'function(*args)' until it doesn't raise, returns its result
+        Fatal errors are raised immediately, retryable ones only if all the attempts fail
+        """
+        error = TimeoutError("No attempts were made")
+        for _ in self:
+            try:
+                return function(*args)
+            except Exception as e:
+                if not retryable(e): raise
+                error = e
+        raise error
+
+
+def retryable(error):
+    """
+    returns true iff retrying may fix the given error
+    """
+    if isinstance(error, CalledProcessError):
+        return error.returncode not in FATAL_CODES
+    if isinstance(error, (FileNotFoundError, PermissionError)):
+        return False  # missing command, not admin
+    return True
+
+
+FATAL_CODES = set(FPGA_COMMAND_FATAL_CODES)
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import subprocess
+from threading import Event
+from time import time
+
+import log
+import planner
+import testphase
+import tracing
+from CONFIG import TEST_COMMAND
+from bitcache import digest
+from pipeline import BOARD, Pipeline
+
+logger = log.get(__name__)
+
+
+class Runner:
+    def __init__(self, vivado, fpgas, programmed, staging, journal, sessions=None):
+        """
+        Board operations and programming steps, shared by the graphical and the command line interfaces
+        The interface sets the callbacks:
+        'step(message)' after each finished step, 'wait(message)' on pause steps
+        and 'report(event)' with a dict describing each finished operation
+        With 'sessions' (sessions.Sessions) the bitstreams of the boards with a unique target are programmed concurrently
+        """
+        self.vivado = vivado
+        self.fpgas = fpgas
+        self.programmed = programmed
+        self.staging = staging
+        self.journal = journal
+        self.sessions = sessions
+        self.cancelled = Event()  # set to stop the current operation
+        self.skipped = []  # seconds saved by each skipped bitstream
+        self._acquired = None  # board Vivado is connected to
+        self._concurrent = set()  # boards programmed by the sessions
+        self.tests = []  # results of the last test phase
+        self.group = None  # index of the group running in program_batch
+        self.step = lambda message: logger.info(message)
+        self.wait = lambda message: None
+        self.report = lambda event: None
+
+    def label(self, board):
+        """
+        user-friendly label of a board
+        """
+        index = self.fpgas.index(board)
+        return f"board {index + 1}" if index is not None else f"disconnected board {board}"
+
+    def _report(self, event, board, **details):
+        # describes a finished operation to the interface
+        name = self.fpgas.name(board) if self.fpgas.index(board) is not None else None
+        self.report({'event': event, 'board': board, 'name': name, **details})
+
+    def execute(self, operations, restoring=False):
+        """
+        Performs the planned operations concurrently, reporting each one as it finishes
+        """
+
+        def done(result):
+            state = 'enabled' if result.operation == planner.ENABLE else 'disabled'
+            self._report(result.operation, result.board, success=result.success, error=None if result.error is None else str(result.error))
+            if not result.success:
+                self.step(f"{self.label(result.board).capitalize()} couldn't be {state}")
+            elif restoring:
+                self.step(f"Restored {state} {self.label(result.board)}")
+            else:
+                self.step(f"{state.capitalize()} {self.label(result.board)}")
+
+        results = self.fpgas.run_all(operations, done)
+        for result in results:
+            if result.error is not None:
+                logger.warning("Error on %s %s: %s", result.operation, self.label(result.board), result.error)
+        return results
+
+    def switch(self, board, keep=()):
+        """
+        Makes 'board' the only enabled one (the 'keep' boards are left as they are)
+        Returns false if it is disconnected or couldn't be done
+        If it fails because boards were connected or disconnected meanwhile, it is tried again with the new ones
+        """
+        generation = self.fpgas.generation
+        if self._switch(board, keep): return True
+        self.fpgas.update()  # without the interface nothing else enumerates them during a run
+        if self.fpgas.generation == generation: return False
+        self.step("The connected boards changed, switching again")
+        return self._switch(board, keep)
+
+    def _switch(self, board, keep):
+        # switches once, with the current boards
+        if self.fpgas.index(board) is None:
+            self.step(f"Skipping disconnected {self.label(board)}")
+            return False
+        current = self.fpgas.get_state()
+        self._acquired = None
+        desired = {other: state for other, state in planner.only(current, board).items() if other not in keep}
+        return all(result.success for result in self.execute(planner.plan(current, desired)))
+
+    def run_step(self, step, board, force=False):
+        """
+        Performs a step on 'board' (None for global steps), returns true iff it succeeded
+        """
+        self.step(f"{step.description} on {self.label(board)}" if board is not None else step.description)
+        if step.command == 'pause':
+            self.wait("Paused")
+        elif step.command == 'script':
+            # with the board in the environment, like the test commands (not for global steps)
+            environment = None
+            if board is not None and self.fpgas.index(board) is not None:
+                environment = dict(os.environ, FDT_BOARD_NAME=self.fpgas.name(board), FDT_BOARD_ID=board, FDT_BOARD_INDEX=str(self.fpgas.index(board) + 1))
+            # from its original location (not staged), so it finds the files next to it
+            script = os.path.abspath(step.parameter)
+            code = subprocess.call(script, cwd=os.path.dirname(script), env=environment)
+            self._report('script', board, file=step.parameter, success=code == 0, code=code)
+            return code == 0
+        elif step.command == 'bitstream' and board in self._concurrent:
+            # on its own session, with the other boards enabled
+            if self.fpgas.index(board) is None:
+                self.step(f"Skipping disconnected {self.label(board)}")
+                return False
+            if not self.fpgas.enabled(board):
+                self.execute(planner.plan(self.fpgas.get_state(), {board: True}))
+            with self.sessions.session(board, self.cancelled) as vivado:
+                return self.program_bitstream(board, step.parameter, force, vivado)
+        elif step.command == 'bitstream':
+            if self._acquired != board:
+                self.step("Reconnecting Vivado" if self.vivado.ready else "Initializing Vivado (may take a while)")
+                with tracing.span('vivado_reacquire'):
+                    acquired = self.vivado.reacquire(self.cancelled)
+                if not acquired and self.vivado.is_vivado_available():
+                    self._report('bitstream', board, file=step.parameter, success=False, status='error', message="Unable to connect to the board")
+                    return False
+                self._acquired = board
+            return self.program_bitstream(board, step.parameter, force)
+        else:
+            logger.warning("Ignoring unknown programming command: %s %s", step.command, step.parameter)
+        return True
+
+    def program_bitstream(self, board, bitfile, force=False, vivado=None):
+        """
+        Programs the bitstream with 'vivado' (the main session by default), unless the board already has it (and not 'force')
+        Returns true iff the board has it afterwards
+        """
+        vivado = vivado or self.vivado
+        sha256, local = self.staging.get(bitfile)
+        if not force and self.programmed.matches(board, sha256, lambda: vivado.identify(self.cancelled)):
+            saved = self.programmed.saved(board)
+            self.skipped.append(saved)
+            self._report('bitstream', board, file=bitfile, success=True, status='skipped', saved_s=saved)
+            self.step(f"Skipped {os.path.basename(bitfile)} on {self.label(board)}, already programmed (saved {saved:.1f}s)")
+            return True
+
+        with tracing.span('program', board=self.fpgas.name(board)):
+            result = vivado.program(local, self.cancelled)
+        logger.debug("Programmed %s: %s after %d attempts in %d ms", os.path.basename(bitfile), result.status, result.attempts, result.elapsed_ms)
+        if result.status == 'ok' and sha256 is not None:
+            self.programmed.record(board, sha256, vivado.identify(self.cancelled), result.elapsed_ms)
+        else:
+            self.programmed.forget(board)
+        self._report('bitstream', board, file=bitfile, success=result.status == 'ok', status=result.status, attempts=result.attempts, elapsed_ms=result.elapsed_ms, message=result.message)
+        return result.status == 'ok'
+
+    def inputs(self, steps):
+        """
+        returns a hash of the steps and the content of their files
+        """
+        sha = hashlib.sha256()
+        for step in steps:
+            content = None if step.parameter is None else self.staging.get(step.parameter)[0] if step.command == 'bitstream' else digest(step.parameter)
+            sha.update(json.dumps([step.command, step.scope, step.exclusive, content]).encode('utf-8'))
+        return sha.hexdigest()
+
+    def program_all(self, steps, boards=None, force=False, test=False, resume=False):
+        """
+        Plans to run the steps (pipeline.Step) on 'boards' (all by default), and restore the states afterwards
+        or, if 'test', run the test phase on them (which leaves them enabled)
+        Each step is recorded in the journal, if 'resume' the boards completed by the last interrupted run are skipped
+        Returns the function that does it, and its number of steps
+        """
+        states = self.fpgas.get_state()
+        boards = list(states) if boards is None else boards
+        pipeline = Pipeline(steps, boards, self.run_step, self.switch)  # to count the steps
+        plans, final = planner.sequence(states, pipeline.switches)
+        restore = planner.plan(final, states)
+        run_tests, test_steps = self.test_all(boards) if test else (None, 0)
+
+        def f():
+            self.skipped.clear()
+            self._detect(steps, boards)
+            self._program(steps, boards, force, resume)
+            if test:
+                run_tests()
+            else:
+                self.execute(planner.plan(self.fpgas.get_state(), states), restoring=True)
+
+        return f, len(pipeline) + sum(map(len, plans)) + (test_steps if test else len(restore)) + has_bitstream(steps) * len(pipeline.switches)
+
+    def program_batch(self, groups, skip=lambda board: False):
+        """
+        Plans to run several groups of steps one after another, and restore the states once at the end
+        'groups' are tuples (steps, boards, force), a board can be in several of them
+        Boards with 'skip(board)' true when their turn comes are left out (they fail), 'group' is the index of the running group
+        Returns the function that does it (which returns the failed boards of each group), and its number of steps
+        """
+        states = self.fpgas.get_state()
+        pipelines = [Pipeline(steps, boards, self.run_step, self.switch) for steps, boards, _ in groups]  # to count the steps
+        plans, final = planner.sequence(states, [board for pipeline in pipelines for board in pipeline.switches])
+        restore = planner.plan(final, states)
+
+        def f():
+            self.skipped.clear()
+            self._detect([step for steps, _, _ in groups for step in steps], list(dict.fromkeys(board for _, boards, _ in groups for board in boards)))
+            failed = []
+            try:
+                for self.group, (steps, boards, force) in enumerate(groups):
+                    failed.append(self._program(steps, boards, force, skip=skip))
+            finally:
+                self.group = None
+            self.execute(planner.plan(self.fpgas.get_state(), states), restoring=True)
+            return failed
+
+        return f, sum(len(pipeline) + has_bitstream(steps) * len(pipeline.switches) for (steps, _, _), pipeline in zip(groups, pipelines)) + sum(map(len, plans)) + len(restore)
+
+    def _recorder(self, steps, force, failures, skip=lambda board: False):
+        # returns the function that runs and records a step, adding the failed ones to 'failures' (and raising)
+        indexes = {id(step): index for index, step in enumerate(steps)}
+
+        def run(step, board):
+            if board is not None and skip(board):
+                failures.append((step, board))
+                raise LookupError(f"{self.label(board).capitalize()} was cancelled")
+            start = time()
+            ok = False
+            try:
+                with tracing.span('step', step=step.description, board=self.fpgas.name(board) if board is not None else ''):
+                    ok = self.run_step(step, board, force)
+            finally:
+                self.journal.record(board, indexes[id(step)], ok, start, time())
+                if not ok: failures.append((step, board))
+            if not ok:
+                # the pipeline skips the rest of the steps of the board (or all of them, after a global step)
+                raise RuntimeError(f"{step.description} failed" + (f" on {self.label(board)}" if board is not None else ""))
+
+        return run
+
+    def _detect(self, steps, boards):
+        # finds the boards that can be programmed concurrently by the sessions (enabling them, Vivado only sees the enabled ones)
+        self._concurrent = set()
+        if self.sessions is None or self.sessions.size <= 0 or not has_bitstream(steps) or not self.vivado.is_vivado_available(): return
+        self.step("Detecting the boards with a unique JTAG target")
+        self.execute(planner.plan(self.fpgas.get_state(), {board: True for board in boards}))
+        self._concurrent = set(self.sessions.detect(self.vivado, self.fpgas, boards, self.cancelled))
+        self._acquired = None
+
+    def _program(self, steps, boards, force, resume=False, skip=lambda board: False):
+        # runs the steps, recording them in the journal, and reports their timings. Returns the failed boards
+        completed = self.journal.start(self.inputs(steps), [index for index, step in enumerate(steps) if step.scope == BOARD], resume)
+        for board in [board for board in boards if board in completed]:
+            self.step(f"Skipping {self.label(board)}, completed by the interrupted run")
+
+        def switch(board, keep=()):
+            return not skip(board) and self.switch(board, keep)
+
+        failures = []
+        pipeline = Pipeline(steps, [board for board in boards if board not in completed], self._recorder(steps, force, failures, skip), switch, self._concurrent)
+        timings = pipeline.execute(self.cancelled)
+        if not failures and all(timing.error is None for timing in timings):
+            self.journal.finish()
+        logger.info("Step timings:\n%s", "\n".join(f"> {timing.start:8.2f}s {timing.elapsed:8.2f}s {timing.step.description}" + (f" on {self.label(timing.board)}" if timing.board is not None else "") + (f" failed: {timing.error!r}" if timing.error is not None else "") for timing in timings))
+        for timing in timings:
+            self._report('step', timing.board, step=timing.step.description, start_s=round(timing.start, 3), elapsed_s=round(timing.elapsed, 3), success=timing.error is None, error=None if timing.error is None else str(timing.error))
+        failed = {board for _, board in failures} | {timing.board for timing in timings if timing.error is not None}
+        return set(boards) if None in failed else failed
+
+    def test_all(self, boards=None):
+        """
+        Plans to enable 'boards' (all by default) and run the TEST_COMMAND on each of them concurrently
+        The results are kept in 'tests'
+        Returns the function that does it, and its number of steps
+        """
+        boards = list(self.fpgas.get_state()) if boards is None else boards
+
+        def f():
+            self.tests = []
+            self.execute(planner.plan(self.fpgas.get_state(), {board: True for board in boards}))
+            available = [(board, self.fpgas.name(board), self.fpgas.index(board) + 1) for board in boards if self.fpgas.index(board) is not None]
+
+            def done(result):
+                logger.info("Test of %s %s in %.1fs, output:\n%s", self.label(result.board), 'passed' if result.passed else 'failed', result.elapsed, result.output)
+                self._report('test', result.board, success=result.passed, code=result.code, elapsed_s=round(result.elapsed, 3), output=result.output)
+                self.step(f"Tested {self.label(result.board)}: {'PASS' if result.passed else 'FAIL'}")
+
+            self.tests = testphase.run_all(TEST_COMMAND, available, self.cancelled, done)
+
+        return f, len(boards) * 2
+
+
+def has_bitstream(steps):
+    """
+    returns true iff any of the steps programs a bitstream
+    """
+    return any(step.command == 'bitstream' for step in steps)
@@ -0,0 +1,87 @@
+"""
+Pool of additional Vivado sessions, to program concurrently the boards that Vivado can tell apart.
+A board doesn't need the others disabled if the serial number of its usb device is unique and it matches exactly
+one JTAG target (boards with the same serial need it reflashed, see the README).
+Each session has its own hw_server (on consecutive ports from VIVADO_HW_SERVER_PORT) and opens one target at a time,
+while the main Vivado session programs the rest of the boards one by one, never opening the targets of the pool.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from queue import Empty, Queue
+from threading import Lock
+
+import log
+from CONFIG import VIVADO_SESSIONS, VIVADO_HW_SERVER_PORT
+from cancel import CancelException
+from vivado import Vivado
+
+logger = log.get(__name__)
+
+
+class Sessions:
+    def __init__(self, size=VIVADO_SESSIONS):
+        self.size = size
+        self.targets = {}  # serial of each board programmed by the pool
+        self.sessions = []
+        self._free = Queue()
+        self._lock = Lock()
+
+    def detect(self, vivado, fpgas, boards, cancel=None):
+        """
+        Finds which of 'boards' (that must be enabled) have a unique target, using the main 'vivado' session
+        which won't open them from now on
+        Returns the serials found, by board (the target names depend on the hw_server, each session finds its own)
+        """
+        serials = fpgas.serials()
+        targets = vivado.targets(cancel)
+        repeated = Counter(serials.values())
+        self.targets = {}
+        excluded = []
+        for board in boards:
+            serial = serials.get(board)
+            if serial is None or repeated[serial] > 1: continue
+            matches = [target for target in targets if fnmatchcase(target, pattern(serial))]
+            if len(matches) == 1:
+                self.targets[board] = serial
+                excluded += matches
+        vivado.exclude = excluded
+        logger.info("%d of %d boards can be programmed concurrently: %s", len(self.targets), len(boards), " ".join(excluded))
+        return self.targets
+
+    @contextmanager
+    def session(self, board, cancel=None):
+        """
+        Uses a free session (launching one if there are less than 'size'), connected to the target of 'board'
+        Raises CancelException if 'cancel' (an Event) is set while waiting for it, LookupError if the session can't find
+        the target of the board
+        """
+        vivado = None
+        with self._lock:
+            if self._free.empty() and len(self.sessions) < self.size:
+                vivado = Vivado(VIVADO_HW_SERVER_PORT + len(self.sessions))
+                self.sessions.append(vivado)
+        while vivado is None:
+            try:
+                vivado = self._free.get(timeout=0.5)
+            except Empty:
+                if cancel is not None and cancel.is_set(): raise CancelException()
+        try:
+            vivado.target = pattern(self.targets[board])
+            if not vivado.reacquire(cancel): raise LookupError(f"No target with serial {self.targets[board]} on session {vivado.port}")
+            yield vivado
+        finally:
+            vivado.release()
+            self._free.put(vivado)
+
+    def close(self):
+        for vivado in self.sessions:
+            vivado.close()
+        self.sessions = []
+
+
+def pattern(serial):
+    """
+    Returns the pattern of the target names of the board with the given usb serial (the target adds a suffix to it)
+    """
+    return f"*/{serial}*"
@@ -0,0 +1,412 @@
+"""
+Simulated hardware, to run the tool on Linux without Windows, Vivado nor boards (see benchmark.py).
+It installs fake 'pnputil', 'vivado' and 'hw_server' commands in a directory:
+    pnputil answers /enum-devices (also with /instanceid and /relations), /enable-device and /disable-device
+        like the real one, keeping the state of the boards in a file
+    vivado -mode tcl answers the commands sent by vivado.py (the fdt_* procs, puts, program_hw_devices...)
+        seeing only the enabled boards
+Each command takes a configurable latency (randomized by +-jitter) and fails with a configurable rate.
+Every process launched and every failure injected is logged, to count them.
+$> python simulator.py install /tmp/sim --boards 16
+$> PATH=/tmp/sim:$PATH python cli.py list VIVADO_PATH=/tmp/sim/vivado
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import shlex
+import sys
+from collections import Counter
+from fnmatch import fnmatchcase
+from time import monotonic, sleep, time
+
+from CONFIG import FPGA_DESCRIPTION
+
+SETTINGS = 'simulator.json'
+STATE = 'state.json'
+LOG = 'log.jsonl'
+
+DEFAULTS = {
+    'boards': 8,
+    'unique': 0,  # boards with a unique serial number (and JTAG target), the rest share the default one
+    'enabled': True,  # initial state of the boards
+    'latency': 0.05,  # seconds, of each pnputil command
+    'jitter': 0.25,  # ratio
+    'failures': 0.0,  # rate of failed enable/disable commands
+    'settle': 0.0,  # seconds until a changed board reports its new state
+    'startup': 1.0,  # seconds, until vivado is ready
+    'acquire': 0.1,  # seconds, to open a target
+    'program': 0.5,  # seconds, for each programming attempt
+    'program_failures': 0.0,  # rate of failed programming attempts
+}
+
+HEADER = "Microsoft PnP Utility\n"
+SHARED_SERIAL = "1234-tul"  # of the PYNQ-Z2 boards, all the same
+
+
+class Simulator:
+    def __init__(self, directory, **settings):
+        """
+        Simulated hardware in 'directory', with the given settings (see DEFAULTS)
+        The commands are (re)installed and the boards reset to their initial state
+        """
+        self.directory = os.path.abspath(directory)
+        self.settings = {**DEFAULTS, **settings}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, SETTINGS), 'w') as file:
+            json.dump(self.settings, file, indent=1)
+        for command in ('pnputil', 'vivado', 'hw_server'):
+            path = os.path.join(self.directory, command)
+            with open(path, 'w') as file:
+                file.write(f"#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} {shlex.quote(self.directory)} {command} \"$@\"\n")
+            os.chmod(path, 0o755)
+        self.reset()
+
+    def reset(self):
+        """
+        Sets the boards to their initial state and clears the log
+        """
+        with _locked(self.directory) as state:
+            state.clear()
+            state.update({board['id']: {'enabled': self.settings['enabled'], 'since': 0, 'bitstream': None} for board in boards(self.settings)})
+        self.reset_counts()
+
+    def reset_counts(self):
+        """
+        Clears the log, keeping the state of the boards
+        """
+        open(os.path.join(self.directory, LOG), 'w').close()
+
+    def environment(self, environment=None):
+        """
+        Returns a copy of the environment (os.environ by default) with the fake commands first in the PATH
+        """
+        environment = dict(os.environ if environment is None else environment)
+        environment['PATH'] = self.directory + os.pathsep + environment.get('PATH', '')
+        return environment
+
+    def parameters(self):
+        """
+        Returns the KEY=VALUE parameters the tool needs to use the simulator
+        """
+        return [f"VIVADO_PATH={os.path.join(self.directory, 'vivado')}"]
+
+    def state(self):
+        """
+        Returns the current state of each board: true if enabled, by instance id
+        """
+        with _locked(self.directory) as state:
+            return {board: _enabled(entry, self.settings) for board, entry in state.items()}
+
+    def counts(self):
+        """
+        Returns the number of processes launched (by command) and failures injected (by operation) since the reset
+        """
+        spawns, failures = Counter(), Counter()
+        for event in self._events():
+            if event['event'] in ('spawn', 'failure'):
+                (failures if event['event'] == 'failure' else spawns)[event['command']] += 1
+        return spawns, failures
+
+    def programmed(self):
+        """
+        Returns the boards programmed since the reset, in order, as (instance id, hw_server port of the Vivado that did it)
+        """
+        return [(event['board'], event['port']) for event in self._events() if event['event'] == 'program']
+
+    def _events(self):
+        with open(os.path.join(self.directory, LOG)) as file:
+            return [json.loads(line) for line in file]
+
+
+def boards(settings):
+    """
+    Returns the simulated boards: their instance id, parent (usb device) id and JTAG serial
+    """
+    result = []
+    for index in range(settings['boards']):
+        unique = index < settings['unique']
+        result.append({
+            'id': f"USB\\VID_0403&PID_6010&MI_00\\6&{0x2c5a0e3f + index:08x}&0&0000",
+            'parent': f"USB\\VID_0403&PID_6010\\FT{index:06X}" if unique else f"USB\\VID_0403&PID_6010\\5&{0x1b9f2d47 + index:08x}&0&{index + 1}",
+            'serial': f"FT{index:06X}" if unique else SHARED_SERIAL,
+        })
+    return result
+
+
+def _enabled(entry, settings):
+    # state reported by a board, the previous one until it settles
+    return entry['enabled'] if time() - entry['since'] >= settings['settle'] else not entry['enabled']
+
+
+class _locked:
+    # the state file, locked and saved on exit
+    def __init__(self, directory):
+        self.path = os.path.join(directory, STATE)
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.seek(0)
+        self.state = json.loads(self.file.read() or '{}')
+        return self.state
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None:
+            self.file.seek(0)
+            self.file.truncate()
+            json.dump(self.state, self.file)
+        self.file.close()
+
+
+def _log(directory, event, command, **values):
+    # appended in a single write, so concurrent processes don't mix their lines
+    with open(os.path.join(directory, LOG), 'a') as file:
+        file.write(json.dumps({'event': event, 'command': command, 'pid': os.getpid(), **values}) + '\n')
+
+
+def _wait(settings, seconds):
+    sleep(seconds * random.uniform(1 - settings['jitter'], 1 + settings['jitter']))
+
+
+# pnputil
+
+def pnputil(directory, settings, arguments):
+    """
+    Runs a fake pnputil command, returns its exit code
+    """
+    _wait(settings, settings['latency'])
+    print(HEADER)
+    if arguments[:1] == ['/enum-devices']:
+        return _enumerate(directory, settings, arguments[1:])
+    if arguments[:1] in (['/enable-device'], ['/disable-device']) and len(arguments) == 2:
+        return _change(directory, settings, arguments[0] == '/enable-device', arguments[1])
+    print("Invalid command. Use /? for help")
+    return 87
+
+
+def _enumerate(directory, settings, arguments):
+    with _locked(directory) as state:
+        reported = {board: _enabled(entry, settings) for board, entry in state.items()}
+    instance = arguments[arguments.index('/instanceid') + 1] if '/instanceid' in arguments else None
+    relations = '/relations' in arguments
+
+    found = False
+    for board in boards(settings):
+        for interface, description in (('MI_00', FPGA_DESCRIPTION), ('MI_01', FPGA_DESCRIPTION[:-1] + 'B')):
+            id = board['id'].replace('MI_00', interface)
+            if instance is not None and id != instance: continue
+            found = True
+            print(f"Instance ID:                {id}")
+            print(f"Device Description:         {description}")
+            print("Class Name:                 USB")
+            print("Class GUID:                 {36fc9e60-c465-11cf-8056-444553540000}")
+            print("Manufacturer Name:          FTDI")
+            print(f"Status:                     {'Started' if reported.get(board['id']) else 'Disabled'}")
+            print("Driver Name:                oem42.inf")
+            if relations: print(f"Parent:                     {board['parent']}")
+            print()
+    if instance is None:
+        for index in range(2):
+            print(f"Instance ID:                USB\\ROOT_HUB30\\4&{0x3a1f0c55 + index:08x}&0&0")
+            print("Device Description:         USB Root Hub (USB 3.0)")
+            print("Class Name:                 USB")
+            print("Class GUID:                 {36fc9e60-c465-11cf-8056-444553540000}")
+            print("Manufacturer Name:          (Standard USB HUBs)")
+            print("Status:                     Started")
+            print("Driver Name:                usbhub3.inf")
+            print()
+    if not found and instance is not None:
+        print("No devices were found on the system.")
+    return 0
+
+
+def _change(directory, settings, enable, id):
+    operation = 'enable' if enable else 'disable'
+    print(f"{'Enabling' if enable else 'Disabling'} device:          {id}")
+    with _locked(directory) as state:
+        entry = state.get(id)
+        if entry is None:
+            print(f"Failed to {operation} device: The parameter is incorrect.")
+            return 87
+        if random.random() < settings['failures']:
+            _log(directory, 'failure', operation)
+            print(f"Failed to {operation} device: A device attached to the system is not functioning.")
+            return 31
+        if entry['enabled'] != enable:
+            state[id] = {**entry, 'enabled': enable, 'since': time()}
+    print(f"Device {operation}d successfully.")
+    return 0
+
+
+# vivado
+
+def vivado(directory, settings, arguments):
+    """
+    Runs a fake Vivado in tcl mode, reading commands from stdin until 'exit'
+    """
+    port = 3121
+    target = None  # acquired one: (board, name)
+    bitfile = None  # PROGRAM.FILE, when programming step by step
+    print("****** Vivado v2023.1 (64-bit)")
+    print("  **** SW Build 0000000 (simulated)", flush=True)
+    start = monotonic()
+
+    def targets():
+        with _locked(directory) as state:
+            enabled = [board for board in boards(settings) if _enabled(state[board['id']], settings)]
+        # boards with the same serial are seen as a single target
+        names = {}
+        for board in enabled:
+            names.setdefault(f"localhost:{port}/xilinx_tcf/Xilinx/{board['serial']}A", board['id'])
+        return names
+
+    for command in _commands(sys.stdin):
+        words = _words(command)
+        if not words: continue
+        if words[0] == 'exit':
+            break
+        elif words[0] == 'connect_hw_server':
+            port = int(re.search(r':(\d+)\s*$', command)[1])
+        elif words[0] == 'puts':
+            # the first 'puts' waits for the startup
+            if start is not None:
+                sleep(max(0.0, settings['startup'] - (monotonic() - start)))
+                start = None
+            print(words[1] if len(words) > 1 else '')
+        elif words[0] == 'fdt_acquire':
+            pattern, wanted, exclude = (re.findall(r'\{([^}]*)\}', command) + ['', '*', ''])[:3]
+            _wait(settings, settings['acquire'])
+            names = [name for name in targets() if fnmatchcase(name, wanted) and name not in exclude.split()]
+            if names:
+                target = (targets()[names[0]], names[0])
+                print(f"FDT_ACQUIRE ok {int(settings['acquire'] * 1000)} xc7z020_1")
+            else:
+                target = None
+                print(f"FDT_ACQUIRE error {int(settings['acquire'] * 1000)} no target matching {wanted}")
+        elif words[0] == 'fdt_targets':
+            print("FDT_TARGETS", *targets())
+        elif words[0] == 'fdt_program':
+            bitfile, retries, delay, max_delay, deadline = words[2], int(words[3]), int(words[4]) / 1000, int(words[5]) / 1000, int(words[6]) / 1000
+            started = monotonic()
+            status, message, attempts = 'error', "", 0
+            if not os.path.isfile(bitfile):
+                # set_property PROGRAM.FILE fails, no attempts
+                status, message = 'error', f"ERROR: [Common 17-69] File '{bitfile}' does not exist"
+                retries = 0
+            while attempts < retries:
+                if attempts > 0:
+                    if monotonic() + delay - started > deadline:
+                        status, message = 'timeout', f"Deadline reached, last error: {message}"
+                        break
+                    sleep(delay)
+                    delay = min(delay * 2, max_delay)
+                attempts += 1
+                status, message = _program(directory, settings, target, targets(), bitfile, port)
+                if status == 'ok': break
+            print(f"FDT_PROGRAM {status} {attempts} {int((monotonic() - started) * 1000)} {message}")
+        elif words[0] == 'program_hw_devices':
+            status, message = _program(directory, settings, target, targets(), bitfile, port)
+            print("INFO: [Labtools 27-3164] End of startup status: HIGH" if status == 'ok' else f"ERROR: [Labtools 27-3165] {message}")
+        elif words[0] == 'if' and 'PROGRAM.FILE' in command:
+            bitfile = _substitute(re.findall(r'"((?:[^"\\]|\\.)*)"', command)[-1])
+            if not os.path.isfile(bitfile): print(f"ERROR: [Common 17-69] File '{bitfile}' does not exist")
+        elif words[0] == 'fdt_identify':
+            with _locked(directory) as state:
+                bitstream = state[target[0]]['bitstream'] if target is not None else None
+            usercode = hashlib.sha256(bitstream.encode()).hexdigest()[:8].upper() if bitstream else ''
+            print(f"FDT_IDENTIFY {1 if bitstream else 0} {usercode and '0x' + usercode} {usercode and '0x' + usercode[::-1]}")
+        elif 'FDT_RELEASED' in command:
+            target = None
+            print("FDT_RELEASED")
+        elif words[0] in ('proc', 'load_features', 'if', 'catch', 'refresh_hw_server'):
+            pass
+        else:
+            print(f'invalid command name "{words[0]}"')
+        sys.stdout.flush()
+
+
+def _program(directory, settings, target, targets, bitfile, port):
+    # one programming attempt, returns its status and message
+    _wait(settings, settings['program'])
+    if target is None or target[1] not in targets:
+        return 'error', "ERROR: [Labtools 27-2269] No devices detected on target"
+    if bitfile is None or not os.path.isfile(bitfile):
+        return 'error', "ERROR: [Labtools 27-3303] Incorrect bitstream assigned to device"
+    if random.random() < settings['program_failures']:
+        _log(directory, 'failure', 'program')
+        return 'notdone', "DONE is low after programming"
+    with _locked(directory) as state:
+        state[target[0]]['bitstream'] = bitfile
+    _log(directory, 'program', 'program', board=target[0], port=port)
+    return 'ok', ""
+
+
+def _commands(lines):
+    # complete tcl commands (a proc spans several lines, until its braces are balanced)
+    command = ''
+    for line in lines:
+        command += line
+        if command.count('{') <= command.count('}'):
+            yield command.strip()
+            command = ''
+
+
+def _words(command):
+    # words of a tcl command, with the substitutions of tcl (braces are literal, backslashes are escapes elsewhere)
+    # variables and commands ($x, [x]) are kept as they are
+    words = []
+    for match in re.finditer(r'"((?:[^"\\]|\\.)*)"|\{([^{}]*)\}|((?:[^\s\\]|\\.)+)', command):
+        quoted, braced, bare = match.groups()
+        words.append(braced if braced is not None else _substitute(quoted if quoted is not None else bare))
+    return words
+
+
+ESCAPES = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+def _substitute(text):
+    # tcl backslash substitution: \n and the like, \xhh, \ooo, and any other character as itself
+    def replace(match):
+        escape = match[1]
+        if escape[0] == 'x': return chr(int(escape[1:], 16))
+        if escape[0] in '01234567': return chr(int(escape, 8))
+        return ESCAPES.get(escape, escape)
+
+    return re.sub(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)', replace, text, flags=re.DOTALL)
+
+
+# hw_server
+
+def hw_server(directory, settings, arguments):
+    """
+    Runs a fake hw_server, until killed
+    """
+    while True:
+        sleep(3600)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(prog="simulator", description="Installs the simulated hardware")
+    parser.add_argument('command', choices=['install'])
+    parser.add_argument('directory')
+    for key, value in DEFAULTS.items():
+        parser.add_argument('--' + key.replace('_', '-'), type=type(value) if not isinstance(value, bool) else lambda text: text.lower() in ('1', 'true', 'yes'), default=value)
+    settings = vars(parser.parse_args(arguments))
+    del settings['command']
+    simulator = Simulator(**settings)
+    print(f"Installed {simulator.settings['boards']} simulated boards, run with: PATH={simulator.directory}:$PATH", *simulator.parameters())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[2] in ('pnputil', 'vivado', 'hw_server'):
+        # a fake command
+        directory, command = sys.argv[1], sys.argv[2]
+        with open(os.path.join(directory, SETTINGS)) as file:
+            settings = json.load(file)
+        _log(directory, 'spawn', command)
+        sys.exit(globals()[command](directory, settings, sys.argv[3:]))
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from time import sleep
+from uuid import uuid4
+
+import log
+from CONFIG import STAGING_PATH, STAGING_MAX_SIZE, STAGING_WATCH_INTERVAL
+from bitcache import digest
+
+logger = log.get(__name__)
+
+
+class Staging:
+    def __init__(self):
+        """
+        Local content-addressed copies of the bitstreams, so they are read only once from their original location
+        (usually a network share). Scripts are not staged, they run from their own folder.
+        Files are copied in the background as soon as they are staged, and copied again if they are modified.
+        The least recently used copies are removed when the total size exceeds STAGING_MAX_SIZE.
+        """
+        self.path = os.path.expanduser(STAGING_PATH)
+        self.staged = {}  # future (sha256, local path) of each staged source file
+        self.stats = {}  # (modification time, size) of each source file when it was copied
+        self._executor = ThreadPoolExecutor(2, thread_name_prefix="staging")
+        self._lock = Lock()
+        self._watcher = Thread(target=self._watch, name="staging watcher", daemon=True)
+        self._watcher.start()
+
+    def stage(self, source):
+        """
+        Starts copying 'source' in the background, if not already staged and unchanged
+        If it can't be read now (a share hiccup) its staged copy is kept
+        """
+        with self._lock:
+            current = _stat(source)
+            previous = self.staged.get(source)
+            if previous is not None and not (previous.done() and previous.exception() is not None):
+                if current is None or current == self.stats.get(source): return
+            self.stats[source] = current
+            self.staged[source] = self._executor.submit(self._copy, source)
+
+    def get(self, source):
+        """
+        Returns the (sha256, local path) of 'source', staging it if needed and waiting until it is copied
+        If it can't be staged, (None, original path) is returned: the source isn't read again to hash it
+        """
+        self.stage(source)
+        try:
+            sha256, local = self.staged[source].result()
+            os.utime(local)  # recently used
+            return sha256, local
+        except OSError as e:
+            logger.warning("Unable to stage %s: %s", source, e)
+            return None, source
+
+    def _copy(self, source):
+        # copies the file while computing its hash, verifies the copy
+        os.makedirs(self.path, exist_ok=True)
+        temporal = os.path.join(self.path, f"{uuid4().hex}.tmp")
+        sha = hashlib.sha256()
+        with open(source, 'rb') as input, open(temporal, 'wb') as output:
+            for chunk in iter(lambda: input.read(1 << 20), b''):
+                sha.update(chunk)
+                output.write(chunk)
+        sha256 = sha.hexdigest()
+        if digest(temporal) != sha256:
+            os.remove(temporal)
+            raise OSError(f"Copy of {source} is corrupted")
+
+        local = os.path.join(self.path, sha256 + os.path.splitext(source)[1])
+        os.replace(temporal, local)
+        logger.debug("Staged %s as %s", source, local)
+        self._evict(local)
+        return sha256, local
+
+    def _evict(self, keep):
+        # removes the least recently used files not currently staged, while over the size limit
+        with self._lock:
+            used = {future.result()[1] for future in self.staged.values() if future.done() and future.exception() is None} | {keep}
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if not name.endswith('.tmp')]
+        files = sorted((os.stat(file).st_mtime, os.stat(file).st_size, file) for file in files)
+        total = sum(size for _, size, _ in files)
+        for _, size, file in files:
+            if total <= STAGING_MAX_SIZE: break
+            if file in used: continue
+            logger.info("Evicting %s", file)
+            os.remove(file)
+            total -= size
+
+    def _watch(self):
+        # copies again the modified files
+        while True:
+            sleep(STAGING_WATCH_INTERVAL)
+            with self._lock:
+                changed = [source for source, stat in self.stats.items() if _stat(source) not in (stat, None)]
+            for source in changed:
+                logger.info("Modified %s", source)
+                self.stage(source)
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+def _stat(path):
+    # identifies the current version of a file, None if it can't be read
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
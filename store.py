@@ -0,0 +1,37 @@
+import json
+import os
+
+import log
+
+logger = log.get(__name__)
+
+
+def load(path, default):
+    """
+    Returns the json content of file 'path', or 'default' if it doesn't exist or can't be read
+    """
+    try:
+        with open(os.path.expanduser(path), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logger.warning("Unable to read %s: %s", path, e)
+        return default
+
+
+def save(path, content, mode=0o666):
+    """
+    Saves 'content' as json into file 'path', atomically (the file is never left half-written)
+    The file is created with the permissions 'mode' (minus the umask), so it is never readable by others if they are excluded
+    """
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporal = f"{path}.tmp"
+    try:
+        os.remove(temporal)  # left by an interrupted save, with other permissions
+    except FileNotFoundError:
+        pass
+    with os.fdopen(os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'w', encoding='utf-8') as file:
+        json.dump(content, file, indent=1)
+    os.replace(temporal, path)
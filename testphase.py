@@ -0,0 +1,96 @@
+"""
+Test phase, run with all the boards enabled (usually after programming them).
+The TEST_COMMAND template runs concurrently for each board, with the values of the board substituted:
+{name}, {id} and {index} (starting at 1), also available as the FDT_BOARD_NAME, FDT_BOARD_ID and FDT_BOARD_INDEX
+environment variables.
+A board passes if its command exits with 0 before TEST_TIMEOUT seconds.
+"""
+import os
+import shlex
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+from typing import NamedTuple
+
+from CONFIG import TEST_TIMEOUT, TEST_WORKERS
+from cancel import CancelException
+
+
+class TestResult(NamedTuple):
+    board: str
+    name: str
+    index: int  # starting at 1
+    passed: bool
+    code: int | None  # exit code, None if it timed out
+    elapsed: float  # seconds
+    output: str  # stdout and stderr
+
+
+def command(template, name, id, index):
+    """
+    Returns the command for a board, with its values quoted for the shell
+    """
+    quote = (lambda value: '"' + value.replace('"', '""') + '"') if os.name == 'nt' else shlex.quote
+    return template.format(name=quote(name), id=quote(id), index=index)
+
+
+def run(template, board, name, index, timeout=TEST_TIMEOUT, cancelled=None):
+    """
+    Runs the test of a board, returns its TestResult
+    Raises CancelException if 'cancelled' (an Event) is set meanwhile
+    """
+    start = monotonic()
+    environment = dict(os.environ, FDT_BOARD_NAME=name, FDT_BOARD_ID=board, FDT_BOARD_INDEX=str(index))
+    process = subprocess.Popen(command(template, name, board, index), shell=True, env=environment,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                               universal_newlines=True, errors='replace',
+                               **({'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == 'nt' else {'start_new_session': True}))
+    while True:
+        try:
+            # short waits, to check the cancel token
+            output, _ = process.communicate(timeout=0.5)
+            return TestResult(board, name, index, process.returncode == 0, process.returncode, monotonic() - start, output)
+        except subprocess.TimeoutExpired:
+            if cancelled is not None and cancelled.is_set():
+                _kill(process)
+                raise CancelException()
+            if monotonic() - start > timeout:
+                _kill(process)
+                output, _ = process.communicate()
+                return TestResult(board, name, index, False, None, monotonic() - start, output + f"\nTimed out after {timeout} seconds")
+
+
+def _kill(process):
+    # kills the shell and everything it launched
+    if os.name == 'nt':
+        subprocess.call(['taskkill', '/T', '/F', '/PID', str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass  # already finished
+    process.wait()
+
+
+def run_all(template, boards, cancelled=None, done=lambda result: None):
+    """
+    Runs the tests of all 'boards' (board, name, index) concurrently, calling 'done(result)' as each one finishes
+    Returns the results, in the order of 'boards'
+    """
+    with ThreadPoolExecutor(TEST_WORKERS, thread_name_prefix="test") as executor:
+        futures = {executor.submit(run, template, board, name, index, TEST_TIMEOUT, cancelled): board for board, name, index in boards}
+        results = {}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.board] = result
+            done(result)
+    return [results[board] for board, _, _ in boards]
+
+
+def summary(results):
+    """
+    Returns the headings and rows of the results table
+    """
+    rows = [[result.index, result.name, "PASS" if result.passed else "FAIL", "timeout" if result.code is None else result.code, f"{result.elapsed:.1f}s", (result.output.strip().splitlines() or [""])[-1]] for result in results]
+    return ["#", "Board", "Result", "Exit code", "Time", "Last output line"], rows
@@ -0,0 +1,171 @@
+"""
+Agent RPC and coordinator on 127.0.0.1, with fake boards behind the real http handler
+"""
+import base64
+import hashlib
+import socket
+from http.server import ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+
+import pytest
+
+import coordinator
+from agent import INVALID_PARAMS, METHOD_NOT_FOUND, SERVER_ERROR, UNAUTHORIZED, UNKNOWN_JOB, Agent, Client, RPCError, _handler
+from coordinator import Coordinator
+from retry import Retry
+
+TOKEN = "secret"
+
+
+class FakeAgent:
+    # same methods as agent.Agent, each job finishes after reporting one event per board
+    def __init__(self, boards=('b1', 'b2'), forget=0):
+        self.boards = boards
+        self.forget = forget  # times to answer 'unknown job', as if restarted
+        self.files = {}
+        self.runs = []
+        self.jobs = {}
+
+    def ping(self):
+        return {'host': 'fake', 'boards': len(self.boards), 'job': None}
+
+    def list(self):
+        return [{'index': index + 1, 'board': board} for index, board in enumerate(self.boards)]
+
+    def missing(self, files):
+        return [sha256 for sha256 in files if sha256 not in self.files]
+
+    def put(self, name, content):
+        data = base64.b64decode(content)
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.files[sha256] = data
+        return sha256
+
+    def run(self, steps, boards=None, force=False, test=False, resume=False):
+        for step in steps:
+            if 'sha256' in step and step['sha256'] not in self.files: raise RPCError(INVALID_PARAMS, "Missing file")
+        self.runs.append({'steps': steps, 'resume': resume})
+        job = f"job{len(self.runs)}"
+        self.jobs[job] = [{'event': 'bitstream', 'board': board, 'status': 'ok'} for board in self.boards]
+        return job
+
+    def status(self, job, since=0):
+        if self.forget:
+            self.forget -= 1
+            raise RPCError(UNKNOWN_JOB, f"Unknown job {job}")
+        if job not in self.jobs: raise RPCError(UNKNOWN_JOB, f"Unknown job {job}")
+        return {'state': 'done', 'events': self.jobs[job][since:], 'error': None}
+
+    def cancel(self, job):
+        raise ValueError("broken")
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(agent):
+        # address of a new server of 'agent'
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(agent, TOKEN))
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"127.0.0.1:{server.server_address[1]}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(coordinator, 'AGENT_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(coordinator, 'RECONNECT', Retry(3, 0.01, 0.01, 5))
+
+
+def test_rpc(serve):
+    address = serve(FakeAgent())
+    client = Client(address, TOKEN, timeout=5)
+    assert client.call('ping') == {'host': 'fake', 'boards': 2, 'job': None}
+    assert client.call('missing', files={'abc': 'design.bit'}) == ['abc']
+
+    def error(client, method, **params):
+        with pytest.raises(RPCError) as e:
+            client.call(method, **params)
+        return e.value.code
+
+    assert error(client, 'status', job='none') == UNKNOWN_JOB
+    assert error(client, 'close') == METHOD_NOT_FOUND  # not exposed
+    assert error(client, 'ping', extra=1) == INVALID_PARAMS
+    assert error(client, 'cancel', job='job1') == SERVER_ERROR
+    assert error(Client(address, "wrong", timeout=5), 'ping') == UNAUTHORIZED
+    assert error(Client(address, "", timeout=5), 'ping') == UNAUTHORIZED
+
+
+def test_coordinator_runs_on_all_agents(serve, tmp_path):
+    bitstream = tmp_path / 'design.bit'
+    bitstream.write_bytes(b'design')
+    agents = [FakeAgent(('a1', 'a2')), FakeAgent(('b1',))]
+    addresses = [serve(agent) for agent in agents]
+    events = []
+
+    states = Coordinator(addresses, events.append, TOKEN).run([{'command': 'bitstream', 'parameter': str(bitstream)}])
+
+    assert states == dict.fromkeys(addresses, 'done')
+    sha256 = hashlib.sha256(b'design').hexdigest()
+    for agent in agents:
+        assert agent.files == {sha256: b'design'}
+        assert agent.runs == [{'steps': [{'command': 'bitstream', 'parameter': 'design.bit', 'sha256': sha256}], 'resume': False}]
+    # the events of each agent, tagged with its address
+    bitstreams = [(event['agent'], event['board']) for event in events if event['event'] == 'bitstream']
+    assert sorted(bitstreams) == sorted([(addresses[0], 'a1'), (addresses[0], 'a2'), (addresses[1], 'b1')])
+
+
+def test_coordinator_resumes_a_lost_job(serve, tmp_path):
+    bitstream = tmp_path / 'design.bit'
+    bitstream.write_bytes(b'design')
+    agent = FakeAgent(forget=1)
+    address = serve(agent)
+    events = []
+
+    states = Coordinator([address], events.append, TOKEN).run([{'command': 'bitstream', 'parameter': str(bitstream)}])
+
+    assert states == {address: 'done'}
+    assert [run['resume'] for run in agent.runs] == [False, True]
+    assert [event['state'] for event in events if event['event'] == 'agent'] == ['running', 'resuming', 'running', 'done']
+
+
+def test_coordinator_gives_up_on_an_unreachable_agent(serve):
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        address = f"127.0.0.1:{unused.getsockname()[1]}"  # nothing listening
+    working = serve(FakeAgent())
+    events = []
+
+    states = Coordinator([address, working], events.append, TOKEN).run([{'command': 'pause'}])
+
+    assert states == {address: 'failed', working: 'done'}
+    lost = [event['state'] for event in events if event['event'] == 'agent' and event['agent'] == address]
+    assert lost == ['unreachable', 'failed']
+
+
+def test_events_after_a_job_are_not_part_of_it(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    agent = Agent()
+    try:
+        monkeypatch.setattr(agent.fpgas, 'update', lambda: None)
+        monkeypatch.setattr(agent.runner, 'program_all', lambda *arguments: (lambda: agent.runner.report({'event': 'bitstream'}), 1))
+        job = agent.run([])
+        for _ in range(50):
+            if agent.status(job)['state'] != 'running': break
+            sleep(0.1)
+        assert agent.ping()['job'] is None
+
+        # the events of a later enable
+        agent.runner.step("Enabled board 1")
+        agent.runner.report({'event': 'enable', 'board': 'b1'})
+
+        assert agent.status(job) == {'state': 'done', 'events': [{'event': 'bitstream'}], 'error': None}
+    finally:
+        agent.close()
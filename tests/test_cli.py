@@ -0,0 +1,24 @@
+"""
+Command line results, on the simulated hardware
+"""
+import os
+
+import pytest
+
+if os.name == 'nt': pytest.skip("the simulator runs on Linux", allow_module_level=True)
+
+from simulator import Simulator
+from tests.test_sessions import program
+
+
+def test_summary_counts_each_failed_board_once(tmp_path):
+    # the bitstream fails on every board: reported by its 'bitstream' and its 'step' events
+    simulator = Simulator(tmp_path / 'simulator', boards=3, startup=0.2, acquire=0.05, program=0.05, program_failures=1.0)
+    bitstream = tmp_path / 'design.bit'
+    bitstream.write_bytes(b'design')
+
+    events = program(simulator, tmp_path / 'home', bitstream, 'VIVADO_PROGRAM_RETRY=1', 'VIVADO_SESSIONS=0')
+
+    assert len([event for event in events if event.get('success') is False]) > 3
+    summary, = [event for event in events if event['event'] == 'summary']
+    assert summary['failed'] == 3
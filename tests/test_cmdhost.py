@@ -0,0 +1,61 @@
+"""
+Command host framing, with sh as the shell
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cmdhost import CommandHost, CommandHostPool
+
+if os.name == 'nt': pytest.skip("sh is not available", allow_module_level=True)
+
+
+@pytest.fixture
+def host():
+    host = CommandHost('sh', '$?')
+    yield host
+    host.close()
+
+
+def test_output_and_exit_code(host):
+    assert host.run("echo one; echo two >&2") == "one\ntwo\n"
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        host.run("echo partial; false")
+    assert error.value.returncode == 1
+    assert error.value.output == "partial\n"
+
+
+def test_output_without_final_newline(host):
+    assert host.run("printf last") == "last"
+    assert host.run("echo next") == "next\n"
+
+
+def test_single_process(host):
+    pids = {host.run("echo $$") for _ in range(5)}
+    assert len(pids) == 1
+
+
+def test_stopped_stream_discards_the_rest(host):
+    lines = host.stream("for i in 1 2 3 4; do echo $i; done")
+    assert next(lines) == "1\n"
+    lines.close()
+    assert host.run("echo after") == "after\n"
+
+
+def test_relaunched_after_exiting(host):
+    with pytest.raises(OSError):
+        host.run("exit 3")
+    assert host.run("echo back") == "back\n"
+
+
+def test_pool_runs_concurrently():
+    pool = CommandHostPool('sh', '$?')
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            outputs = list(executor.map(lambda index: pool.run(f"sleep 0.2; echo {index}"), range(4)))
+        assert outputs == [f"{index}\n" for index in range(4)]
+        assert len(pool._hosts) > 1
+    finally:
+        pool.close()
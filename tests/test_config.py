@@ -0,0 +1,39 @@
+"""
+Parameters from the command line
+"""
+import ast
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parameter(key, value):
+    # value of CONFIG.key when given as key=value, and the output
+    process = subprocess.run([sys.executable, '-c', f"import CONFIG; print(repr(CONFIG.{key}))", f"{key}={value}"],
+                             cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    *output, result = process.stdout.splitlines()
+    return ast.literal_eval(result), output
+
+
+@pytest.mark.parametrize('value, expected', [
+    ("True", True), ("true", True), ("1", True), ("yes", True),
+    ("False", False), ("FALSE", False), ("0", False), ("no", False), ("", False),
+])
+def test_bool(value, expected):
+    assert parameter('VIVADO_DAEMON', value)[0] is expected
+
+
+def test_invalid_bool():
+    value, output = parameter('VIVADO_STARTUP_LOAD', "maybe")
+    assert value is True  # the default
+    assert output == ["Can't replace parameter VIVADO_STARTUP_LOAD=maybe"]
+
+
+def test_other_types():
+    assert parameter('UI_REFRESH_TIMEOUT', "500")[0] == 500
+    assert parameter('AGENT_POLL_INTERVAL', "0.1")[0] == 0.1
+    assert parameter('FPGA_DESCRIPTION', "USB board")[0] == "USB board"
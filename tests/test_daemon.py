@@ -0,0 +1,108 @@
+"""
+Daemon protocol, with sh as the shell
+"""
+import os
+import socket
+import stat
+import struct
+from threading import Thread
+from time import sleep
+
+import pytest
+
+import daemon
+import store
+from daemon import Daemon, RefusedError, RemoteConsole, receive, send
+
+if os.name == 'nt': pytest.skip("sh is not available", allow_module_level=True)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon, 'VIVADO_DAEMON_FILE', str(tmp_path / "daemon.json"))
+    server = Daemon('sh')
+    thread = Thread(target=server.serve, daemon=True)
+    thread.start()
+    assert wait(lambda: os.path.exists(daemon.VIVADO_DAEMON_FILE))
+    yield server
+    server.stopped = True
+    thread.join(5)
+
+
+def wait(condition):
+    for _ in range(50):
+        if condition(): return True
+        sleep(0.1)
+    return False
+
+
+def test_framing():
+    left, right = socket.socketpair()
+    with left, right:
+        send(left, {'op': 'write', 'command': "echo á"})
+        assert receive(right) == {'op': 'write', 'command': "echo á"}
+
+        # a message split in several chunks
+        data = b'{"ok": true}'
+        frame = struct.pack('>I', len(data)) + data
+        thread = Thread(target=lambda: [left.sendall(frame[index:index + 1]) for index in range(len(frame))])
+        thread.start()
+        assert receive(right) == {'ok': True}
+        thread.join()
+
+        # closed in the middle of a message
+        left.sendall(frame[:8])
+        left.close()
+        with pytest.raises(EOFError):
+            receive(right)
+
+
+def test_file(server):
+    path = daemon.VIVADO_DAEMON_FILE
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert store.load(path, {}) == {'port': server.server.getsockname()[1], 'token': server.token, 'pid': os.getpid()}
+
+
+def test_token(server):
+    port = server.server.getsockname()[1]
+    with pytest.raises(RefusedError, match="invalid token"):
+        RemoteConsole(port, "0" * 32)
+    with pytest.raises(RefusedError, match="invalid token"):
+        RemoteConsole(port, None)
+    console = RemoteConsole(port, server.token)
+    assert console.alive()
+    console.detach()
+
+
+def test_console(server):
+    port = server.server.getsockname()[1]
+    console = RemoteConsole(port, server.token)
+    console.write("echo ready")
+    index, match = console.expect([r"^fail$", r"^(re)ady$"], timeout=5)
+    assert index == 1 and match.group(1) == "re"
+    with pytest.raises(TimeoutError):
+        console.expect([r"^never$"], timeout=0.6)
+    console.set('acquired', True)
+    console.detach()
+
+
+def test_single_client(server):
+    port = server.server.getsockname()[1]
+    console = RemoteConsole(port, server.token)
+    with pytest.raises(RefusedError, match="busy"):
+        RemoteConsole(port, server.token)
+    console.set('launched', True)
+    console.detach()
+
+    # the state is kept between clients
+    assert wait(lambda: server.client is None)
+    console = RemoteConsole(port, server.token)
+    assert console.get('launched') is True
+    console.detach()
+
+
+def test_close(server):
+    console = RemoteConsole(server.server.getsockname()[1], server.token)
+    console.close()
+    assert wait(lambda: not os.path.exists(daemon.VIVADO_DAEMON_FILE))
+    assert not server.console.alive()
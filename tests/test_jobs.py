@@ -0,0 +1,102 @@
+"""
+Job queue cancellation, with a fake runner
+"""
+from threading import Event
+
+from jobs import Scheduler
+from pipeline import step
+
+
+class FakeStaging:
+    def stage(self, path):
+        pass
+
+    def get(self, path):
+        return path, path
+
+
+class FakeFpgas:
+    def __init__(self, boards):
+        self.boards = boards
+
+    def __iter__(self):
+        return iter(self.boards)
+
+    def get_state(self):
+        return {board: True for board in self.boards}
+
+
+class FakeRunner:
+    # runs each group at once, a board fails if it is skipped when its group runs
+    def __init__(self, boards):
+        self.fpgas = FakeFpgas(boards)
+        self.staging = FakeStaging()
+        self.cancelled = Event()
+        self.group = None
+        self.programmed = []
+        self.before = lambda board: None  # called before each board
+
+    def inputs(self, steps):
+        return repr(steps)
+
+    def program_batch(self, groups, skip):
+        def f():
+            failed = []
+            for self.group, (_, boards, _) in enumerate(groups):
+                failed.append(set())
+                for board in boards:
+                    self.before(board)
+                    if skip(board):
+                        failed[-1].add(board)
+                    else:
+                        self.programmed.append(board)
+            self.group = None
+            return failed
+
+        return f, len(groups)
+
+
+STEPS = [step('bitstream', 'design.bit')]
+
+
+def test_cancel_a_queued_job():
+    runner = FakeRunner(['a', 'b', 'c'])
+    scheduler = Scheduler(runner)
+    jobs = {board: scheduler.submit(STEPS, [board]) for board in runner.fpgas}
+    assert scheduler.queued('b') is jobs['b']
+
+    scheduler.cancel(jobs['b'])
+
+    assert scheduler.queued('b') is None
+    assert jobs['b'].state == 'cancelled'
+    function, _ = scheduler.run()
+    assert function() == [jobs['a'], jobs['c']]
+    assert runner.programmed == ['a', 'c']
+    assert [job.state for job in jobs.values()] == ['done', 'cancelled', 'done']
+
+
+def test_cancel_a_running_job():
+    runner = FakeRunner(['a', 'b', 'c'])
+    scheduler = Scheduler(runner)
+    first = scheduler.submit(STEPS, ['a', 'b'])
+    second = scheduler.submit(STEPS, ['c'])
+    # cancelled while programming its first board, the others of the same group keep running
+    runner.before = lambda board: scheduler.cancel(scheduler.owner(board)) if board == 'a' else None
+
+    function, _ = scheduler.run()
+    function()
+
+    assert runner.programmed == ['c']
+    assert first.state == 'cancelled'
+    assert second.state == 'done'
+
+
+def test_queued_returns_the_last_job_of_the_board():
+    runner = FakeRunner(['a', 'b'])
+    scheduler = Scheduler(runner)
+    scheduler.submit(STEPS, ['a'])
+    last = scheduler.submit(STEPS, ['b', 'a'])
+    assert scheduler.queued('a') is last
+    scheduler.cancel(last)
+    assert scheduler.queued('a') is not None
+    assert scheduler.queued('b') is None
@@ -0,0 +1,90 @@
+"""
+Journal resume and compaction
+"""
+import json
+
+import pytest
+
+import journal
+from journal import Journal
+
+STEPS = [0, 2]  # per-board steps, 1 is global
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "journal" / "journal.jsonl")
+
+
+def records(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def interrupted(path, inputs="inputs"):
+    # a run that completed board 'a', failed the last step on 'b', and never reached 'c'
+    run = Journal(path)
+    run.start(inputs, STEPS)
+    run.record('a', 0, True, 1, 2)
+    run.record('b', 0, True, 2, 3)
+    run.record(None, 1, True, 3, 4)
+    run.record('a', 2, True, 4, 5)
+    run.record('b', 2, False, 5, 6)
+    run.close()
+    return run.run
+
+
+def test_resume(path):
+    previous = interrupted(path)
+    run = Journal(path)
+    assert run.start("inputs", STEPS, resume=True) == {'a'}
+    assert run.run == previous
+    run.record('b', 2, True, 7, 8)
+    run.close()
+
+    # resumed again, the steps of both attempts count
+    run = Journal(path)
+    assert run.start("inputs", STEPS, resume=True) == {'a', 'b'}
+    assert run.run == previous
+    run.close()
+    assert [record['type'] for record in records(path)] == ['start'] + ['step'] * 5 + ['resume', 'step', 'resume']
+
+
+def test_new_run(path):
+    previous = interrupted(path)
+    run = Journal(path)
+    assert run.start("other inputs", STEPS, resume=True) == set()
+    assert run.run != previous
+    run.close()
+    run = Journal(path)
+    assert run.start("inputs", STEPS, resume=False) == set()
+    assert run.run != previous
+    run.close()
+
+
+def test_truncated_record(path):
+    interrupted(path)
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write('{"type":"step","run":"')  # crashed while writing
+    run = Journal(path)
+    assert run.start("inputs", STEPS, resume=True) == {'a'}
+    run.close()
+
+
+def test_compaction(path, monkeypatch):
+    monkeypatch.setattr(journal, 'JOURNAL_HISTORY', 2)
+    runs = []
+    for _ in range(3):
+        run = Journal(path)
+        run.start("inputs", STEPS, resume=True)
+        run.record('a', 0, True, 1, 2)
+        runs.append(run.run)
+        run.finish()
+        assert run.run is None
+
+    # only the summaries of the last runs are kept
+    summaries = records(path)
+    assert [record['type'] for record in summaries] == ['summary'] * 2
+    assert [record['run'] for record in summaries] == runs[1:]
+    assert all(record['steps'] == 1 for record in summaries)
+    assert len(set(runs)) == 3  # a finished run is never resumed
@@ -0,0 +1,130 @@
+"""
+Pipeline lanes and cancellation, with fake steps
+"""
+from threading import Event, Lock
+from time import sleep
+
+import pytest
+
+from cancel import CancelException
+from pipeline import GLOBAL, Pipeline, step
+
+BOARDS = ['a', 'b', 'c']
+
+
+class Boards:
+    def __init__(self, delay=0.02, concurrent=()):
+        self.delay = delay
+        self.concurrent = concurrent  # their exclusive steps run on the pool
+        self.enabled = set(BOARDS)
+        self.running = []  # (step, board) running now
+        self.runs = []  # (step, board, enabled boards) in order of start
+        self.overlap = 0  # maximum number of steps running at the same time
+        self._lock = Lock()
+
+    def switch(self, board, keep):
+        with self._lock:
+            assert not any(self._lane(*other) for other in self.running), "switched while an exclusive step was running"
+            self.enabled = {board, *keep}
+        return True
+
+    def run(self, s, board):
+        with self._lock:
+            if self._lane(s, board): assert not any(self._lane(*other) for other in self.running), "two exclusive steps at the same time"
+            self.running.append((s, board))
+            self.runs.append((s, board, frozenset(self.enabled)))
+            self.overlap = max(self.overlap, len(self.running))
+        try:
+            sleep(self.delay)
+            if s.parameter == f"fail-{board}": raise RuntimeError(f"failed on {board}")
+        finally:
+            with self._lock:
+                self.running.remove((s, board))
+
+    def _lane(self, s, board):
+        return s.exclusive and board not in self.concurrent
+
+
+def test_exclusive_steps_run_alone_on_their_board():
+    boards = Boards()
+    steps = [step('script', 'setup', GLOBAL), step('bitstream', 'design.bit'), step('script', 'check', exclusive=False), step('script', 'test')]
+    pipeline = Pipeline(steps, BOARDS, boards.run, boards.switch)
+    timings = pipeline.execute(Event())
+    assert len(timings) == len(pipeline) == 1 + 3 * len(BOARDS)
+    assert all(timing.error is None for timing in timings)
+    for s, board, enabled in boards.runs:
+        if s.exclusive and board is not None: assert enabled == {board}
+    # the exclusive steps run in the order of the boards
+    assert [board for s, board, _ in boards.runs if s.parameter == 'design.bit'] == BOARDS
+
+
+def test_parallel_steps_overlap():
+    boards = Boards(delay=0.2)
+    steps = [step('script', 'check', exclusive=False)]
+    Pipeline(steps, BOARDS, boards.run, boards.switch).execute(Event())
+    assert boards.overlap == len(BOARDS)
+
+
+def test_concurrent_bitstreams_run_on_the_pool():
+    boards = Boards(delay=0.2, concurrent=('b', 'c'))
+    steps = [step('bitstream', 'design.bit')]
+    pipeline = Pipeline(steps, BOARDS, boards.run, boards.switch, concurrent=boards.concurrent)
+    pipeline.execute(Event())
+    assert pipeline.switches == ['a']
+    assert boards.overlap > 1
+    # the board of the lane keeps the concurrent ones enabled
+    assert [enabled for s, board, enabled in boards.runs if board == 'a'] == [{'a', 'b', 'c'}]
+
+
+def test_failure_stops_only_its_board():
+    boards = Boards()
+    steps = [step('script', 'fail-b'), step('bitstream', 'design.bit'), step('script', 'end', GLOBAL)]
+    timings = Pipeline(steps, BOARDS, boards.run, boards.switch).execute(Event())
+    errors = {(timing.step.parameter, timing.board): timing.error for timing in timings}
+    assert isinstance(errors['fail-b', 'b'], RuntimeError)
+    assert errors['design.bit', 'b'] is errors['fail-b', 'b']
+    assert errors['design.bit', 'a'] is None and errors['design.bit', 'c'] is None
+    # global steps only stop after a failed global step
+    assert errors['end', None] is None
+    assert ('design.bit', 'b') not in [(s.parameter, board) for s, board, _ in boards.runs]
+
+
+def test_unavailable_board():
+    boards = Boards()
+    pipeline = Pipeline([step('bitstream', 'design.bit')], BOARDS, boards.run, lambda board, keep: board != 'b')
+    errors = {timing.board: timing.error for timing in pipeline.execute(Event())}
+    assert isinstance(errors['b'], LookupError)
+    assert errors['a'] is None and errors['c'] is None
+
+
+def test_cancelled_during_a_step():
+    boards = Boards()
+    cancelled = Event()
+
+    def run(s, board):
+        if board == 'b': cancelled.set()
+        boards.run(s, board)
+
+    steps = [step('bitstream', 'design.bit'), step('script', 'check', exclusive=False)]
+    pipeline = Pipeline(steps, BOARDS, run, boards.switch)
+    with pytest.raises(CancelException):
+        pipeline.execute(cancelled)
+    # nothing started after the cancellation, and every step is finished
+    assert [board for s, board, _ in boards.runs if s.exclusive] == ['a', 'b']
+    assert all(node.future.done() for node in pipeline.nodes)
+    assert isinstance(pipeline.nodes[-1].future.exception(), CancelException)
+
+
+def test_cancelled_by_a_step():
+    boards = Boards()
+
+    def run(s, board):
+        boards.run(s, board)
+        if board == 'a': raise CancelException()
+
+    cancelled = Event()
+    pipeline = Pipeline([step('bitstream', 'design.bit')], BOARDS, run, boards.switch)
+    with pytest.raises(CancelException):
+        pipeline.execute(cancelled)
+    assert cancelled.is_set()
+    assert [board for _, board, _ in boards.runs] == ['a']
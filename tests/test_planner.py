@@ -0,0 +1,49 @@
+"""
+Transitions between board states
+"""
+import itertools
+
+import planner
+from planner import DISABLE, ENABLE
+
+
+def test_plan_changes_only_what_differs():
+    current = {'a': True, 'b': False, 'c': True}
+    assert planner.plan(current, {'a': True, 'b': True, 'c': False}) == [(ENABLE, 'b'), (DISABLE, 'c')]
+    assert planner.plan(current, current) == []
+
+
+def test_plan_enables_before_disabling():
+    operations = planner.plan({'a': True, 'b': False}, {'a': False, 'b': True})
+    assert operations == [(ENABLE, 'b'), (DISABLE, 'a')]
+
+
+def test_plan_skips_undefined_and_missing_boards():
+    current = {'a': None, 'b': True}
+    assert planner.plan(current, {'a': True, 'b': None, 'c': True}) == []
+
+
+def test_only_and_every():
+    current = {'a': True, 'b': False, 'c': None}
+    assert planner.only(current, 'b') == {'a': False, 'b': True, 'c': False}
+    assert planner.every(current, True) == {'a': True, 'b': True, 'c': True}
+
+
+def test_plan_reaches_the_desired_states():
+    # every combination of current and desired states of 3 boards
+    boards = ['a', 'b', 'c']
+    for states in itertools.product((True, False), repeat=len(boards)):
+        current = dict(zip(boards, states))
+        for desired_states in itertools.product((True, False, None), repeat=len(boards)):
+            desired = dict(zip(boards, desired_states))
+            operations = planner.plan(current, desired)
+            result = planner.apply(current, operations)
+            assert all(result[board] == (state if state is not None else current[board]) for board, state in desired.items())
+            assert len(operations) == sum(state is not None and state != current[board] for board, state in desired.items())
+
+
+def test_sequence_switches_one_board_at_a_time():
+    current = {'a': True, 'b': True, 'c': False}
+    plans, final = planner.sequence(current, ['c', 'a'])
+    assert plans == [[(ENABLE, 'c'), (DISABLE, 'a'), (DISABLE, 'b')], [(ENABLE, 'a'), (DISABLE, 'c')]]
+    assert final == {'a': True, 'b': False, 'c': False}
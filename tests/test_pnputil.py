@@ -0,0 +1,70 @@
+"""
+Streaming parser of the pnputil enumeration
+"""
+from CONFIG import FPGA_DESCRIPTION
+from pnputil import Device, parse
+
+BOARD = f"""Instance ID:                USB\\VID_0403&PID_6010&MI_00\\6&2c5a0e3f&0&0000
+Device Description:         {FPGA_DESCRIPTION}
+Class Name:                 USB
+Class GUID:                 {{36fc9e60-c465-11cf-8056-444553540000}}
+Manufacturer Name:          FTDI
+Status:                     Started
+Driver Name:                oem42.inf
+"""
+
+HUB = """Instance ID:                USB\\ROOT_HUB30\\4&3a1f0c55&0&0
+Device Description:         USB Root Hub (USB 3.0)
+Class Name:                 USB
+Class GUID:                 {36fc9e60-c465-11cf-8056-444553540000}
+Manufacturer Name:          (Standard USB HUBs)
+Status:                     Started
+Driver Name:                usbhub3.inf
+"""
+
+
+def lines(text):
+    return iter(text.splitlines(keepends=True))
+
+
+def test_devices():
+    devices = list(parse(lines("Microsoft PnP Utility\n\n" + BOARD + "\n" + HUB + "\n")))
+    assert devices == [
+        Device("USB\\VID_0403&PID_6010&MI_00\\6&2c5a0e3f&0&0000", FPGA_DESCRIPTION, "Started"),
+        Device("USB\\ROOT_HUB30\\4&3a1f0c55&0&0", "USB Root Hub (USB 3.0)", "Started"),
+    ]
+
+
+def test_description_filter():
+    devices = list(parse(lines(HUB + "\n" + BOARD + "\n" + HUB), FPGA_DESCRIPTION))
+    assert [device.device_description for device in devices] == [FPGA_DESCRIPTION]
+
+
+def test_streaming():
+    # each device is yielded as soon as its block ends, before the rest is read
+    def output():
+        yield from lines(BOARD + "\n")
+        raise AssertionError("read too far")
+
+    assert next(parse(output())).status == "Started"
+
+
+def test_truncated_output():
+    # last block without the final blank line
+    assert [device.id for device in parse(lines(HUB + "\n" + BOARD))] == ["USB\\ROOT_HUB30\\4&3a1f0c55&0&0", "USB\\VID_0403&PID_6010&MI_00\\6&2c5a0e3f&0&0000"]
+    # block cut after the description: the missing fields are empty
+    assert list(parse(lines("\n".join(BOARD.splitlines()[:2])))) == [Device("USB\\VID_0403&PID_6010&MI_00\\6&2c5a0e3f&0&0000", FPGA_DESCRIPTION, "")]
+    # block cut before the id: nothing
+    assert list(parse(lines("\n" + "\n".join(BOARD.splitlines()[1:]) + "\n\n"))) == []
+    assert list(parse(lines(""))) == []
+
+
+def test_unknown_keys_by_position():
+    # other languages: the fields are taken by their position in the block
+    translated = "\n".join(f"Clave {index}: {line.partition(':')[2].strip()}" for index, line in enumerate(BOARD.splitlines())) + "\n\n"
+    assert list(parse(lines(translated))) == [Device("USB\\VID_0403&PID_6010&MI_00\\6&2c5a0e3f&0&0000", FPGA_DESCRIPTION, "Started")]
+
+
+def test_parent():
+    device, = parse(lines(BOARD + "Parent:                     USB\\VID_0403&PID_6010\\FT000001\n\n"))
+    assert device.parent == "USB\\VID_0403&PID_6010\\FT000001"
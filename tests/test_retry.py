@@ -0,0 +1,72 @@
+"""
+Retry policy: backoff, jitter and deadline
+"""
+import subprocess
+
+import pytest
+
+import retry
+from retry import Retry
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # records the waits instead of sleeping, the clock advances with them
+    waits = []
+    now = [0.0]
+    monkeypatch.setattr(retry, 'sleep', lambda seconds: (waits.append(seconds), now.__setitem__(0, now[0] + seconds)))
+    monkeypatch.setattr(retry, 'monotonic', lambda: now[0])
+    return waits
+
+
+def test_backoff_doubles_up_to_the_maximum(sleeps):
+    assert list(Retry(6, 0.5, 3.0, 100, jitter=0)) == [1, 2, 3, 4, 5, 6]
+    assert sleeps == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_jitter_stays_in_bounds(sleeps):
+    for _ in range(200):
+        list(Retry(4, 1.0, 4.0, 1000, jitter=0.25))
+    for index, wait in enumerate(sleeps):
+        base = min(1.0 * 2 ** (index % 3), 4.0)
+        assert base * 0.75 <= wait <= base * 1.25
+    assert len(set(sleeps)) > 3  # randomized
+
+
+def test_deadline_stops_before_waiting_past_it(sleeps):
+    assert list(Retry(10, 1.0, 1.0, 3.5, jitter=0)) == [1, 2, 3, 4]
+    assert sum(sleeps) <= 3.5
+
+
+def test_call_retries_until_it_succeeds(sleeps):
+    results = iter([OSError("busy"), OSError("busy"), "done"])
+
+    def function():
+        result = next(results)
+        if isinstance(result, Exception): raise result
+        return result
+
+    assert Retry(5, 0.1, 1.0, 100, jitter=0).call(function) == "done"
+    assert len(sleeps) == 2
+
+
+def test_call_raises_fatal_errors_at_once(sleeps):
+    calls = []
+
+    def function():
+        calls.append(1)
+        raise subprocess.CalledProcessError(5, "pnputil")  # access denied
+
+    with pytest.raises(subprocess.CalledProcessError):
+        Retry(5, 0.1, 1.0, 100).call(function)
+    assert len(calls) == 1
+
+
+def test_call_raises_the_last_error(sleeps):
+    errors = iter([OSError("first"), OSError("last")])
+
+    def function():
+        raise next(errors)
+
+    with pytest.raises(OSError, match="last"):
+        Retry(2, 0.1, 1.0, 100).call(function)
@@ -0,0 +1,66 @@
+"""
+Switching boards when they are connected or disconnected during a run, with fake devices
+"""
+import pytest
+
+from fpgas import FPGAs
+from pnputil import Device
+from runner import Runner
+
+
+class Hardware:
+    # connected boards and their states, enumerated by the FPGAs
+    def __init__(self, fpgas, boards):
+        self.fpgas = fpgas
+        self.boards = dict.fromkeys(boards, True)
+        self.unplug = {}  # board disconnected when the given one is changed
+
+    def enumerate(self):
+        return tuple(Device(board, "FPGA", "Started" if enabled else "Disabled") for board, enabled in self.boards.items())
+
+    def change(self, board, enabled):
+        self.boards.pop(self.unplug.pop(board, None), None)
+        if board not in self.boards: return False
+        self.boards[board] = enabled
+        self.fpgas._set_enabled(board, enabled)
+        return True
+
+
+@pytest.fixture
+def hardware(monkeypatch):
+    fpgas = FPGAs()
+    hardware = Hardware(fpgas, ['a', 'b', 'c'])
+    monkeypatch.setattr(fpgas, 'enumerate', hardware.enumerate)
+    monkeypatch.setattr(fpgas, 'enable', lambda board: hardware.change(board, True))
+    monkeypatch.setattr(fpgas, 'disable', lambda board: hardware.change(board, False))
+    fpgas.update()
+    yield hardware
+    fpgas.close()
+
+
+def test_generation(hardware):
+    fpgas = hardware.fpgas
+    generation = fpgas.generation
+    fpgas.disable('a')
+    fpgas.update()
+    assert fpgas.generation == generation  # same boards
+    hardware.boards['d'] = True
+    fpgas.update()
+    assert fpgas.generation == generation + 1
+
+
+def test_switch_after_a_board_is_disconnected(hardware):
+    runner = Runner(None, hardware.fpgas, None, None, None)
+    hardware.unplug['c'] = 'c'  # while disabling it
+
+    assert runner.switch('b')
+    assert hardware.fpgas.get_state() == {'a': False, 'b': True}
+
+
+def test_switch_fails_without_changes(hardware):
+    runner = Runner(None, hardware.fpgas, None, None, None)
+    hardware.fpgas.disable = lambda board: board != 'c' and hardware.change(board, False)
+    generation = hardware.fpgas.generation
+
+    assert not runner.switch('b')
+    assert hardware.fpgas.generation == generation
@@ -0,0 +1,60 @@
+"""
+Concurrent programming with the Vivado sessions, on the simulated hardware
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+if os.name == 'nt': pytest.skip("the simulator runs on Linux", allow_module_level=True)
+
+from simulator import Simulator
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cli.py')
+
+
+def program(simulator, home, bitstream, *parameters, force=True):
+    # runs 'cli.py program' on the simulator, returns its events
+    environment = simulator.environment()
+    environment['HOME'] = environment['USERPROFILE'] = str(home)
+    process = subprocess.run([sys.executable, CLI, 'program', '--bit', str(bitstream), *(['--force'] if force else []), *simulator.parameters(), *parameters],
+                             env=environment, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, timeout=300)
+    return [json.loads(line) for line in process.stdout.splitlines()]
+
+
+def test_each_session_programs_its_own_board(tmp_path):
+    # 3 boards with a unique serial (programmed by the 2 sessions), 3 with the shared one (by the main session)
+    simulator = Simulator(tmp_path / 'simulator', boards=6, unique=3, startup=0.2, acquire=0.05, program=0.1)
+    bitstream = tmp_path / 'design.bit'
+    bitstream.write_bytes(b'design')
+
+    events = program(simulator, tmp_path / 'home', bitstream, 'VIVADO_SESSIONS=2')
+
+    boards = list(simulator.state())
+    results = {event['board']: event['status'] for event in events if event['event'] == 'bitstream'}
+    assert results == {board: 'ok' for board in boards}
+    programmed = simulator.programmed()
+    assert sorted(board for board, _ in programmed) == sorted(boards)  # each one once
+    for board, port in programmed:
+        if boards.index(board) < 3:
+            assert port in (3122, 3123)
+        else:
+            assert port == 3121
+
+
+def test_skipped_boards_were_programmed(tmp_path):
+    # the boards recorded as programmed (skipped by the next run) hold the bitstream
+    simulator = Simulator(tmp_path / 'simulator', boards=4, unique=2, startup=0.2, acquire=0.05, program=0.1)
+    bitstream = tmp_path / 'design.bit'
+    bitstream.write_bytes(b'design')
+    program(simulator, tmp_path / 'home', bitstream, 'VIVADO_SESSIONS=2')
+    simulator.reset_counts()
+
+    events = program(simulator, tmp_path / 'home', bitstream, 'VIVADO_SESSIONS=2', force=False)
+
+    assert simulator.programmed() == []
+    assert all(event['status'] == 'skipped' for event in events if event['event'] == 'bitstream')
+    with open(simulator.directory + '/state.json') as file:
+        assert all(entry['bitstream'] is not None for entry in json.load(file).values())
@@ -0,0 +1,42 @@
+"""
+Local copies of the bitstreams
+"""
+import os
+
+import pytest
+
+from staging import Staging
+
+
+@pytest.fixture
+def staging(tmp_path):
+    staging = Staging()
+    staging.path = str(tmp_path / 'staging')
+    yield staging
+    staging.close()
+
+
+def test_copy_is_kept_while_the_source_is_unreachable(staging, tmp_path):
+    source = tmp_path / 'design.bit'
+    source.write_bytes(b'first')
+    sha256, local = staging.get(str(source))
+    assert open(local, 'rb').read() == b'first'
+
+    source.unlink()  # share hiccup
+    assert staging.get(str(source)) == (sha256, local)
+
+
+def test_modified_source_is_copied_again(staging, tmp_path):
+    source = tmp_path / 'design.bit'
+    source.write_bytes(b'first')
+    first, _ = staging.get(str(source))
+    source.write_bytes(b'second version')
+    os.utime(source, ns=(1, 1))  # a different modification time, even on coarse clocks
+
+    second, local = staging.get(str(source))
+    assert second != first
+    assert open(local, 'rb').read() == b'second version'
+
+
+def test_unreachable_source_is_not_hashed(staging, tmp_path):
+    assert staging.get(str(tmp_path / 'missing.bit')) == (None, str(tmp_path / 'missing.bit'))
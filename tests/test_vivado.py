@@ -0,0 +1,77 @@
+"""
+Preparation of the Vivado session, with a fake console
+"""
+from threading import Event, Thread
+from time import monotonic
+
+import pytest
+
+import vivado
+from vivado import Vivado
+
+
+class FakeConsole:
+    # console of a Vivado already running in the daemon
+    def __init__(self, **state):
+        self.state = state
+        self.commands = []
+
+    def write(self, command):
+        self.commands.append(command)
+
+    def get(self, key):
+        return self.state.get(key)
+
+    def set(self, key, value):
+        self.state[key] = value
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = Vivado()
+    session.launcher = "vivado"
+    started = []
+    monkeypatch.setattr(session, '_start_watchdog', lambda: started.append('watchdog'))
+    monkeypatch.setattr(session, '_warm', lambda: started.append('standby'))
+    session.started = started
+    return session
+
+
+def test_running_in_the_daemon(session, monkeypatch):
+    monkeypatch.setattr(vivado, 'VIVADO_STANDBY', True)
+    session._console = FakeConsole(launched=True, ready=True, acquired=True)
+
+    session.prepare()
+
+    assert session.ready
+    assert session._console.get('acquired') is False  # the boards may have changed
+    assert session._console.commands == vivado.PROCS
+    assert session.started == ['standby', 'watchdog']
+
+
+def test_preload_does_not_wait_for_other_operations(session):
+    session._console = FakeConsole()
+    locked, release = Event(), Event()
+
+    def recovering():
+        with session._lock:
+            locked.set()
+            release.wait(5)
+
+    thread = Thread(target=recovering)
+    thread.start()
+    locked.wait(5)
+    try:
+        start = monotonic()
+        session.prepare(wait_ready=False)
+        assert monotonic() - start < 1
+        assert session._console.commands == []  # left to the running operation
+    finally:
+        release.set()
+        thread.join()
+
+    # once free, it is launched without waiting
+    session.prepare(wait_ready=False)
+    assert session._console.get('launched')
+    assert not session.ready
+    assert session.started == []
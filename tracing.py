@@ -0,0 +1,201 @@
+"""
+Lightweight instrumentation: timed spans, counters and latency histograms.
+Spans are context managers measured with a monotonic clock, nested per thread:
+    with tracing.span('program', board=name):
+        ...
+They are kept in memory (last TRACE_BUFFER) and can be exported as json lines or as Chrome trace events
+(chrome://tracing, Perfetto). Each span is also observed in the histogram fdt_<name>_seconds, labelled with its attributes.
+With TRACE_ENABLED and METRICS_PORT disabled, span() returns a shared no-op context and nothing is recorded.
+With METRICS_PORT, the metrics are served on http://127.0.0.1:<port>/metrics in the Prometheus text format.
+"""
+import json
+import os
+import re
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count as counter
+from time import monotonic, time
+from typing import NamedTuple
+
+import log
+from CONFIG import TRACE_ENABLED, TRACE_BUFFER, TRACE_FILE, METRICS_PORT
+
+logger = log.get(__name__)
+
+ENABLED = TRACE_ENABLED or METRICS_PORT != 0
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)  # seconds
+
+_NULL = nullcontext()
+_EPOCH = time() - monotonic()  # to convert monotonic times to wall times
+_ids = counter(1)
+_local = threading.local()  # open spans of each thread
+_lock = threading.Lock()
+spans = deque(maxlen=TRACE_BUFFER)
+histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, count, sum]
+counters = {}  # (name, labels) -> value
+
+
+class Span(NamedTuple):
+    name: str
+    id: int
+    parent: int | None
+    thread: str
+    start: float  # monotonic seconds
+    duration: float  # seconds
+    attributes: dict
+
+
+class _Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault('stack', [])
+        self.id = next(_ids)
+        self.parent = stack[-1] if stack else None
+        stack.append(self.id)
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        duration = monotonic() - self.start
+        _local.stack.pop()
+        if kind is not None: self.attributes['error'] = kind.__name__
+        spans.append(Span(self.name, self.id, self.parent, threading.current_thread().name, self.start, duration, self.attributes))
+        observe(self.name, duration, **{key: value for key, value in self.attributes.items() if key != 'error'})
+
+
+def span(name, **attributes):
+    """
+    Returns a context manager that records the time spent inside it
+    """
+    return _Span(name, attributes) if ENABLED else _NULL
+
+
+def observe(name, seconds, **labels):
+    """
+    Adds a value to the histogram fdt_<name>_seconds
+    """
+    if not ENABLED: return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = histograms.setdefault(key, [0] * (len(BUCKETS) + 3))  # each bucket, +Inf, count and sum
+        histogram[bisect_left(BUCKETS, seconds)] += 1  # buckets are made cumulative when rendered
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+def count(name, value=1, **labels):
+    """
+    Increases the counter fdt_<name>_total
+    """
+    if not ENABLED: return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+# export
+
+def export_jsonl(path):
+    """
+    Saves the recorded spans as json lines (times in wall clock seconds)
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        for s in list(spans):
+            file.write(json.dumps({'name': s.name, 'id': s.id, 'parent': s.parent, 'thread': s.thread, 'start': round(_EPOCH + s.start, 6), 'duration': round(s.duration, 6), **s.attributes}) + '\n')
+
+
+def chrome_trace():
+    """
+    Returns the recorded spans in the Chrome trace event format
+    """
+    return {'traceEvents': [
+        {'name': s.name, 'ph': 'X', 'ts': round(s.start * 1e6), 'dur': round(s.duration * 1e6), 'pid': os.getpid(), 'tid': s.thread, 'args': {'id': s.id, 'parent': s.parent, **s.attributes}}
+        for s in list(spans)
+    ], 'displayTimeUnit': 'ms'}
+
+
+def export(path=TRACE_FILE):
+    """
+    Saves the recorded spans, as Chrome trace events if 'path' ends with .json or as json lines otherwise
+    """
+    if not ENABLED or not path: return
+    path = os.path.expanduser(path)
+    if path.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(chrome_trace(), file)
+    else:
+        export_jsonl(path)
+    logger.info("Trace saved to %s", path)
+
+
+def prometheus():
+    """
+    Returns the metrics in the Prometheus text exposition format
+    """
+    def metric(name):
+        return 'fdt_' + re.sub(r'\W', '_', name)
+
+    def labels(pairs, extra=()):
+        pairs = [*pairs, *extra]
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+    lines = []
+    with _lock:
+        histogram_items = sorted(histograms.items())
+        counter_items = sorted(counters.items())
+    for name in sorted({name for (name, _), _ in histogram_items}):
+        lines.append(f"# TYPE {metric(name)}_seconds histogram")
+        for (other, pairs), values in histogram_items:
+            if other != name: continue
+            cumulative = 0
+            for bucket, value in zip(BUCKETS + ('+Inf',), values):
+                cumulative += value
+                lines.append(f"{metric(name)}_seconds_bucket{labels(pairs, [('le', bucket)])} {cumulative}")
+            lines.append(f"{metric(name)}_seconds_count{labels(pairs)} {values[-2]}")
+            lines.append(f"{metric(name)}_seconds_sum{labels(pairs)} {values[-1]:.6f}")
+    for name in sorted({name for (name, _), _ in counter_items}):
+        lines.append(f"# TYPE {metric(name)}_total counter")
+        for (other, pairs), value in counter_items:
+            if other == name: lines.append(f"{metric(name)}_total{labels(pairs)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, kind = prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+        elif self.path == '/trace.json':
+            body, kind = json.dumps(chrome_trace()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # not logged
+
+
+def serve(port=METRICS_PORT):
+    """
+    Serves the metrics on localhost, from a background thread
+    Returns the server (None if disabled)
+    """
+    if not port: return None
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics available on http://127.0.0.1:%d/metrics", server.server_address[1])
+    return server
@@ -1,13 +1,142 @@
+import os
+import re
 import subprocess
 from glob import glob
-from time import sleep
+from threading import RLock, Thread
+from time import monotonic, sleep, time
+from typing import NamedTuple
 
-from CONFIG import VIVADO_PATH, VIVADO_STARTUP_LOAD, VIVADO_PROGRAM_RETRY
+from CONFIG import VIVADO_PATH, VIVADO_STARTUP_LOAD, VIVADO_PROGRAM_RETRY, VIVADO_PROGRAM_RETRY_DELAY, VIVADO_PROGRAM_RETRY_MAX_DELAY, VIVADO_PROGRAM_RETRY_DEADLINE, VIVADO_STARTUP_TIMEOUT, VIVADO_PROGRAM_TIMEOUT, VIVADO_PROGRAM_BATCH, VIVADO_DEVICE, VIVADO_ACQUIRE_TIMEOUT, VIVADO_DAEMON, VIVADO_STANDBY, VIVADO_HEARTBEAT_INTERVAL, VIVADO_HEARTBEAT_TIMEOUT
+import daemon
+import log
+import tracing
+from cancel import CancelException
+from console import Console
+from retry import Retry
+
+logger = log.get(__name__)
+
+# programs a device with retries (no new attempt after 'deadline' ms), and prints a single result line:
+# FDT_PROGRAM <status> <attempts> <elapsed ms> <message>
+PROGRAM_PROC = """proc fdt_program {device bitfile retries delay max_delay deadline} {
+    set start [clock milliseconds]
+    set status error
+    set attempt 0
+    # kept when programming the same bitstream again
+    if {[catch {if {[get_property PROGRAM.FILE $device] ne $bitfile} {set_property PROGRAM.FILE $bitfile $device}} message]} {
+        set retries 0
+    }
+    while {$attempt < $retries} {
+        if {$attempt > 0} {
+            if {[clock milliseconds] + $delay - $start > $deadline} {
+                set status timeout
+                set message "Deadline reached, last error: $message"
+                break
+            }
+            after $delay
+            set delay [expr {min($delay * 2, $max_delay)}]
+        }
+        incr attempt
+        if {[catch {program_hw_devices $device} message]} {
+            set status error
+            continue
+        }
+        catch {refresh_hw_device -update_hw_probes false $device}
+        if {[get_property REGISTER.IR.BIT5_DONE $device] == 1} {
+            set status ok
+            set message ""
+            break
+        }
+        set status notdone
+        set message "DONE is low after programming"
+    }
+    puts "FDT_PROGRAM $status $attempt [expr {[clock milliseconds] - $start}] [string map {"\n" " "} $message]"
+}"""
+
+
+# (re)connects to the first target matching 'target' (except the 'exclude' ones) and selects the device matching the pattern
+# prints: FDT_ACQUIRE <status> <elapsed ms> <device or message>
+ACQUIRE_PROC = """proc fdt_acquire {pattern {target *} {exclude {}}} {
+    global hw_device
+    set start [clock milliseconds]
+    set hw_device ""
+    if {[catch {
+        catch {close_hw_target}
+        refresh_hw_server
+        set targets [get_hw_targets $target]
+        foreach excluded $exclude { set targets [lsearch -all -inline -not -exact $targets $excluded] }
+        if {[llength $targets] == 0} { error "no target matching $target" }
+        current_hw_target [lindex $targets 0]
+        open_hw_target
+        set hw_device [lindex [get_hw_devices $pattern] 0]
+        if {$hw_device eq ""} { error "no device matching $pattern" }
+        current_hw_device $hw_device
+    } message]} {
+        puts "FDT_ACQUIRE error [expr {[clock milliseconds] - $start}] [string map {"\n" " "} $message]"
+    } else {
+        puts "FDT_ACQUIRE ok [expr {[clock milliseconds] - $start}] $hw_device"
+    }
+}"""
+
+
+# reads back the configuration state of a device, prints: FDT_IDENTIFY <done> <usercode> <usr_access>
+IDENTIFY_PROC = """proc fdt_identify {device} {
+    catch {refresh_hw_device -update_hw_probes false $device}
+    set values {}
+    foreach property {REGISTER.IR.BIT5_DONE REGISTER.USERCODE REGISTER.USR_ACCESS} {
+        if {[catch {lappend values [get_property $property $device]}]} { lappend values "" }
+    }
+    puts "FDT_IDENTIFY [join $values " "]"
+}"""
+
+
+# lists the connected targets, prints: FDT_TARGETS <target> ...
+TARGETS_PROC = """proc fdt_targets {} {
+    catch {refresh_hw_server}
+    puts "FDT_TARGETS [join [get_hw_targets *] " "]"
+}"""
+
+PROCS = [ACQUIRE_PROC, PROGRAM_PROC, IDENTIFY_PROC, TARGETS_PROC]
+
+
+class ProgramResult(NamedTuple):
+    """
+    Outcome of Vivado.program
+    """
+    status: str  # 'ok', 'notdone' (programmed but not started), 'error', 'timeout' (retries stopped by the deadline) or 'unavailable'
+    attempts: int
+    elapsed_ms: int
+    message: str
+
+
+# bash reads a pipe one line at a time, leaving the rest of the commands for Vivado (sh may read ahead and run them)
+SHELL = 'cmd.exe' if os.name == 'nt' else 'bash'
+
+
+def tcl_path(path):
+    """
+    Returns 'path' as a double-quoted tcl word: with forward slashes (backslashes would be escapes) and $[]" escaped
+    """
+    return '"' + re.sub(r'([$\[\]"])', r'\\\1', path.replace('\\', '/')) + '"'
+
+
+PROGRAM_RETRY = Retry(VIVADO_PROGRAM_RETRY, VIVADO_PROGRAM_RETRY_DELAY, VIVADO_PROGRAM_RETRY_MAX_DELAY, VIVADO_PROGRAM_RETRY_DEADLINE)
 
 
 class Vivado:
-    def __init__(self):
-        self._instance: subprocess.Popen | None = None
+    def __init__(self, port=None):
+        """
+        Vivado session, connected to the default hw_server or, if 'port' is given, to its own one launched on that port
+        """
+        self.port = port
+        self.target = None  # target to acquire, None for the first one
+        self.exclude = []  # targets never acquired (used by other sessions)
+        self._hw_server = None
+        self._console: Console | None = None
+        self._standby: Console | None = None  # pre-launched instance, to replace the current one if it fails
+        self._lock = RLock()  # the console is used by one operation at a time (including the watchdog)
+        self._heartbeats = 0
+        self._watchdog = None
         self.ready = False
 
         # TODO allow user to choose version
@@ -15,84 +144,316 @@ class Vivado:
 
         # preload
         if VIVADO_STARTUP_LOAD:
-            print("Preloading Vivado")
+            logger.info("Preloading Vivado")
             self.prepare(wait_ready=False)
 
     def is_vivado_available(self):
         return self.launcher is not None
 
-    def prepare(self, wait_ready=True):
+    def prepare(self, wait_ready=True, cancel=None):
         if self.ready: return  # already ready
-        if self.launcher is None: return  # cant launch
-
-        if self._instance is None:
-            print("Launching cmd...")
-            self._instance = subprocess.Popen('cmd.exe',
-                                              universal_newlines=True,
-                                              stdin=subprocess.PIPE,
-                                              stdout=subprocess.PIPE,
-                                              stderr=subprocess.STDOUT,
-                                              )
-            print("launching Vivado", self.launcher, "...")
-            self._run(self.launcher + " -mode tcl -nolog -nojournal -verbose")
-
-            # initialize hardware manager
-            self._run("load_features labtools")
-            self._run("if { [catch {open_hw_manager} error] } { open_hw }")
-            self._run("connect_hw_server -url TCP:localhost:3121")
-
-            # connect to first available target
-            self._run("set targu [get_hw_targets *]")
-            self._run("current_hw_target $targu")
-            self._run("open_hw_target")
-            self._run("set hw_device [lindex [get_hw_devices] 1]")
-            self._run("current_hw_device $hw_device")
-            self._run('puts "vivado is now ready"')
-
-        if wait_ready:
-            print("Waiting until Vivado is ready")
-            self._waitUntil("vivado is now ready")
-            self.ready = True
+        # a preload doesn't wait for the running operation (a recovery can take minutes), that one prepares it anyway
+        if not self._lock.acquire(blocking=wait_ready): return
+        try:
+            if self.ready: return  # prepared meanwhile
+            if self.launcher is None: return  # cant launch
 
-    def _run(self, command):
-        print("Running:", command)
-        self._instance.stdin.write(command)
-        self._instance.stdin.write('\n')
-        self._instance.stdin.flush()
-
-    def _waitUntil(self, expected):
-        print("Waiting for:", expected)
-        while True:
+            if self._console is None:
+                self._console = self._open()
+
+            if not self._console.get('launched'):
+                self._launch(self._console)
+
+            elif self._console.get('ready'):
+                # already running (from a daemon), but the boards may have changed meanwhile
+                logger.info("Vivado is already running")
+                for proc in PROCS:
+                    self._run(proc)  # may be from an older version
+                self._console.set('acquired', False)
+                self.ready = True
+
+            if VIVADO_STANDBY and self.port is None and self._standby is None:
+                self._warm()
+
+            if wait_ready and not self.ready:
+                logger.info("Waiting until Vivado is ready")
+                with tracing.span('vivado_ready'):
+                    self._expect([r'(?<!")vivado is now ready'], VIVADO_STARTUP_TIMEOUT, cancel)
+                if self._console.get('launched_at') is not None:
+                    tracing.observe('vivado_startup', time() - self._console.get('launched_at'))
+                self._console.set('ready', True)
+                self.ready = True
+
+            if self.ready: self._start_watchdog()
+        finally:
+            self._lock.release()
+
+    def _open(self):
+        # console where Vivado runs, from the daemon if enabled
+        if VIVADO_DAEMON and self.port is None:
+            try:
+                return daemon.attach(SHELL)
+            except OSError as e:
+                logger.warning("Unable to use the Vivado daemon, running locally: %s", e)
+        logger.debug("Launching %s ...", SHELL)
+        return Console(SHELL)
+
+    def _launch(self, console):
+        # launches Vivado on the console, without waiting nor connecting to the target
+        logger.info("Launching Vivado %s ...", self.launcher)
+        console.write(self.launcher + " -mode tcl -nolog -nojournal -verbose")
+
+        # initialize hardware manager
+        console.write("load_features labtools")
+        console.write("if { [catch {open_hw_manager} error] } { open_hw }")
+        if self.port is not None: self._launch_hw_server()
+        console.write(f"connect_hw_server -url TCP:localhost:{self.port or 3121}")
+        for proc in PROCS:
+            console.write(proc)
+        console.write('puts "vivado is now ready"')
+        console.set('launched', True)
+        console.set('launched_at', time())
+
+    def _launch_hw_server(self):
+        # launches the own hw_server of this session, unless it is running
+        if self._hw_server is not None and self._hw_server.poll() is None: return
+        hw_server = os.path.join(os.path.dirname(self.launcher), 'hw_server.bat' if os.name == 'nt' else 'hw_server')
+        logger.info("Launching hw_server on port %d", self.port)
+        self._hw_server = subprocess.Popen([hw_server, '-s', f"tcp::{self.port}"], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _acquire(self):
+        # command to acquire the target of this session
+        return f"fdt_acquire {{{VIVADO_DEVICE}}} {{{self.target or '*'}}} {{{' '.join(self.exclude)}}}"
+
+    def _warm(self):
+        # launches the standby instance in the background
+        logger.info("Launching standby Vivado")
+        self._standby = Console(SHELL)
+        self._launch(self._standby)
+
+    def _recover(self, cancel=None):
+        """
+        Replaces a failed Vivado, by the standby one if available (a new standby is then launched), or restarting it
+        """
+        with self._lock:
+            failed, self._console = self._console, None
+            self.ready = False
+            if failed is not None:
+                Thread(target=failed.close, daemon=True).start()
+
+            if self._standby is not None:
+                logger.warning("Promoting the standby Vivado")
+                self._console, self._standby = self._standby, None
+            else:
+                logger.warning("Restarting Vivado")
+            self.prepare(cancel=cancel)
+
+    def _start_watchdog(self):
+        if VIVADO_HEARTBEAT_INTERVAL <= 0 or self._watchdog is not None: return
+        self._watchdog = Thread(target=self._watch, name="vivado watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _watch(self):
+        # periodically checks that the current Vivado is responsive, while idle
+        while self._watchdog is not None:
+            sleep(VIVADO_HEARTBEAT_INTERVAL)
+            if not self._lock.acquire(blocking=False): continue  # busy, so probably alive
+            try:
+                if not self.ready or self._watchdog is None: continue
+                if not self.heartbeat():
+                    logger.warning("Vivado is not responding")
+                    self._recover()
+            except Exception as e:
+                logger.error("Unable to recover Vivado: %s", e)
+            finally:
+                self._lock.release()
+
+    def heartbeat(self):
+        """
+        returns true iff the current Vivado is alive and responds in time
+        """
+        with self._lock:
+            if self._console is None or not self._console.alive(): return False
+            self._heartbeats += 1
+            try:
+                self._console.skip()
+                self._run(f'puts "FDT_HEARTBEAT {self._heartbeats}"')
+                self._console.expect([rf'(?<!")FDT_HEARTBEAT {self._heartbeats}\b'], VIVADO_HEARTBEAT_TIMEOUT)
+                return True
+            except (TimeoutError, EOFError):
+                return False
+
+    def identify(self, cancel=None):
+        """
+        Reads back the identity of the current device (its USERCODE and USR_ACCESS registers)
+        returns None if it can't be read, or if the device is not configured
+        """
+        if self.launcher is None: return None
+        with self._lock:
+            self.prepare(cancel=cancel)
             try:
-                line = self._instance.stdout.readline()
-            except KeyboardInterrupt:
-                exit()
-            print("   >", line, end='')
-            if expected in line: return line
-
-    def program(self, bitfile):
-        if self.launcher is None: return
-        self.prepare()
-
-        # configure program
-        self._run(f'set_property PROGRAM.FILE "{bitfile}" $hw_device')
+                self._connected(cancel)
+                self._console.skip()
+                self._run("fdt_identify $hw_device")
+                _, match = self._expect([r"\bFDT_IDENTIFY (\S*) (\S*) (\S*)"], VIVADO_ACQUIRE_TIMEOUT, cancel)
+            except (TimeoutError, EOFError):
+                return None
+
+        done, usercode, usr_access = match.groups()
+        if done != '1' or not (usercode or usr_access): return None
+        return f"{usercode}/{usr_access}"
+
+    def reacquire(self, cancel=None):
+        """
+        Reconnects to the hardware target, needed after switching boards (and after launching, the boards may have
+        changed meanwhile). Restarts Vivado if it doesn't answer
+        Returns true iff the target was acquired
+        """
+        if self.launcher is None: return False
+        with self._lock:
+            self.prepare(cancel=cancel)
+            try:
+                return self._connect(cancel)
+            except (TimeoutError, EOFError):
+                pass
+
+            # fallback
+            self._recover(cancel)
+            try:
+                return self._connect(cancel)
+            except (TimeoutError, EOFError):
+                return False
+
+    def _connect(self, cancel=None):
+        # acquires the target, returns true iff it was. Raises TimeoutError or EOFError if Vivado doesn't answer
+        self._console.set('acquired', False)
+        self._console.skip()
+        self._run(self._acquire())
+        _, match = self._expect([r"\bFDT_ACQUIRE (\w+) (\d+) ?(.*)"], VIVADO_ACQUIRE_TIMEOUT, cancel)
+        if match[1] != 'ok':
+            logger.warning("Unable to acquire the target: %s", match[3])
+            return False
+        logger.debug("Target acquired in %s ms: %s", match[2], match[3])
+        self._console.set('acquired', True)
+        return True
+
+    def _connected(self, cancel=None):
+        # acquires the target if the current Vivado didn't yet (just launched, recovered or reattached)
+        if not self._console.get('acquired'): self._connect(cancel)
+
+    def targets(self, cancel=None):
+        """
+        Returns the names of the connected targets, empty if they can't be read
+        """
+        if self.launcher is None: return []
+        with self._lock:
+            self.prepare(cancel=cancel)
+            self._console.skip()
+            self._run("fdt_targets")
+            try:
+                _, match = self._expect([r"(?<!\")\bFDT_TARGETS ?(.*)"], VIVADO_ACQUIRE_TIMEOUT, cancel)
+            except (TimeoutError, EOFError):
+                return []
+        return match[1].split()
+
+    def release(self, cancel=None):
+        """
+        Closes the current target, so that other sessions can open it
+        """
+        if self._console is None or not self.ready: return
+        with self._lock:
+            self._console.skip()
+            self._run('catch {close_hw_target}; puts "FDT_RELEASED"')
+            try:
+                self._expect([r'(?<!")\bFDT_RELEASED'], VIVADO_ACQUIRE_TIMEOUT, cancel)
+            except (TimeoutError, EOFError):
+                pass
+
+    def _run(self, command):
+        self._console.write(command)
+
+    def _expect(self, patterns, timeout, cancel=None):
+        # waits for any of the patterns, shows the last output on errors
+        try:
+            return self._console.expect(patterns, timeout, cancel)
+        except (TimeoutError, EOFError) as e:
+            logger.warning("Vivado error: %s\nLast Vivado output:\n%s", e, "\n".join(f"   > {line}" for line in self._console.output(20)))
+            raise
+
+    def program(self, bitfile, cancel=None):
+        """
+        Programs the current device with the given bitstream, returns a ProgramResult
+        If Vivado fails meanwhile, it is recovered and the programming is performed again
+        """
+        if self.launcher is None: return ProgramResult('unavailable', 0, 0, "Vivado not found")
+        with self._lock:
+            self.prepare(cancel=cancel)
+
+            program = self._program_batch if VIVADO_PROGRAM_BATCH else self._program_steps
+            with tracing.span('vivado_program'):
+                try:
+                    self._connected(cancel)
+                    result = program(bitfile, cancel)
+                except (TimeoutError, EOFError):
+                    tracing.count('vivado_recoveries')
+                    self._recover(cancel)
+                    self._connected(cancel)
+                    result = program(bitfile, cancel)
+
+        if result.status != 'ok':
+            logger.warning("Unable to program the device: %s", result)
+        return result
+
+    def _program_batch(self, bitfile, cancel):
+        # single round-trip, the retries are performed by Vivado
+        self._console.skip()
+        self._run(f'fdt_program $hw_device {tcl_path(bitfile)} {VIVADO_PROGRAM_RETRY} {int(VIVADO_PROGRAM_RETRY_DELAY * 1000)} {int(VIVADO_PROGRAM_RETRY_MAX_DELAY * 1000)} {int(VIVADO_PROGRAM_RETRY_DEADLINE * 1000)}')
+        _, match = self._expect([r"\bFDT_PROGRAM (\w+) (\d+) (\d+) ?(.*)"], VIVADO_PROGRAM_RETRY_DEADLINE + VIVADO_PROGRAM_TIMEOUT, cancel)
+        return ProgramResult(match[1], int(match[2]), int(match[3]), match[4].strip())
+
+    def _program_steps(self, bitfile, cancel):
+        # one round-trip for each command and attempt
+        start = monotonic()
+        self._run(f'if {{[get_property PROGRAM.FILE $hw_device] ne {tcl_path(bitfile)}}} {{set_property PROGRAM.FILE {tcl_path(bitfile)} $hw_device}}')
         # if ila included: run("set_property PROBES.FILE {C:/design.ltx} $hw_device")
 
-        for _ in range(VIVADO_PROGRAM_RETRY):
+        attempts, status, message = 0, 'error', ""
+        for attempts in PROGRAM_RETRY:
+            if cancel is not None and cancel.is_set(): raise CancelException()
+            self._console.skip()
             self._run("program_hw_devices $hw_device")
-            result = self._waitUntil("End of startup status")
-            if 'HIGH' in result: break
-            sleep(1)
+            index, match = self._expect([r"End of startup status: (\w+)", r"\bERROR: (.*)"], VIVADO_PROGRAM_TIMEOUT, cancel)
+            if index == 0 and match[1] == 'HIGH':
+                status, message = 'ok', ""
+                break
+            status, message = ('notdone' if index == 0 else 'error'), match[0]
         else:
-            print("Unable to program the device")
+            if 0 < attempts < VIVADO_PROGRAM_RETRY:
+                status, message = 'timeout', f"Deadline reached, last error: {message}"
+        return ProgramResult(status, attempts, int((monotonic() - start) * 1000), message)
 
-    def close(self):
-        if self._instance is None: return
+    def close(self, keep_daemon=False):
+        """
+        Closes Vivado, if it runs from a daemon and 'keep_daemon' is set it is kept running for the next session
+        """
+        self._watchdog = None
+        if self._standby is not None:
+            self._standby.close()
+            self._standby = None
+        if self._hw_server is not None:
+            if os.name == 'nt':
+                # the .bat and the hw_server it launched
+                subprocess.call(['taskkill', '/T', '/F', '/PID', str(self._hw_server.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                self._hw_server.kill()
+            self._hw_server = None
+        if self._console is None: return
 
-        try:
-            print("Closing Vivado")
-            self._instance.communicate("exit", timeout=2)
-        except subprocess.TimeoutExpired:
-            print("Killing Vivado")
-            self._instance.kill()
-            self._instance.communicate()
+        if keep_daemon:
+            logger.info("Detaching from Vivado")
+            self._console.detach()
+        else:
+            logger.info("Closing Vivado")
+            self._console.close()
+        self._console = None
+        self.ready = False